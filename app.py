@@ -69,6 +69,11 @@ uploaded_file = st.file_uploader(
     type=["pdf"]
 )
 
+# --- Perfil de desempenho (opcional) ---
+# Grava um perfil (cProfile + pico de memória) desta execução em data/profiles.
+# Os perfis podem ser consultados na página "Perfis".
+gerar_perfil = st.checkbox("Gerar perfil de desempenho desta execução")
+
 # --- Botão de Ação ---
 # Possibilita iniciar o fluxo de análise e processamento de NF.
 if st.button("Executar Análise e Iniciar Fluxo"):
@@ -84,7 +89,7 @@ if st.button("Executar Análise e Iniciar Fluxo"):
                 st.write("Analisando com IA ...")
                 # Chama a função principal do orquestrador
                 # Passa o objeto de arquivo (BytesIO) diretamente
-                result_message = workflow_manager.handle_uploaded_invoice(uploaded_file)
+                result_message = workflow_manager.handle_uploaded_invoice(uploaded_file, profile=gerar_perfil or None)
                 # Exibe o resultado final
                 if "Sucesso!" in result_message:
                     st.success(result_message)
@@ -0,0 +1,237 @@
+import argparse
+from datetime import datetime, timedelta
+
+import db_manager
+import nf_status
+import blob_store
+
+# NFs finalizadas há mais de N dias saem da tabela quente
+DEFAULT_RETENTION_DAYS = 90
+
+# Quantidade máxima de linhas movidas por transação, para não segurar
+# o lock de escrita do SQLite por muito tempo
+DEFAULT_BATCH_SIZE = 500
+
+# Páginas livres devolvidas ao disco por chamada de incremental_vacuum
+VACUUM_PAGES_PER_RUN = 2000
+
+
+def _archive_table_name(timestamp_envio) -> str:
+    """'2025-10-25 14:03:00.123' -> 'ProcessamentoNF_2025_10'"""
+    ano_mes = str(timestamp_envio)[:7]
+    return f"ProcessamentoNF_{ano_mes.replace('-', '_')}"
+
+
+def _ensure_archive_table(conn, tabela: str, colunas: list):
+    """
+    Cria a tabela mensal de arquivo com as mesmas colunas do ProcessamentoNF.
+    Se o ProcessamentoNF ganhou colunas novas desde a criação, adiciona-as.
+    """
+    schema = db_manager.ARCHIVE_SCHEMA
+    definicoes = ", ".join(
+        "id INTEGER PRIMARY KEY" if nome == 'id' else f"{nome} {tipo}"
+        for nome, tipo in colunas
+    )
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {schema}.{tabela} ({definicoes})")
+
+    existentes = {row['name'] for row in conn.execute(f"PRAGMA {schema}.table_info({tabela})").fetchall()}
+    for nome, tipo in colunas:
+        if nome not in existentes:
+            conn.execute(f"ALTER TABLE {schema}.{tabela} ADD COLUMN {nome} {tipo}")
+
+
+def _ensure_archive_history_table(conn):
+    """Cria a tabela de histórico arquivado (mesmas colunas do ProcessamentoNFHistory)."""
+    schema = db_manager.ARCHIVE_SCHEMA
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {schema}.ProcessamentoNFHistory (
+            id INTEGER PRIMARY KEY,
+            processamento_id INTEGER NOT NULL,
+            status_anterior TEXT NOT NULL,
+            status_novo TEXT NOT NULL,
+            origem TEXT NOT NULL,
+            timestamp_mudanca DATETIME NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS {schema}.idx_history_arquivo_processamento "
+        f"ON ProcessamentoNFHistory (processamento_id)"
+    )
+
+
+def _incremental_vacuum_enabled(conn) -> bool:
+    return conn.execute("PRAGMA main.auto_vacuum").fetchone()[0] == 2  # 2 = INCREMENTAL
+
+
+def migrate_incremental_vacuum() -> bool:
+    """
+    Migração única (python archiver.py --migrar-vacuum): converte o banco
+    principal para auto_vacuum=INCREMENTAL. Bancos criados antes dessa
+    configuração precisam de um VACUUM completo, que reescreve o arquivo
+    inteiro e bloqueia o banco enquanto roda; execute numa janela de manutenção.
+
+    Returns:
+        True se o banco foi convertido, False se já estava em INCREMENTAL.
+    """
+    conn = db_manager.get_db_connection()
+    try:
+        if _incremental_vacuum_enabled(conn):
+            print("O banco já usa auto_vacuum=INCREMENTAL; nada a fazer.")
+            return False
+        print("Convertendo o banco para auto_vacuum=INCREMENTAL (VACUUM completo)...")
+        conn.execute("PRAGMA main.auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM main")
+        print("Conversão concluída.")
+        return True
+    finally:
+        conn.close()
+
+
+def archive_batch(conn, limite: datetime, batch_size: int = DEFAULT_BATCH_SIZE) -> list:
+    """
+    Move um lote de NFs finalizadas com timestamp_envio anterior a `limite`
+    para as tabelas mensais de arquivo, junto com o seu histórico de status.
+    Tudo em uma única transação.
+
+    Returns:
+        Lista de sqlite3.Row (id e colunas do ProcessamentoNF) das NFs
+        arquivadas; vazia quando não há mais nada a mover.
+    """
+    schema = db_manager.ARCHIVE_SCHEMA
+    finais = nf_status.FINAL_STATUSES
+    placeholders = ", ".join("?" for _ in finais)
+
+    colunas = [(row['name'], row['type']) for row in conn.execute("PRAGMA main.table_info(ProcessamentoNF)").fetchall()]
+    nomes_colunas = ", ".join(nome for nome, _ in colunas)
+
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+
+        linhas = conn.execute(
+            f"""
+            SELECT * FROM main.ProcessamentoNF
+            WHERE status IN ({placeholders}) AND timestamp_envio < ?
+            ORDER BY timestamp_envio
+            LIMIT ?
+            """,
+            (*finais, limite, batch_size)
+        ).fetchall()
+
+        if not linhas:
+            conn.rollback()
+            return []
+
+        # Agrupa os ids pelo mês de envio (uma tabela de arquivo por mês)
+        por_tabela = {}
+        for linha in linhas:
+            por_tabela.setdefault(_archive_table_name(linha['timestamp_envio']), []).append(linha['id'])
+
+        _ensure_archive_history_table(conn)
+        for tabela, ids in por_tabela.items():
+            _ensure_archive_table(conn, tabela, colunas)
+            ids_placeholders = ", ".join("?" for _ in ids)
+            conn.execute(
+                f"""
+                INSERT INTO {schema}.{tabela} ({nomes_colunas})
+                SELECT {nomes_colunas} FROM main.ProcessamentoNF WHERE id IN ({ids_placeholders})
+                """,
+                ids
+            )
+
+        todos_ids = [linha['id'] for linha in linhas]
+        ids_placeholders = ", ".join("?" for _ in todos_ids)
+        conn.execute(
+            f"""
+            INSERT INTO {schema}.ProcessamentoNFHistory
+            SELECT * FROM main.ProcessamentoNFHistory WHERE processamento_id IN ({ids_placeholders})
+            """,
+            todos_ids
+        )
+        conn.execute(f"DELETE FROM main.ProcessamentoNFHistory WHERE processamento_id IN ({ids_placeholders})", todos_ids)
+        conn.execute(f"DELETE FROM main.ProcessamentoNF WHERE id IN ({ids_placeholders})", todos_ids)
+
+        conn.commit()
+        return linhas
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def collect_pdf_garbage(keep_archived: bool = True) -> int:
+    """
+    Remove do blob_store os PDFs que nenhuma NF referencia mais.
+    Com `keep_archived=False`, os PDFs das NFs arquivadas também são descartados
+    (só os das NFs ainda na tabela quente são mantidos).
+    """
+    referenciados = db_manager.get_referenced_pdf_hashes(include_archive=keep_archived)
+    removidos = blob_store.collect_garbage(referenciados)
+    print(f"Coleta de PDFs concluída: {removidos} arquivo(s) removido(s) do blob store.")
+    return removidos
+
+
+def run_archival(dias: int = DEFAULT_RETENTION_DAYS, batch_size: int = DEFAULT_BATCH_SIZE, max_batches: int = None,
+                 keep_archived_pdfs: bool = True) -> int:
+    """
+    Job de arquivamento: move as NFs finalizadas (APPROVED, REJECTED, TIMEOUT)
+    com mais de `dias` dias para o banco de arquivo, em lotes limitados,
+    e depois executa um incremental_vacuum no banco principal (se já
+    convertido por migrate_incremental_vacuum).
+
+    A tabela quente (ProcessamentoNF) fica só com as NFs recentes e pendentes,
+    que são as que o scheduler e os links realmente consultam.
+    Ao final, faz a coleta de lixo dos PDFs no blob_store.
+
+    Returns:
+        O número de NFs arquivadas.
+    """
+    limite = datetime.now() - timedelta(days=dias)
+    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Arquivando NFs finalizadas anteriores a {limite:%Y-%m-%d}...")
+
+    conn = db_manager.get_db_connection_with_archive()
+    total = 0
+    lotes = 0
+    try:
+        while max_batches is None or lotes < max_batches:
+            arquivadas = archive_batch(conn, limite, batch_size)
+            if not arquivadas:
+                break
+            total += len(arquivadas)
+            lotes += 1
+            print(f"  -> Lote {lotes}: {len(arquivadas)} NFs arquivadas.")
+
+        if total and _incremental_vacuum_enabled(conn):
+            # Cada passo do PRAGMA libera uma página; fetchall() executa até o fim
+            conn.execute(f"PRAGMA main.incremental_vacuum({VACUUM_PAGES_PER_RUN})").fetchall()
+        elif total:
+            # As páginas livres são reaproveitadas, mas o arquivo não diminui
+            print("Aviso: o banco não usa auto_vacuum=INCREMENTAL; execute uma vez "
+                  "'python archiver.py --migrar-vacuum' para devolver o espaço ao disco.")
+        print(f"Arquivamento concluído: {total} NFs movidas em {lotes} lote(s).")
+    finally:
+        conn.close()
+
+    collect_pdf_garbage(keep_archived=keep_archived_pdfs)
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Arquiva NFs finalizadas antigas do ProcessamentoNF.")
+    parser.add_argument("--dias", type=int, default=DEFAULT_RETENTION_DAYS,
+                        help=f"Idade mínima (em dias) das NFs finalizadas a arquivar (padrão: {DEFAULT_RETENTION_DAYS}).")
+    parser.add_argument("--lote", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Máximo de NFs por transação (padrão: {DEFAULT_BATCH_SIZE}).")
+    parser.add_argument("--max-lotes", type=int, default=None,
+                        help="Interrompe após este número de lotes (padrão: sem limite).")
+    parser.add_argument("--descartar-pdfs-arquivados", action="store_true",
+                        help="Remove do blob store os PDFs das NFs arquivadas (por padrão são mantidos).")
+    parser.add_argument("--migrar-vacuum", action="store_true",
+                        help="Apenas converte o banco para auto_vacuum=INCREMENTAL (VACUUM completo, uma única vez).")
+    args = parser.parse_args()
+
+    if args.migrar_vacuum:
+        migrate_incremental_vacuum()
+    else:
+        run_archival(dias=args.dias, batch_size=args.lote, max_batches=args.max_lotes,
+                     keep_archived_pdfs=not args.descartar_pdfs_arquivados)
@@ -0,0 +1,342 @@
+import argparse
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import db_manager
+import nf_status
+
+# Linhas lidas do banco por vez (limita a memória usada pela auditoria)
+DEFAULT_CHUNK_SIZE = 50000
+
+# Diferença máxima (R$) aceita entre o valor da NF e o valor do pedido
+DEFAULT_AMOUNT_TOLERANCE = 0.01
+
+# NFs pendentes há mais que isto são consideradas paradas
+STALE_PENDING_HOURS = 48
+
+# Faixas (em horas) da distribuição do tempo de resposta dos solicitantes
+RESPONSE_TIME_BINS_HOURS = [0, 1, 4, 8, 24, 48, 72, np.inf]
+
+REPORT_DIR = os.path.join("data", "relatorios")
+
+# Colunas (e tipos, em aliases do Arrow) de cada seção do relatório. O esquema
+# Parquet é montado daqui, e não inferido do primeiro bloco: uma coluna toda
+# vazia nesse bloco seria tipada como null e os blocos seguintes falhariam.
+REPORT_SECTIONS = {
+    "divergencias_valor": [
+        ("id", "int64"), ("numero_nf", "string"), ("fornecedor_nf", "string"), ("valor_nf", "float64"),
+        ("numero_pedido", "string"), ("valor_pedido", "float64"), ("diferenca", "float64"),
+        ("centro_de_custos", "string"), ("status", "string"), ("timestamp_envio", "timestamp[ns]"),
+    ],
+    "pendentes_antigos": [
+        ("id", "int64"), ("numero_nf", "string"), ("fornecedor_nf", "string"), ("valor_nf", "float64"),
+        ("numero_pedido", "string"), ("centro_de_custos", "string"), ("solicitante_nome", "string"),
+        ("timestamp_envio", "timestamp[ns]"),
+    ],
+    "duplicidades": [
+        ("chave_duplicidade", "string"), ("id", "int64"), ("fornecedor_nf", "string"), ("numero_nf", "string"),
+        ("valor_nf", "float64"), ("numero_pedido", "string"), ("status", "string"),
+        ("timestamp_envio", "timestamp[ns]"),
+    ],
+    "tempo_resposta_solicitantes": [
+        ("solicitante_id", "int64"), ("solicitante_nome", "string"), ("respostas", "int64"),
+        ("media_horas", "float64"), ("min_horas", "float64"), ("max_horas", "float64"),
+    ],
+    "tempo_resposta_distribuicao": [
+        ("faixa", "string"), ("respostas", "int64"),
+    ],
+}
+
+# Chave de duplicidade: fornecedor em minúsculas, sem espaços nas pontas e com
+# espaços repetidos reduzidos a um (até 8 seguidos), + número da NF sem zeros
+# à esquerda. Calculada pelo próprio SQLite, sem função Python por linha.
+_DUPLICATE_KEY_SQL = (
+    "replace(replace(replace(lower(trim(coalesce(fornecedor_nf, ''))), '  ', ' '), '  ', ' '), '  ', ' ')"
+    " || '|' || ltrim(trim(coalesce(numero_nf, '')), '0')"
+)
+
+
+def _section_schema(name: str):
+    import pyarrow as pa
+
+    return pa.schema([(coluna, pa.type_for_alias(tipo)) for coluna, tipo in REPORT_SECTIONS[name]])
+
+
+class ReportWriter:
+    """
+    Grava cada seção do relatório em um arquivo CSV ou Parquet, bloco a bloco,
+    sem manter as linhas já gravadas na memória. As colunas de cada seção vêm
+    de REPORT_SECTIONS.
+    """
+
+    def __init__(self, output_dir: str, fmt: str = "csv"):
+        if fmt not in ("csv", "parquet"):
+            raise ValueError(f"Formato de relatório desconhecido: '{fmt}' (use csv ou parquet).")
+        if fmt == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ImportError("O formato parquet requer o pacote 'pyarrow' (pip install pyarrow).")
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self._writers = {}
+        self.counts = {}
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.output_dir, f"{name}.{self.fmt}")
+
+    def write(self, name: str, df: pd.DataFrame):
+        df = df[[coluna for coluna, _ in REPORT_SECTIONS[name]]]
+        self.counts[name] = self.counts.get(name, 0) + len(df)
+        if self.fmt == "csv":
+            primeiro = name not in self._writers
+            df.to_csv(self.path(name), mode="w" if primeiro else "a", header=primeiro, index=False)
+            self._writers[name] = True
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = self._writers.get(name)
+        if writer is None:
+            writer = pq.ParquetWriter(self.path(name), _section_schema(name))
+            self._writers[name] = writer
+        writer.write_table(pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False))
+
+    def close(self):
+        if self.fmt == "parquet":
+            for writer in self._writers.values():
+                writer.close()
+
+
+def _month_bounds(mes: str):
+    """'2025-10' -> (datetime(2025, 10, 1), datetime(2025, 11, 1))"""
+    inicio = datetime.strptime(mes, "%Y-%m")
+    fim = (inicio + timedelta(days=32)).replace(day=1)
+    return inicio, fim
+
+
+def _sources(conn) -> list:
+    """
+    Pares (tabela de NFs, tabela de histórico) a auditar: a tabela quente e
+    cada tabela mensal de arquivo (ver archiver.py).
+    """
+    fontes = [("main.ProcessamentoNF", "main.ProcessamentoNFHistory")]
+    schema = db_manager.ARCHIVE_SCHEMA
+    tem_historico_arquivado = conn.execute(
+        f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'ProcessamentoNFHistory'"
+    ).fetchone()
+    historico = f"{schema}.ProcessamentoNFHistory" if tem_historico_arquivado else None
+    for tabela in db_manager.get_archive_tables(conn):
+        fontes.append((f"{schema}.{tabela}", historico))
+    return fontes
+
+
+def _source_filter(periodo):
+    """Filtro de período (timestamp_envio) e seus parâmetros."""
+    if not periodo:
+        return "", []
+    return "AND timestamp_envio >= ? AND timestamp_envio < ?", [d.strftime("%Y-%m-%d %H:%M:%S") for d in periodo]
+
+
+def _iter_invoice_chunks(conn, periodo, chunk_size: int):
+    """
+    Lê as NFs de todas as fontes em blocos, por paginação na chave primária
+    (sem ORDER BY sobre a view inteira). Gera (tabela_historico, DataFrame).
+
+    valor_nf é convertido para número; valores não numéricos viram NaN e são
+    marcados na coluna valor_nf_invalido.
+    """
+    filtro, params = _source_filter(periodo)
+
+    for tabela, historico in _sources(conn):
+        ultimo_id = 0
+        while True:
+            df = pd.read_sql_query(
+                f"""
+                SELECT id, numero_nf, fornecedor_nf, valor_nf, pedido_id, status, timestamp_envio
+                FROM {tabela}
+                WHERE id > ? {filtro}
+                ORDER BY id
+                LIMIT ?
+                """,
+                conn,
+                params=[ultimo_id, *params, chunk_size]
+            )
+            if df.empty:
+                break
+            ultimo_id = int(df["id"].iloc[-1])
+            df["timestamp_envio"] = pd.to_datetime(df["timestamp_envio"], format="ISO8601", errors="coerce")
+            valor = pd.to_numeric(df["valor_nf"], errors="coerce")
+            df["valor_nf_invalido"] = valor.isna() & df["valor_nf"].notna()
+            df["valor_nf"] = valor
+            yield historico, df
+
+
+def _iter_duplicates(conn, periodo, chunk_size: int):
+    """
+    NFs (de todas as fontes) cuja chave de duplicidade aparece mais de uma
+    vez, ordenadas pela chave, em blocos de `chunk_size` linhas.
+
+    A chave (ver _DUPLICATE_KEY_SQL), o agrupamento (GROUP BY ... HAVING) e
+    a ordenação são feitos pelo SQLite, que usa arquivos temporários quando
+    não cabem no cache, então a memória do processo não cresce com o número
+    de NFs.
+    """
+    filtro, params = _source_filter(periodo)
+    selects, todos_params = [], []
+    for tabela, _ in _sources(conn):
+        selects.append(
+            f"""
+            SELECT {_DUPLICATE_KEY_SQL} as chave_duplicidade,
+                   id, fornecedor_nf, numero_nf, valor_nf, pedido_id, status, timestamp_envio
+            FROM {tabela}
+            WHERE 1 = 1 {filtro}
+            """
+        )
+        todos_params.extend(params)
+
+    consulta = f"""
+        WITH nfs AS ({' UNION ALL '.join(selects)})
+        SELECT * FROM nfs
+        WHERE chave_duplicidade IN (
+            SELECT chave_duplicidade FROM nfs GROUP BY chave_duplicidade HAVING COUNT(*) > 1
+        )
+        ORDER BY chave_duplicidade, id
+    """
+    for df in pd.read_sql_query(consulta, conn, params=todos_params, chunksize=chunk_size):
+        df["timestamp_envio"] = pd.to_datetime(df["timestamp_envio"], format="ISO8601", errors="coerce")
+        df["valor_nf"] = pd.to_numeric(df["valor_nf"], errors="coerce")
+        yield df
+
+
+def run_audit(output_dir: str = None, fmt: str = "csv", mes: str = None,
+              chunk_size: int = DEFAULT_CHUNK_SIZE, tolerance: float = DEFAULT_AMOUNT_TOLERANCE) -> dict:
+    """
+    Auditoria de conciliação sobre todas as NFs (quentes e arquivadas) e pedidos.
+
+    Seções geradas (um arquivo cada):
+      - divergencias_valor: NFs cujo valor difere do valor do pedido (ou não é numérico).
+      - duplicidades: NFs com o mesmo fornecedor e número de NF.
+      - pendentes_antigos: NFs pendentes há mais de 48 horas.
+      - tempo_resposta_solicitantes: estatísticas do tempo de resposta por solicitante.
+      - tempo_resposta_distribuicao: histograma do tempo de resposta.
+
+    As NFs são lidas em blocos de `chunk_size` linhas e os cálculos são feitos
+    com joins e group-bys vetorizados (pandas/NumPy). Entre os blocos ficam na
+    memória apenas os agregados por solicitante e o histograma; as duplicidades
+    são agrupadas pelo SQLite (ver _iter_duplicates).
+
+    Returns:
+        Dicionário {seção: número de linhas gravadas}.
+    """
+    if output_dir is None:
+        output_dir = os.path.join(REPORT_DIR, f"auditoria_{mes or 'completa'}_{datetime.now():%Y%m%d_%H%M%S}")
+    periodo = _month_bounds(mes) if mes else None
+    limite_pendente = pd.Timestamp(datetime.now() - timedelta(hours=STALE_PENDING_HOURS))
+
+    writer = ReportWriter(output_dir, fmt)
+    conn = db_manager.get_db_connection_with_archive()
+    print(f"Iniciando auditoria ({mes or 'todo o histórico'}). Relatório em: {output_dir}")
+
+    try:
+        # Pedidos e solicitantes: tabelas cadastrais, pequenas o bastante para a memória
+        pedidos = pd.read_sql_query(
+            """
+            SELECT cp.id as pedido_id, cp.numero_pedido, cp.valor as valor_pedido, cp.centro_de_custos,
+                   s.id as solicitante_id, s.nome as solicitante_nome
+            FROM ControleDePedidos cp
+            JOIN Solicitantes s ON cp.solicitante_id = s.id
+            """,
+            conn
+        )
+        pedidos["valor_pedido"] = pd.to_numeric(pedidos["valor_pedido"], errors="coerce")
+
+        histograma = np.zeros(len(RESPONSE_TIME_BINS_HOURS) - 1, dtype=np.int64)
+        por_solicitante = None
+
+        # --- Divergências, pendentes e tempos de resposta ---
+        for historico, chunk in _iter_invoice_chunks(conn, periodo, chunk_size):
+            df = chunk.merge(pedidos, on="pedido_id", how="left")
+
+            diferenca = (df["valor_nf"] - df["valor_pedido"]).abs()
+            divergentes = df.loc[(diferenca > tolerance) | df["valor_nf_invalido"]].assign(diferenca=diferenca)
+            if not divergentes.empty:
+                writer.write("divergencias_valor", divergentes)
+
+            parados = df.loc[(df["status"] == nf_status.PENDING_VALIDATION) & (df["timestamp_envio"] < limite_pendente)]
+            if not parados.empty:
+                writer.write("pendentes_antigos", parados)
+
+            # Tempo de resposta: respostas dadas pelo link (aprovação/rejeição)
+            if historico:
+                hist = pd.read_sql_query(
+                    f"""
+                    SELECT processamento_id as id, timestamp_mudanca
+                    FROM {historico}
+                    WHERE processamento_id BETWEEN ? AND ? AND origem = 'link'
+                    """,
+                    conn,
+                    params=[int(df["id"].min()), int(df["id"].max())]
+                )
+                if not hist.empty:
+                    hist["timestamp_mudanca"] = pd.to_datetime(hist["timestamp_mudanca"], format="ISO8601", errors="coerce")
+                    respostas = df[["id", "solicitante_id", "solicitante_nome", "timestamp_envio"]].merge(hist, on="id")
+                    horas = (respostas["timestamp_mudanca"] - respostas["timestamp_envio"]).dt.total_seconds() / 3600
+                    respostas = respostas.assign(horas=horas).dropna(subset=["horas"])
+
+                    histograma += np.histogram(respostas["horas"], bins=RESPONSE_TIME_BINS_HOURS)[0]
+                    parcial = respostas.groupby(["solicitante_id", "solicitante_nome"])["horas"].agg(
+                        respostas="count", soma_horas="sum", max_horas="max", min_horas="min"
+                    )
+                    if por_solicitante is None:
+                        por_solicitante = parcial
+                    else:
+                        combinado = pd.concat([por_solicitante, parcial])
+                        por_solicitante = combinado.groupby(level=[0, 1]).agg(
+                            respostas=("respostas", "sum"), soma_horas=("soma_horas", "sum"),
+                            max_horas=("max_horas", "max"), min_horas=("min_horas", "min")
+                        )
+
+        # --- NFs com o mesmo fornecedor e número de NF ---
+        for duplicadas in _iter_duplicates(conn, periodo, chunk_size):
+            duplicadas = duplicadas.merge(pedidos[["pedido_id", "numero_pedido"]], on="pedido_id", how="left")
+            writer.write("duplicidades", duplicadas)
+
+        # --- Agregados de tempo de resposta ---
+        if por_solicitante is not None and not por_solicitante.empty:
+            resumo = por_solicitante.reset_index()
+            resumo["media_horas"] = resumo["soma_horas"] / resumo["respostas"]
+            writer.write("tempo_resposta_solicitantes", resumo.sort_values("media_horas", ascending=False))
+
+        rotulos = [
+            f"{int(RESPONSE_TIME_BINS_HOURS[i])}h-{'' if np.isinf(RESPONSE_TIME_BINS_HOURS[i + 1]) else int(RESPONSE_TIME_BINS_HOURS[i + 1])}h"
+            for i in range(len(histograma))
+        ]
+        writer.write("tempo_resposta_distribuicao", pd.DataFrame({"faixa": rotulos, "respostas": histograma}))
+    finally:
+        writer.close()
+        conn.close()
+
+    for secao, linhas in writer.counts.items():
+        print(f"  -> {secao}: {linhas} linha(s)")
+    print("Auditoria concluída.")
+    return writer.counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Auditoria de conciliação entre NFs e pedidos.")
+    parser.add_argument("--mes", default=None, help="Mês a auditar (AAAA-MM). Se omitido, audita todo o histórico.")
+    parser.add_argument("--formato", choices=["csv", "parquet"], default="csv", help="Formato dos arquivos do relatório.")
+    parser.add_argument("--saida", default=None, help="Diretório do relatório (padrão: data/relatorios/auditoria_<mes>_<data>).")
+    parser.add_argument("--bloco", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Linhas lidas por vez (padrão: {DEFAULT_CHUNK_SIZE}).")
+    parser.add_argument("--tolerancia", type=float, default=DEFAULT_AMOUNT_TOLERANCE,
+                        help=f"Diferença máxima aceita entre NF e pedido, em R$ (padrão: {DEFAULT_AMOUNT_TOLERANCE}).")
+    args = parser.parse_args()
+
+    run_audit(output_dir=args.saida, fmt=args.formato, mes=args.mes, chunk_size=args.bloco, tolerance=args.tolerancia)
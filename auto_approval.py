@@ -0,0 +1,123 @@
+import json
+import os
+import unicodedata
+from dotenv import load_dotenv
+
+# Carrega as variáveis de ambiente (AUTO_APPROVAL_RULES_FILE) do arquivo .env
+load_dotenv()
+
+# Arquivo JSON com as regras de aprovação automática.
+# Veja regras_aprovacao.example.json. Sem o arquivo, a aprovação automática fica desligada.
+RULES_FILE = os.getenv("AUTO_APPROVAL_RULES_FILE", "regras_aprovacao.json")
+
+# Cache das regras: (mtime do arquivo, regras)
+_rules_cache = (None, None)
+
+
+def load_rules() -> dict:
+    """
+    Lê o arquivo de regras, recarregando-o apenas quando ele é modificado.
+    Retorna {} se o arquivo não existir ou for inválido.
+    """
+    global _rules_cache
+    try:
+        mtime = os.path.getmtime(RULES_FILE)
+    except OSError:
+        return {}
+
+    if _rules_cache[0] != mtime:
+        try:
+            with open(RULES_FILE, encoding="utf-8") as f:
+                _rules_cache = (mtime, json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Erro ao ler as regras de aprovação automática '{RULES_FILE}': {e}")
+            _rules_cache = (mtime, {})
+    return _rules_cache[1]
+
+
+def _normalize_name(nome) -> str:
+    """Nome de fornecedor sem acentos, sem diferença de maiúsculas e com espaços simples."""
+    sem_acentos = unicodedata.normalize("NFKD", str(nome or "")).encode("ascii", "ignore").decode("ascii")
+    return " ".join(sem_acentos.casefold().split())
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# --- Regras ---
+# Cada regra recebe (configuração, nf_data, pedido_data) e retorna (passou, detalhe).
+
+def _rule_amount_tolerance(config: dict, nf_data, pedido_data) -> tuple:
+    valor_nf = _to_float(nf_data.get('valor_nf'))
+    valor_pedido = _to_float(pedido_data['valor_pedido'])
+    if valor_nf is None or valor_pedido is None:
+        return False, "Valor da NF ou do pedido ausente."
+
+    diferenca = abs(valor_nf - valor_pedido)
+    permitido = max(float(config.get('absoluta', 0)), valor_pedido * float(config.get('percentual', 0)) / 100)
+    detalhe = f"Diferença R$ {diferenca:.2f} (permitido R$ {permitido:.2f})."
+    return diferenca <= permitido + 1e-9, detalhe
+
+
+def _rule_cost_center_limit(config: dict, nf_data, pedido_data) -> tuple:
+    centro = pedido_data['centro_de_custos']
+    limite = config.get(centro, config.get('*'))
+    if limite is None:
+        return False, f"Centro de custos '{centro}' sem limite configurado."
+
+    valor_nf = _to_float(nf_data.get('valor_nf'))
+    if valor_nf is None:
+        return False, "Valor da NF ausente."
+    return valor_nf <= float(limite), f"Valor R$ {valor_nf:.2f} (limite de '{centro}': R$ {float(limite):.2f})."
+
+
+def _rule_supplier_allowlist(config: list, nf_data, pedido_data) -> tuple:
+    fornecedor = nf_data.get('fornecedor_nf')
+    confiaveis = {_normalize_name(nome) for nome in config}
+    return _normalize_name(fornecedor) in confiaveis, f"Fornecedor '{fornecedor}'."
+
+
+# Chave no arquivo de regras -> função da regra
+RULES = {
+    'tolerancia_valor': _rule_amount_tolerance,
+    'limite_por_centro_de_custos': _rule_cost_center_limit,
+    'fornecedores_confiaveis': _rule_supplier_allowlist,
+}
+
+
+def evaluate(nf_data, pedido_data, rules: dict = None) -> tuple:
+    """
+    Avalia as regras configuradas para uma NF já associada ao seu pedido.
+
+    A NF é aprovada automaticamente somente se a aprovação automática estiver
+    ativa, houver ao menos uma regra configurada e TODAS passarem.
+
+    Args:
+        nf_data: Dados extraídos pela IA (dict).
+        pedido_data: Resultado de db_manager.get_order_details_by_number.
+        rules: Regras a usar (padrão: as do arquivo RULES_FILE).
+
+    Returns:
+        Uma tupla (aprovar, resultados), onde resultados é uma lista de
+        (regra, passou, detalhe) — uma entrada por regra avaliada.
+    """
+    rules = load_rules() if rules is None else rules
+    if not rules.get('ativo'):
+        return False, []
+
+    resultados = []
+    for nome, regra in RULES.items():
+        if nome not in rules:
+            continue
+        try:
+            passou, detalhe = regra(rules[nome], nf_data, pedido_data)
+        except Exception as e:
+            passou, detalhe = False, f"Erro ao avaliar a regra: {e}"
+        resultados.append((nome, passou, detalhe))
+
+    aprovar = bool(resultados) and all(passou for _, passou, _ in resultados)
+    return aprovar, resultados
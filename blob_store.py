@@ -0,0 +1,116 @@
+import gzip
+import hashlib
+import os
+import tempfile
+import time
+
+# Diretório raiz do armazenamento de PDFs (endereçado por conteúdo)
+BLOB_DIR = os.path.join("data", "blobs")
+
+# Comprime os PDFs com gzip ao gravar (PDFs de NF costumam ter bastante texto)
+COMPRESS_BLOBS = os.getenv("BLOB_COMPRESS", "1") != "0"
+
+# Tamanho dos blocos de leitura/escrita em streaming
+CHUNK_SIZE = 64 * 1024
+
+# Blobs mais novos que isto nunca são coletados, pois o upload pode ainda
+# não ter gravado a linha correspondente no ProcessamentoNF
+GC_GRACE_SECONDS = 3600
+
+
+def _blob_paths(blob_hash: str) -> tuple:
+    """
+    Caminhos possíveis de um blob (comprimido e não comprimido).
+    Os blobs são distribuídos em subdiretórios pelos 4 primeiros caracteres
+    do hash (ab/cd/abcd...), para não concentrar milhares de arquivos numa pasta.
+    """
+    base = os.path.join(BLOB_DIR, blob_hash[:2], blob_hash[2:4], blob_hash)
+    return f"{base}.pdf.gz", f"{base}.pdf"
+
+
+def _find_blob(blob_hash: str):
+    for path in _blob_paths(blob_hash):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def put(data: bytes, compress: bool = None) -> str:
+    """
+    Grava o conteúdo no armazenamento e retorna o seu hash SHA-256.
+    PDFs idênticos têm o mesmo hash e são armazenados uma única vez.
+    """
+    blob_hash = hashlib.sha256(data).hexdigest()
+    existente = _find_blob(blob_hash)
+    if existente:
+        # Renova o mtime: o blob volta a ficar protegido pelo GC_GRACE_SECONDS
+        # até o novo upload registrar a sua linha no ProcessamentoNF
+        try:
+            os.utime(existente)
+            return blob_hash
+        except FileNotFoundError:
+            pass  # Coletado entre a busca e o utime: grava de novo
+
+    compress = COMPRESS_BLOBS if compress is None else compress
+    path_gz, path_raw = _blob_paths(blob_hash)
+    path = path_gz if compress else path_raw
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Grava num arquivo temporário e renomeia: nunca há blobs parciais
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if compress:
+                with gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as gz:
+                    gz.write(data)
+            else:
+                f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return blob_hash
+
+
+def exists(blob_hash: str) -> bool:
+    return _find_blob(blob_hash) is not None
+
+
+def open_blob(blob_hash: str):
+    """
+    Abre um blob para leitura em streaming (descomprimindo se necessário).
+    Deve ser usado com `with`. Lança FileNotFoundError se não existir.
+    """
+    path = _find_blob(blob_hash)
+    if path is None:
+        raise FileNotFoundError(f"Blob '{blob_hash}' não encontrado em '{BLOB_DIR}'.")
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def collect_garbage(referenced_hashes: set, grace_seconds: int = GC_GRACE_SECONDS) -> int:
+    """
+    Remove os blobs que não estão em `referenced_hashes` e que são mais
+    antigos que `grace_seconds`. Também limpa temporários abandonados.
+
+    Returns:
+        O número de arquivos removidos.
+    """
+    if not os.path.isdir(BLOB_DIR):
+        return 0
+
+    limite = time.time() - grace_seconds
+    removidos = 0
+    for raiz, _, arquivos in os.walk(BLOB_DIR):
+        for nome in arquivos:
+            path = os.path.join(raiz, nome)
+            blob_hash = nome.split(".", 1)[0]
+            if blob_hash in referenced_hashes and not nome.endswith(".tmp"):
+                continue
+            try:
+                if os.path.getmtime(path) < limite:
+                    os.remove(path)
+                    removidos += 1
+            except FileNotFoundError:
+                continue
+    return removidos
@@ -1,10 +1,22 @@
 import sqlite3
 import os
-from datetime import datetime
+import re
+import threading
+import unicodedata
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import nf_status
 
 # Define o caminho para o arquivo do banco de dados dentro da pasta /data
 DB_FILE = os.path.join("data", "pedidos.db")
 
+# Banco "frio" com as NFs finalizadas movidas pelo archiver.py,
+# em tabelas mensais (ProcessamentoNF_AAAA_MM).
+ARCHIVE_DB_FILE = os.path.join("data", "pedidos_arquivo.db")
+ARCHIVE_SCHEMA = "arquivo"
+
 def get_db_connection():
     """
     Cria e retorna uma conexão com o banco de dados SQLite.
@@ -15,11 +27,216 @@ def get_db_connection():
     conn.row_factory = sqlite3.Row
     return conn
 
-def get_order_details_by_number(numero_pedido):
+def get_archive_tables(conn):
     """
-    Busca detalhes de um pedido e do seu solicitante pelo número do pedido.
-    Utiliza um JOIN para combinar dados das tabelas ControleDePedidos e Solicitantes.
+    Lista as tabelas mensais de arquivo (ProcessamentoNF_AAAA_MM) de uma
+    conexão que já tenha o banco de arquivo anexado, em ordem cronológica.
+    """
+    cursor = conn.execute(
+        f"""
+        SELECT name FROM {ARCHIVE_SCHEMA}.sqlite_master
+        WHERE type = 'table' AND name GLOB 'ProcessamentoNF_[0-9][0-9][0-9][0-9]_[0-9][0-9]'
+        ORDER BY name
+        """
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+def get_db_connection_with_archive():
+    """
+    Cria uma conexão com o banco principal e o banco de arquivo anexado,
+    e define a view temporária 'ProcessamentoNFTodos', que une (UNION ALL)
+    as NFs "quentes" e todas as tabelas mensais de arquivo, e a
+    'ProcessamentoNFHistoryTodos', com o histórico de status quente e arquivado.
+
+    Consultas que precisam do histórico completo devem usar essa view;
+    o fluxo normal (scheduler, links) continua usando só o ProcessamentoNF.
     """
+    conn = get_db_connection()
+    conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (ARCHIVE_DB_FILE,))
+
+    colunas = [row['name'] for row in conn.execute("PRAGMA main.table_info(ProcessamentoNF)").fetchall()]
+    selects = [f"SELECT {', '.join(colunas)} FROM main.ProcessamentoNF"]
+    for tabela in get_archive_tables(conn):
+        # Tabelas arquivadas antes de uma coluna nova existir a retornam como NULL
+        existentes = {row['name'] for row in conn.execute(f"PRAGMA {ARCHIVE_SCHEMA}.table_info({tabela})").fetchall()}
+        campos = ", ".join(c if c in existentes else f"NULL AS {c}" for c in colunas)
+        selects.append(f"SELECT {campos} FROM {ARCHIVE_SCHEMA}.{tabela}")
+
+    conn.execute(f"CREATE TEMP VIEW ProcessamentoNFTodos AS {' UNION ALL '.join(selects)}")
+
+    # Histórico de status quente + arquivado (tabela criada no primeiro arquivamento)
+    colunas_historico = "id, processamento_id, status_anterior, status_novo, origem, timestamp_mudanca"
+    historicos = [f"SELECT {colunas_historico} FROM main.ProcessamentoNFHistory"]
+    if conn.execute(
+        f"SELECT 1 FROM {ARCHIVE_SCHEMA}.sqlite_master WHERE type = 'table' AND name = 'ProcessamentoNFHistory'"
+    ).fetchone():
+        historicos.append(f"SELECT {colunas_historico} FROM {ARCHIVE_SCHEMA}.ProcessamentoNFHistory")
+    conn.execute(f"CREATE TEMP VIEW ProcessamentoNFHistoryTodos AS {' UNION ALL '.join(historicos)}")
+    return conn
+
+def query_all_processing_entries(**filtros):
+    """
+    Consulta as NFs quentes e arquivadas de forma transparente.
+
+    Args:
+        filtros: Igualdade por coluna do ProcessamentoNF, passada como
+            parâmetro da consulta (ex: numero_nf='123', status='APPROVED').
+            Sem filtros, retorna todas as NFs.
+
+    Returns:
+        Lista de sqlite3.Row, ordenada por id.
+
+    Raises:
+        ValueError: Se algum filtro não for uma coluna do ProcessamentoNF.
+    """
+    conn = get_db_connection_with_archive()
+    try:
+        colunas = {row['name'] for row in conn.execute("PRAGMA main.table_info(ProcessamentoNF)").fetchall()}
+        desconhecidas = sorted(set(filtros) - colunas)
+        if desconhecidas:
+            raise ValueError(f"Colunas desconhecidas no filtro: {', '.join(desconhecidas)}")
+
+        condicao = " AND ".join(f"{coluna} = ?" for coluna in filtros) or "1 = 1"
+        cursor = conn.execute(
+            f"SELECT * FROM ProcessamentoNFTodos WHERE {condicao} ORDER BY id",
+            tuple(filtros.values())
+        )
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+def compress_text(text):
+    """Comprime o texto extraído de um PDF para armazenamento (zlib)."""
+    if not text:
+        return None
+    return zlib.compress(text.encode("utf-8"), 9)
+
+def decompress_text(data):
+    """Inverso de compress_text."""
+    if not data:
+        return ""
+    return zlib.decompress(data).decode("utf-8")
+
+def _to_amount(valor_nf, default=0.0):
+    """
+    Converte o valor da NF (vindo da extração, pode ser texto) para float.
+    Valores ausentes ou não numéricos viram `default`, com um aviso. Nos
+    totais o padrão 0 garante que a entrada e a saída de um status sempre
+    usem o mesmo valor; nas exportações usa-se None (valor desconhecido).
+    """
+    if valor_nf is None or valor_nf == '':
+        return default
+    try:
+        return float(valor_nf)
+    except (TypeError, ValueError):
+        print(f"Aviso: valor da NF não numérico ({valor_nf!r}); usando {default}.")
+        return default
+
+# Número máximo de pedidos guardados no cache de get_order_details_by_number
+ORDER_CACHE_SIZE = 1024
+
+
+class _OrderLookupCache:
+    """
+    Cache LRU (em memória, por processo) das consultas de pedido + solicitante,
+    incluindo as consultas sem resultado (cache negativo).
+
+    Invalidação, verificada antes de cada consulta:
+      1. `PRAGMA data_version` em uma conexão própria e persistente: só muda
+         quando OUTRA conexão (de qualquer processo) grava no banco, então, se
+         não mudou, nada foi alterado e nenhuma consulta é feita.
+      2. Se mudou, lê o contador da tabela VersaoCadastro, que os triggers
+         incrementam apenas em mudanças de ControleDePedidos/Solicitantes.
+         Gravações em outras tabelas (ex: cada NF registrada) não esvaziam o cache.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._data_version = None
+        self._versao_cadastro = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _current_versions(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return data_version, self._versao_cadastro
+        try:
+            row = self._conn.execute("SELECT versao FROM VersaoCadastro WHERE id = 1").fetchone()
+            versao_cadastro = row[0] if row else None
+        except sqlite3.OperationalError:
+            # Banco sem a tabela (setup_db.py antigo): qualquer gravação invalida o cache
+            versao_cadastro = ('data_version', data_version)
+        return data_version, versao_cadastro
+
+    def _validate(self):
+        try:
+            data_version, versao_cadastro = self._current_versions()
+        except sqlite3.Error as e:
+            print(f"Erro ao verificar a versão do cadastro de pedidos: {e}")
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            data_version, versao_cadastro = None, None
+        if versao_cadastro is None or versao_cadastro != self._versao_cadastro:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+        self._data_version, self._versao_cadastro = data_version, versao_cadastro
+
+    def get(self, numero_pedido, loader):
+        with self._lock:
+            self._validate()
+            if numero_pedido in self._entries:
+                self._entries.move_to_end(numero_pedido)
+                self.hits += 1
+                return self._entries[numero_pedido]
+            self.misses += 1
+
+        valor = loader(numero_pedido)
+
+        with self._lock:
+            # Só guarda o resultado se o cadastro era verificável (ver _validate)
+            if self._versao_cadastro is not None:
+                self._entries[numero_pedido] = valor
+                self._entries.move_to_end(numero_pedido)
+                if len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return valor
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versao_cadastro = None
+            self._data_version = None
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                'consultas': consultas,
+                'acertos': self.hits,
+                'falhas': self.misses,
+                'taxa_acerto': self.hits / consultas if consultas else 0.0,
+                'invalidacoes': self.invalidations,
+                'tamanho': len(self._entries),
+                'negativos': sum(1 for valor in self._entries.values() if valor is None),
+            }
+
+
+_order_cache = _OrderLookupCache(ORDER_CACHE_SIZE)
+
+
+def _query_order_details(numero_pedido):
     conn = get_db_connection()
     cursor = conn.cursor()
     
@@ -44,20 +261,46 @@ def get_order_details_by_number(numero_pedido):
     conn.close()
     return pedido_data
 
-def create_processing_entry(nf_data, pedido_id, token):
+def get_order_details_by_number(numero_pedido):
+    """
+    Busca detalhes de um pedido e do seu solicitante pelo número do pedido.
+    Utiliza um JOIN para combinar dados das tabelas ControleDePedidos e Solicitantes.
+
+    O resultado (inclusive "pedido inexistente") fica em um cache LRU,
+    invalidado quando ControleDePedidos ou Solicitantes mudam, mesmo que por
+    outro processo. Veja get_order_cache_stats().
+    """
+    return _order_cache.get(numero_pedido, _query_order_details)
+
+def get_order_cache_stats() -> dict:
+    """Estatísticas do cache de pedidos: consultas, acertos, falhas, taxa_acerto, invalidacoes, tamanho, negativos."""
+    return _order_cache.stats()
+
+def clear_order_cache():
+    """Esvazia o cache de pedidos e fecha a sua conexão (ex: depois de recriar o banco)."""
+    _order_cache.clear()
+
+def create_processing_entry(nf_data, pedido_id, token, pdf_hash=None, pdf_text=None):
     """
     Registra uma nova Nota Fiscal em processamento na tabela ProcessamentoNF.
     Define o status inicial como 'PENDING_VALIDATION' e grava o timestamp.
+    `pdf_hash` é a chave do PDF original no blob_store.
+    `pdf_text` é guardado comprimido (zlib) para permitir reextrações futuras.
+    Na mesma transação, atualiza as tabelas de resumo do dashboard e o saldo
+    do pedido, e indexa `pdf_text` e os campos principais no índice de busca (FTS5).
+
+    Retorna o id (chave primária) da nova linha, ou None em caso de erro.
     """
     conn = get_db_connection()
     cursor = conn.cursor()
+    agora = datetime.now()
     
     try:
         cursor.execute(
             """
             INSERT INTO ProcessamentoNF 
-            (numero_nf, data_nf, fornecedor_nf, valor_nf, pedido_id, status, validation_token, timestamp_envio)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            (numero_nf, data_nf, fornecedor_nf, valor_nf, pedido_id, status, validation_token, timestamp_envio, pdf_hash, texto_comprimido)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
             (
                 nf_data.get('numero_nf'),
@@ -65,91 +308,889 @@ def create_processing_entry(nf_data, pedido_id, token):
                 nf_data.get('fornecedor_nf'),
                 nf_data.get('valor_nf'),
                 pedido_id,
-                'PENDING_VALIDATION',  # Status inicial
+                nf_status.PENDING_VALIDATION,  # Status inicial
                 token,
-                datetime.now()         # Timestamp atual
+                agora,                 # Timestamp atual
+                pdf_hash,
+                compress_text(pdf_text)
+            )
+        )
+        processing_id = cursor.lastrowid
+
+        pedido = cursor.execute(
+            "SELECT numero_pedido, centro_de_custos FROM ControleDePedidos WHERE id = ?", (pedido_id,)
+        ).fetchone()
+        _update_dashboard_summaries(
+            cursor, agora, None, nf_status.PENDING_VALIDATION,
+            pedido['centro_de_custos'] if pedido else None, nf_data.get('valor_nf')
+        )
+        _update_order_ledger(cursor, pedido_id, None, nf_status.PENDING_VALIDATION, nf_data.get('valor_nf'))
+
+        cursor.execute(
+            """
+            INSERT INTO ProcessamentoNFBusca (rowid, numero_nf, fornecedor_nf, numero_pedido, texto)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (
+                processing_id,
+                nf_data.get('numero_nf'),
+                nf_data.get('fornecedor_nf'),
+                pedido['numero_pedido'] if pedido else nf_data.get('numero_pedido'),
+                pdf_text or ''
             )
         )
+
         conn.commit()
+        return processing_id
     except sqlite3.Error as e:
         print(f"Erro ao inserir no ProcessamentoNF: {e}")
         conn.rollback()  # Desfaz a transação em caso de erro
+        return None
     finally:
         conn.close()
 
-def update_processing_status_by_token(token, new_status):
+def record_rule_evaluations(processing_id, resultados):
     """
-    Atualiza o status de um processamento de NF (para 'APPROVED', 'REJECTED', ou 'TIMEOUT')
-    usando o token de validação único.
-    
-    Só atualiza se o status atual for 'PENDING_VALIDATION' para evitar
-    condições de corrida (ex: usuário aprova e timeout ocorre ao mesmo tempo).
+    Grava o resultado de cada regra de aprovação automática avaliada para a NF.
+
+    Args:
+        processing_id: Chave primária do ProcessamentoNF.
+        resultados: Lista de (regra, passou, detalhe), como retornada por auto_approval.evaluate.
+    """
+    if not resultados:
+        return
+    conn = get_db_connection()
+    agora = datetime.now()
+    try:
+        conn.executemany(
+            """
+            INSERT INTO AvaliacoesRegras (processamento_id, regra, passou, detalhe, timestamp_avaliacao)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [(processing_id, regra, int(passou), detalhe, agora) for regra, passou, detalhe in resultados]
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Erro ao registrar avaliação de regras: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def claim_expired_validations(worker_id, limite_envio, batch_size=50, lease_seconds=300):
+    """
+    Reserva (lease) atomicamente um lote de NFs pendentes enviadas antes de
+    `limite_envio`, para que várias instâncias do scheduler possam rodar ao
+    mesmo tempo sem processar as mesmas linhas.
+
+    Uma linha só é reservada se estiver livre ou se o lease anterior já
+    expirou (ex: a instância que a reservou caiu). A transição de status
+    (transition_status) libera o lease.
+
+    Args:
+        worker_id: Identificador único da instância (ex: host:pid).
+        limite_envio: datetime; só NFs com timestamp_envio anterior são reservadas.
+        batch_size: Máximo de NFs reservadas por chamada.
+        lease_seconds: Duração do lease.
+
+    Returns:
+        Lista de sqlite3.Row (id, validation_token, timestamp_envio, numero_nf)
+        reservadas para este worker.
     """
     conn = get_db_connection()
     cursor = conn.cursor()
+    agora = datetime.now()
     
     try:
+        # Um único UPDATE ... RETURNING: o SQLite serializa as escritas, então
+        # dois workers nunca recebem a mesma linha.
         cursor.execute(
             """
             UPDATE ProcessamentoNF
-            SET status = ?
-            WHERE validation_token = ? AND status = 'PENDING_VALIDATION'
+            SET lease_owner = ?, lease_expira_em = ?
+            WHERE id IN (
+                SELECT id FROM ProcessamentoNF
+                WHERE status = ? AND timestamp_envio < ?
+                  AND (lease_owner IS NULL OR lease_expira_em < ?)
+                ORDER BY timestamp_envio
+                LIMIT ?
+            )
+            RETURNING id, validation_token, timestamp_envio, numero_nf
             """,
-            (new_status, token)
+            (worker_id, agora + timedelta(seconds=lease_seconds),
+             nf_status.PENDING_VALIDATION, limite_envio, agora, batch_size)
         )
+        claimed = cursor.fetchall()
         conn.commit()
-        # Retorna True se uma linha foi de fato atualizada, False caso contrário
-        return cursor.rowcount > 0
+        return claimed
     except sqlite3.Error as e:
-        print(f"Erro ao atualizar status: {e}")
+        print(f"Erro ao reservar NFs pendentes: {e}")
         conn.rollback()
-        return False
+        return []
     finally:
         conn.close()
 
-def get_pending_validations():
+def release_leases(worker_id, processing_ids):
     """
-    Busca todas as NFs que ainda estão com status 'PENDING_VALIDATION'.
-    Usado pelo script de scheduler para verificar timeouts.
+    Libera os leases deste worker sobre as linhas indicadas (ex: após uma
+    falha), para que outra instância possa reprocessá-las sem esperar a expiração.
+    """
+    if not processing_ids:
+        return
+    placeholders = ", ".join("?" for _ in processing_ids)
+    conn = get_db_connection()
+    
+    try:
+        conn.execute(
+            f"""
+            UPDATE ProcessamentoNF
+            SET lease_owner = NULL, lease_expira_em = NULL
+            WHERE lease_owner = ? AND id IN ({placeholders})
+            """,
+            (worker_id, *processing_ids)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Erro ao liberar leases: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def transition_status(processing_id, new_status, origem):
+    """
+    Executa uma transição de status da máquina de estados (nf_status) em uma
+    única transação, e retorna em uma só ida ao banco os dados que o próximo
+    passo precisa (NF + Pedido + Solicitante, os campos do e-mail ao financeiro).
+
+    1. Registra a mudança na tabela ProcessamentoNFHistory.
+    2. Faz o UPDATE ... RETURNING, condicionado ao status atual ser uma
+       origem válida para `new_status` (evita condições de corrida).
+    3. Atualiza as tabelas de resumo do dashboard e o saldo do pedido.
+
+    Args:
+        processing_id: Chave primária do ProcessamentoNF.
+        new_status: Status de destino (ex: nf_status.APPROVED).
+        origem: Quem disparou a transição (ex: 'link', 'scheduler').
+
+    Returns:
+        Um sqlite3.Row com os dados atualizados, ou None se a linha não
+        existir ou não estiver em um status que permita a transição.
+    """
+    origens = nf_status.sources_for(new_status)
+    placeholders = ", ".join("?" for _ in origens)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        # BEGIN IMMEDIATE reserva a escrita já no início, então o status lido
+        # pelo INSERT do histórico é o mesmo que o UPDATE vai alterar.
+        cursor.execute("BEGIN IMMEDIATE")
+        agora = datetime.now()
+
+        cursor.execute(
+            f"""
+            INSERT INTO ProcessamentoNFHistory
+            (processamento_id, status_anterior, status_novo, origem, timestamp_mudanca)
+            SELECT id, status, ?, ?, ?
+            FROM ProcessamentoNF
+            WHERE id = ? AND status IN ({placeholders})
+            RETURNING status_anterior
+            """,
+            (new_status, origem, agora, processing_id, *origens)
+        )
+        historico = cursor.fetchone()
+        if historico is None:
+            conn.rollback()
+            return None
+
+        cursor.execute(
+            f"""
+            UPDATE ProcessamentoNF
+            SET status = ?, lease_owner = NULL, lease_expira_em = NULL
+            WHERE id = ? AND status IN ({placeholders})
+            RETURNING
+                id, numero_nf, data_nf, fornecedor_nf, valor_nf, status, pedido_id, pdf_hash,
+                (SELECT cp.numero_pedido FROM ControleDePedidos cp WHERE cp.id = pedido_id) as numero_pedido,
+                (SELECT cp.valor FROM ControleDePedidos cp WHERE cp.id = pedido_id) as valor_pedido,
+                (SELECT cp.centro_de_custos FROM ControleDePedidos cp WHERE cp.id = pedido_id) as centro_de_custos,
+                (SELECT s.nome FROM ControleDePedidos cp JOIN Solicitantes s ON cp.solicitante_id = s.id
+                 WHERE cp.id = pedido_id) as solicitante_nome,
+                (julianday(?) - julianday(timestamp_envio)) * 86400 as segundos_resposta
+            """,
+            (new_status, processing_id, *origens, agora)
+        )
+        data = cursor.fetchone()
+
+        _update_dashboard_summaries(
+            cursor, agora, historico['status_anterior'], new_status,
+            data['centro_de_custos'], data['valor_nf'], data['segundos_resposta']
+        )
+        _update_order_ledger(cursor, data['pedido_id'], historico['status_anterior'], new_status, data['valor_nf'])
+
+        conn.commit()
+        return data
+    except sqlite3.Error as e:
+        print(f"Erro na transição de status para {new_status}: {e}")
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+def get_status_history(processing_id):
+    """
+    Retorna o histórico de mudanças de status de um processamento,
+    do mais antigo para o mais recente.
     """
     conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute(
         """
-        SELECT id, validation_token, timestamp_envio, numero_nf 
-        FROM ProcessamentoNF
-        WHERE status = 'PENDING_VALIDATION'
+        SELECT status_anterior, status_novo, origem, timestamp_mudanca
+        FROM ProcessamentoNFHistory
+        WHERE processamento_id = ?
+        ORDER BY id
+        """,
+        (processing_id,)
+    )
+    
+    history = cursor.fetchall()
+    conn.close()
+    return history
+
+# --- Tabelas de resumo do dashboard ---
+# ResumoDiarioStatus: por dia, status e centro de custos, quantas NFs
+# entraram naquele status, o valor somado e o tempo total de resposta.
+# ResumoPendentes: backlog atual de NFs pendentes por centro de custos.
+# São mantidas incrementalmente pelas mesmas transações que alteram o
+# ProcessamentoNF, então o dashboard não precisa agregar o histórico.
+
+def _update_dashboard_summaries(cursor, momento, status_anterior, status_novo, centro_de_custos, valor_nf, segundos_resposta=None):
+    """
+    Aplica a entrada de uma NF em `status_novo` (vinda de `status_anterior`,
+    ou None se é uma NF nova) nas tabelas de resumo. Deve ser chamada com o
+    cursor da transação que alterou o ProcessamentoNF.
+    """
+    centro_de_custos = centro_de_custos or 'N/D'
+    valor_nf = _to_amount(valor_nf)
+
+    cursor.execute(
         """
+        INSERT INTO ResumoDiarioStatus (dia, status, centro_de_custos, quantidade, valor_total, soma_segundos_resposta)
+        VALUES (?, ?, ?, 1, ?, ?)
+        ON CONFLICT (dia, status, centro_de_custos) DO UPDATE SET
+            quantidade = quantidade + 1,
+            valor_total = valor_total + excluded.valor_total,
+            soma_segundos_resposta = soma_segundos_resposta + excluded.soma_segundos_resposta
+        """,
+        (momento.date().isoformat(), status_novo, centro_de_custos, valor_nf, segundos_resposta or 0)
+    )
+
+    # Backlog de pendentes: +1 ao entrar em PENDING_VALIDATION, -1 ao sair
+    delta = 0
+    if status_novo == nf_status.PENDING_VALIDATION:
+        delta += 1
+    if status_anterior == nf_status.PENDING_VALIDATION:
+        delta -= 1
+    if delta:
+        cursor.execute(
+            """
+            INSERT INTO ResumoPendentes (centro_de_custos, quantidade, valor_total)
+            VALUES (?, ?, ?)
+            ON CONFLICT (centro_de_custos) DO UPDATE SET
+                quantidade = quantidade + excluded.quantidade,
+                valor_total = valor_total + excluded.valor_total
+            """,
+            (centro_de_custos, delta, delta * valor_nf)
+        )
+
+# Colunas do índice ProcessamentoNFBusca que podem ser usadas em 'coluna:termo'
+SEARCH_COLUMNS = ('numero_nf', 'fornecedor_nf', 'numero_pedido', 'texto')
+
+# Número de palavras dos trechos exibidos nos resultados da busca
+SNIPPET_WORDS = 16
+
+def _search_terms(texto_busca):
+    """
+    Separa o texto digitado em termos (coluna, termo); coluna é None quando
+    o termo vale para todos os campos. Filtros por coluna podem ser usados
+    com 'coluna:termo' (ex: fornecedor_nf:acme).
+    """
+    termos = []
+    for palavra in texto_busca.split():
+        coluna, sep, termo = palavra.partition(':')
+        if not (sep and coluna in SEARCH_COLUMNS and termo):
+            coluna, termo = None, palavra
+        termos.append((coluna, termo))
+    return termos
+
+def _build_fts_query(texto_busca):
+    """
+    Converte o texto digitado pelo usuário numa consulta FTS5 segura:
+    cada palavra vira um termo entre aspas (todas obrigatórias) e a última
+    aceita prefixo, para a busca funcionar enquanto se digita.
+    """
+    termos = []
+    for coluna, termo in _search_terms(texto_busca):
+        termo = '"' + termo.replace('"', '""') + '"'
+        termos.append(f"{coluna} : {termo}" if coluna else termo)
+    if termos:
+        termos[-1] += '*'
+    return " ".join(termos)
+
+def _normalize_for_search(texto):
+    """Minúsculas e sem acentos, como o tokenizer do índice (unicode61 remove_diacritics)."""
+    decomposto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in decomposto if not unicodedata.combining(c))
+
+def _build_snippet(texto, termos, prefixo=False, palavras=SNIPPET_WORDS):
+    """
+    Trecho do texto em volta da primeira ocorrência dos termos, com as
+    ocorrências entre '**'. Substitui o snippet() do FTS5, que não funciona
+    no índice contentless (o texto só existe comprimido no ProcessamentoNF).
+
+    Args:
+        termos: Termos buscados no texto (sem filtro de coluna).
+        prefixo: Se a última palavra do último termo aceita prefixo.
+    """
+    tokens = list(re.finditer(r"\w+", texto))
+    if not tokens:
+        return ""
+    alvos = [[_normalize_for_search(p) for p in re.findall(r"\w+", termo)] for termo in termos]
+    exatos = {p for alvo in alvos for p in alvo}
+    inicio_prefixo = alvos[-1][-1] if prefixo and alvos and alvos[-1] else None
+
+    def _encontrado(token):
+        normalizado = _normalize_for_search(token.group())
+        return normalizado in exatos or (inicio_prefixo is not None and normalizado.startswith(inicio_prefixo))
+
+    primeiro = next((i for i, token in enumerate(tokens) if _encontrado(token)), 0)
+    fim = min(len(tokens), max(0, primeiro - palavras // 4) + palavras)
+    inicio = max(0, fim - palavras)
+
+    partes = [" … "] if inicio > 0 else []
+    for i in range(inicio, fim):
+        if i > inicio:
+            partes.append(re.sub(r"\s+", " ", texto[tokens[i - 1].end():tokens[i].start()]))
+        palavra = tokens[i].group()
+        partes.append(f"**{palavra}**" if _encontrado(tokens[i]) else palavra)
+    if fim < len(tokens):
+        partes.append(" … ")
+    return "".join(partes)
+
+def search_invoices(texto_busca, limit=20):
+    """
+    Busca textual nas NFs (texto extraído do PDF, número da NF, fornecedor e
+    número do pedido) usando o índice FTS5, ordenada por relevância (bm25).
+
+    O índice não guarda o texto: os campos e o trecho exibido vêm das NFs
+    quentes ou arquivadas (texto_comprimido).
+
+    Returns:
+        Lista de dicionários com id, numero_nf, fornecedor_nf, numero_pedido,
+        status (None se a NF já foi arquivada), timestamp_envio, trecho e relevancia.
+    """
+    consulta = _build_fts_query(texto_busca)
+    if not consulta:
+        return []
+    termos = _search_terms(texto_busca)
+    termos_texto = [termo for coluna, termo in termos if coluna in (None, 'texto')]
+    prefixo = termos[-1][0] in (None, 'texto')
+
+    conn = get_db_connection_with_archive()
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute(
+            """
+            SELECT rowid as id, bm25(ProcessamentoNFBusca) as relevancia
+            FROM ProcessamentoNFBusca
+            WHERE ProcessamentoNFBusca MATCH ?
+            ORDER BY relevancia
+            LIMIT ?
+            """,
+            (consulta, limit)
+        )
+        encontrados = cursor.fetchall()
+        if not encontrados:
+            return []
+
+        marcadores = ", ".join("?" * len(encontrados))
+        cursor.execute(
+            f"""
+            SELECT
+                t.id, t.numero_nf, t.fornecedor_nf, cp.numero_pedido,
+                hot.status, t.timestamp_envio, t.texto_comprimido
+            FROM ProcessamentoNFTodos t
+            LEFT JOIN ControleDePedidos cp ON cp.id = t.pedido_id
+            LEFT JOIN main.ProcessamentoNF hot ON hot.id = t.id
+            WHERE t.id IN ({marcadores})
+            """,
+            [row['id'] for row in encontrados]
+        )
+        nfs = {row['id']: row for row in cursor.fetchall()}
+
+        resultados = []
+        for encontrado in encontrados:
+            row = nfs.get(encontrado['id'])
+            if row is None:
+                continue
+            try:
+                texto = decompress_text(row['texto_comprimido'])
+            except (zlib.error, UnicodeDecodeError):
+                texto = ""
+            resultado = {k: row[k] for k in ('id', 'numero_nf', 'fornecedor_nf', 'numero_pedido',
+                                              'status', 'timestamp_envio')}
+            resultado['trecho'] = _build_snippet(texto, termos_texto, prefixo)
+            resultado['relevancia'] = encontrado['relevancia']
+            resultados.append(resultado)
+        return resultados
+    except sqlite3.Error as e:
+        print(f"Erro na busca textual '{texto_busca}': {e}")
+        return []
+    finally:
+        conn.close()
+
+def iter_stored_texts(include_archive=False, since=None, chunk_size=200):
+    """
+    Percorre, em blocos, as NFs que têm o texto extraído armazenado, sem
+    carregar todas na memória. Gera sqlite3.Row com id, numero_nf, data_nf,
+    fornecedor_nf, valor_nf, numero_pedido e texto_comprimido.
+
+    Args:
+        include_archive: Inclui as NFs arquivadas (ver archiver.py).
+        since: datetime opcional; só NFs com timestamp_envio a partir dele.
+        chunk_size: Linhas lidas do banco por vez.
+    """
+    if include_archive:
+        conn = get_db_connection_with_archive()
+        tabela = "ProcessamentoNFTodos"
+    else:
+        conn = get_db_connection()
+        tabela = "ProcessamentoNF"
+
+    filtro, params = "", ()
+    if since is not None:
+        filtro, params = "AND pnf.timestamp_envio >= ?", (since,)
+
+    try:
+        cursor = conn.execute(
+            f"""
+            SELECT pnf.id, pnf.numero_nf, pnf.data_nf, pnf.fornecedor_nf, pnf.valor_nf,
+                   cp.numero_pedido, pnf.texto_comprimido
+            FROM {tabela} pnf
+            JOIN ControleDePedidos cp ON pnf.pedido_id = cp.id
+            WHERE pnf.texto_comprimido IS NOT NULL {filtro}
+            ORDER BY pnf.id
+            """,
+            params
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+def is_message_ingested(message_id):
+    """Indica se a mensagem (pelo Message-ID) já foi processada pela ingestão por e-mail."""
+    conn = get_db_connection()
+    row = conn.execute("SELECT 1 FROM MensagensIngeridas WHERE message_id = ?", (message_id,)).fetchone()
+    conn.close()
+    return row is not None
+
+def is_attachment_ingested(pdf_hash):
+    """Indica se um PDF (pelo hash SHA-256) já foi recebido por e-mail."""
+    conn = get_db_connection()
+    row = conn.execute("SELECT 1 FROM AnexosIngeridos WHERE pdf_hash = ?", (pdf_hash,)).fetchone()
+    conn.close()
+    return row is not None
+
+def record_ingested_attachment(pdf_hash, message_id, nome_arquivo, resultado):
+    """Registra um PDF recebido por e-mail e o resultado do seu processamento."""
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO AnexosIngeridos (pdf_hash, message_id, nome_arquivo, resultado, timestamp_ingestao)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (pdf_hash, message_id, nome_arquivo, resultado, datetime.now())
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Erro ao registrar anexo ingerido: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def record_ingested_message(message_id, origem):
+    """Registra uma mensagem cujos anexos já foram todos processados."""
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO MensagensIngeridas (message_id, origem, timestamp_ingestao)
+            VALUES (?, ?, ?)
+            """,
+            (message_id, origem, datetime.now())
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Erro ao registrar mensagem ingerida: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def record_ingestion_failure(message_id, erro):
+    """
+    Registra mais uma tentativa com falha de uma mensagem recebida por e-mail.
+    Retorna o número de tentativas com falha até agora (ou None em caso de erro).
+    """
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            """
+            INSERT INTO FalhasIngestao (message_id, tentativas, ultimo_erro, timestamp_falha)
+            VALUES (?, 1, ?, ?)
+            ON CONFLICT (message_id) DO UPDATE SET
+                tentativas = tentativas + 1,
+                ultimo_erro = excluded.ultimo_erro,
+                timestamp_falha = excluded.timestamp_falha
+            RETURNING tentativas
+            """,
+            (message_id, erro, datetime.now())
+        ).fetchone()
+        conn.commit()
+        return row['tentativas']
+    except sqlite3.Error as e:
+        print(f"Erro ao registrar falha de ingestão: {e}")
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+def get_referenced_pdf_hashes(include_archive=True):
+    """
+    Retorna o conjunto de hashes de PDF referenciados pelo ProcessamentoNF
+    (e, se `include_archive`, também pelas NFs arquivadas).
+    Usado na coleta de lixo do blob_store.
+    """
+    if include_archive:
+        conn = get_db_connection_with_archive()
+        tabela = "ProcessamentoNFTodos"
+    else:
+        conn = get_db_connection()
+        tabela = "ProcessamentoNF"
+    try:
+        cursor = conn.execute(f"SELECT DISTINCT pdf_hash FROM {tabela} WHERE pdf_hash IS NOT NULL")
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        conn.close()
+
+# --- Saldo dos pedidos (faturamento parcial) ---
+# Um pedido pode ser faturado por várias NFs. SaldoPedidos guarda os totais
+# correntes por pedido, evitando um SUM sobre o ProcessamentoNF a cada upload.
+
+def _update_order_ledger(cursor, pedido_id, status_anterior, status_novo, valor_nf):
+    """
+    Aplica no saldo do pedido a passagem de uma NF de `status_anterior`
+    (None se é uma NF nova) para `status_novo`. Deve ser chamada com o
+    cursor da transação que alterou o ProcessamentoNF.
+    """
+    valor_nf = _to_amount(valor_nf)
+    faturado = (status_novo in nf_status.INVOICED_STATUSES) - (status_anterior in nf_status.INVOICED_STATUSES)
+    aprovado = (status_novo == nf_status.APPROVED) - (status_anterior == nf_status.APPROVED)
+    nova_nf = 1 if status_anterior is None else 0
+
+    cursor.execute(
+        """
+        INSERT INTO SaldoPedidos (pedido_id, valor_faturado, valor_aprovado, quantidade_nfs)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (pedido_id) DO UPDATE SET
+            valor_faturado = valor_faturado + excluded.valor_faturado,
+            valor_aprovado = valor_aprovado + excluded.valor_aprovado,
+            quantidade_nfs = quantidade_nfs + excluded.quantidade_nfs
+        """,
+        (pedido_id, faturado * valor_nf, aprovado * valor_nf, nova_nf)
+    )
+
+def get_order_balance(pedido_id):
+    """
+    Retorna o saldo de um pedido (consulta O(1) pela chave primária).
+
+    Returns:
+        Um sqlite3.Row com valor_pedido, valor_faturado, valor_aprovado,
+        quantidade_nfs, saldo_restante e sobrefaturado (0/1), ou None se o
+        pedido não existir.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        """
+        SELECT
+            cp.valor as valor_pedido,
+            COALESCE(sp.valor_faturado, 0) as valor_faturado,
+            COALESCE(sp.valor_aprovado, 0) as valor_aprovado,
+            COALESCE(sp.quantidade_nfs, 0) as quantidade_nfs,
+            cp.valor - COALESCE(sp.valor_faturado, 0) as saldo_restante,
+            COALESCE(sp.valor_faturado, 0) > cp.valor + 0.005 as sobrefaturado
+        FROM ControleDePedidos cp
+        LEFT JOIN SaldoPedidos sp ON sp.pedido_id = cp.id
+        WHERE cp.id = ?
+        """,
+        (pedido_id,)
     )
     
-    pending_list = cursor.fetchall()
+    saldo = cursor.fetchone()
     conn.close()
-    return pending_list
+    return saldo
 
-def get_data_for_finance_email(token):
+def get_dashboard_summary(dias=30):
     """
-    Coleta todos os dados de NF, Pedido e Solicitante necessários 
-    para enviar o e-mail final ao financeiro, usando o token.
-    Esta é a consulta mais completa, unindo as 3 tabelas.
+    Lê as tabelas de resumo para o dashboard de operações.
+    O custo depende apenas de `dias` x status x centros de custos,
+    não do tamanho do histórico de ProcessamentoNF.
+
+    Returns:
+        Uma tupla (resumo_diario, pendentes) de listas de sqlite3.Row.
     """
     conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute(
         """
-        SELECT 
-            pnf.numero_nf, pnf.data_nf, pnf.fornecedor_nf, pnf.valor_nf, pnf.status,
-            cp.numero_pedido, cp.valor as valor_pedido, cp.centro_de_custos,
-            s.nome as solicitante_nome
-        FROM ProcessamentoNF pnf
-        JOIN ControleDePedidos cp ON pnf.pedido_id = cp.id
-        JOIN Solicitantes s ON cp.solicitante_id = s.id
-        WHERE pnf.validation_token = ?
+        SELECT dia, status, centro_de_custos, quantidade, valor_total, soma_segundos_resposta
+        FROM ResumoDiarioStatus
+        WHERE dia >= date('now', 'localtime', ?)
+        ORDER BY dia
         """,
-        (token,)
+        (f"-{int(dias)} days",)
+    )
+    resumo_diario = cursor.fetchall()
+
+    cursor.execute(
+        """
+        SELECT centro_de_custos, quantidade, valor_total
+        FROM ResumoPendentes
+        WHERE quantidade > 0
+        ORDER BY quantidade DESC
+        """
     )
+    pendentes = cursor.fetchall()
+
+    conn.close()
+    return resumo_diario, pendentes
+
+def rebuild_dashboard_summaries():
+    """
+    Recalcula as tabelas de resumo a partir do histórico completo, incluindo
+    as NFs e o histórico já arquivados (ver archiver.py).
+    Uso pontual: popular os resumos de um banco criado antes deles existirem,
+    ou corrigir divergências. No dia a dia elas são mantidas incrementalmente.
+    """
+    conn = get_db_connection_with_archive()
+    cursor = conn.cursor()
     
-    data = cursor.fetchone()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("DELETE FROM ResumoDiarioStatus")
+        cursor.execute("DELETE FROM ResumoPendentes")
+
+        # Entradas em PENDING_VALIDATION (criação das NFs)
+        cursor.execute(
+            """
+            INSERT INTO ResumoDiarioStatus (dia, status, centro_de_custos, quantidade, valor_total, soma_segundos_resposta)
+            SELECT date(pnf.timestamp_envio), ?, cp.centro_de_custos, COUNT(*), TOTAL(pnf.valor_nf), 0
+            FROM ProcessamentoNFTodos pnf
+            JOIN ControleDePedidos cp ON pnf.pedido_id = cp.id
+            GROUP BY date(pnf.timestamp_envio), cp.centro_de_custos
+            """,
+            (nf_status.PENDING_VALIDATION,)
+        )
+
+        # Transições registradas no histórico
+        cursor.execute(
+            """
+            INSERT INTO ResumoDiarioStatus (dia, status, centro_de_custos, quantidade, valor_total, soma_segundos_resposta)
+            SELECT date(h.timestamp_mudanca), h.status_novo, cp.centro_de_custos, COUNT(*), TOTAL(pnf.valor_nf),
+                   TOTAL((julianday(h.timestamp_mudanca) - julianday(pnf.timestamp_envio)) * 86400)
+            FROM ProcessamentoNFHistoryTodos h
+            JOIN ProcessamentoNFTodos pnf ON h.processamento_id = pnf.id
+            JOIN ControleDePedidos cp ON pnf.pedido_id = cp.id
+            GROUP BY date(h.timestamp_mudanca), h.status_novo, cp.centro_de_custos
+            ON CONFLICT (dia, status, centro_de_custos) DO UPDATE SET
+                quantidade = quantidade + excluded.quantidade,
+                valor_total = valor_total + excluded.valor_total,
+                soma_segundos_resposta = soma_segundos_resposta + excluded.soma_segundos_resposta
+            """
+        )
+
+        # NFs pendentes nunca são arquivadas: basta a tabela quente
+        cursor.execute(
+            """
+            INSERT INTO ResumoPendentes (centro_de_custos, quantidade, valor_total)
+            SELECT cp.centro_de_custos, COUNT(*), TOTAL(pnf.valor_nf)
+            FROM main.ProcessamentoNF pnf
+            JOIN ControleDePedidos cp ON pnf.pedido_id = cp.id
+            WHERE pnf.status = ?
+            GROUP BY cp.centro_de_custos
+            """,
+            (nf_status.PENDING_VALIDATION,)
+        )
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        print(f"Erro ao recalcular os resumos do dashboard: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+def get_cost_centers():
+    """Lista os centros de custos cadastrados nos pedidos, em ordem alfabética."""
+    conn = get_db_connection()
+    rows = conn.execute(
+        "SELECT DISTINCT centro_de_custos FROM ControleDePedidos WHERE centro_de_custos IS NOT NULL ORDER BY 1"
+    ).fetchall()
     conn.close()
-    return data # Retorna um sqlite3.Row (dict-like) com todos os dados
\ No newline at end of file
+    return [row[0] for row in rows]
+
+# Colunas da exportação para o financeiro (ver export_nf.py)
+EXPORT_COLUMNS = (
+    'id', 'numero_nf', 'data_nf', 'fornecedor_nf', 'valor_nf', 'status', 'timestamp_envio',
+    'ultima_mudanca', 'numero_pedido', 'valor_pedido', 'centro_de_custos',
+    'solicitante_nome', 'solicitante_email'
+)
+
+def get_current_export_watermark():
+    """
+    Marca d'água atual para exportações incrementais: o maior id de
+    ProcessamentoNF e o maior id do histórico de status.
+    """
+    conn = get_db_connection()
+    row = conn.execute(
+        """
+        SELECT (SELECT COALESCE(MAX(id), 0) FROM ProcessamentoNF) as ultimo_nf_id,
+               (SELECT COALESCE(MAX(id), 0) FROM ProcessamentoNFHistory) as ultimo_historico_id
+        """
+    ).fetchone()
+    conn.close()
+    return {'ultimo_nf_id': row['ultimo_nf_id'], 'ultimo_historico_id': row['ultimo_historico_id']}
+
+def get_export_watermark(nome):
+    """Marca d'água da última exportação `nome` concluída, ou None se nunca houve."""
+    conn = get_db_connection()
+    row = conn.execute(
+        "SELECT ultimo_nf_id, ultimo_historico_id, linhas, atualizado_em FROM ExportacoesNF WHERE nome = ?",
+        (nome,)
+    ).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def save_export_watermark(nome, marca, linhas):
+    """Grava a marca d'água de uma exportação concluída. Retorna True em caso de sucesso."""
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            """
+            INSERT INTO ExportacoesNF (nome, ultimo_nf_id, ultimo_historico_id, linhas, atualizado_em)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (nome) DO UPDATE SET
+                ultimo_nf_id = excluded.ultimo_nf_id,
+                ultimo_historico_id = excluded.ultimo_historico_id,
+                linhas = excluded.linhas,
+                atualizado_em = excluded.atualizado_em
+            """,
+            (nome, marca['ultimo_nf_id'], marca['ultimo_historico_id'], linhas, datetime.now())
+        )
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        print(f"Erro ao gravar a marca d'água da exportação '{nome}': {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+def iter_export_rows(inicio=None, fim=None, status=None, centros_de_custos=None,
+                     desde=None, ate=None, include_archive=False, chunk_size=500):
+    """
+    Percorre, em blocos (fetchmany), as NFs unidas ao pedido e ao solicitante,
+    sem carregar o resultado na memória. Gera sqlite3.Row com EXPORT_COLUMNS.
+
+    Args:
+        inicio, fim: datas (date/datetime) opcionais; filtram timestamp_envio
+            no intervalo [inicio, fim).
+        status: lista opcional de status (ver nf_status.py).
+        centros_de_custos: lista opcional de centros de custos.
+        desde: marca d'água de uma exportação anterior (get_export_watermark):
+            só NFs criadas ou com mudança de status depois dela.
+        ate: marca d'água do início desta exportação (get_current_export_watermark),
+            para que linhas gravadas durante a exportação fiquem para a próxima.
+        include_archive: Inclui as NFs arquivadas (não combina com `desde`).
+        chunk_size: Linhas lidas do banco por vez.
+    """
+    if include_archive and desde is not None:
+        raise ValueError("Exportações incrementais consideram apenas as NFs não arquivadas.")
+
+    if include_archive:
+        conn = get_db_connection_with_archive()
+        tabela, tabela_historico = "ProcessamentoNFTodos", "ProcessamentoNFHistoryTodos"
+    else:
+        conn = get_db_connection()
+        tabela, tabela_historico = "ProcessamentoNF", "ProcessamentoNFHistory"
+
+    filtros, params = [], []
+    if inicio is not None:
+        filtros.append("pnf.timestamp_envio >= ?")
+        params.append(inicio)
+    if fim is not None:
+        filtros.append("pnf.timestamp_envio < ?")
+        params.append(fim)
+    if status:
+        filtros.append(f"pnf.status IN ({', '.join('?' * len(status))})")
+        params.extend(status)
+    if centros_de_custos:
+        filtros.append(f"cp.centro_de_custos IN ({', '.join('?' * len(centros_de_custos))})")
+        params.extend(centros_de_custos)
+    if ate is not None:
+        filtros.append("pnf.id <= ?")
+        params.append(ate['ultimo_nf_id'])
+    if desde is not None:
+        # Novas NFs ou NFs com transição de status registrada após a marca d'água
+        historico = "SELECT processamento_id FROM ProcessamentoNFHistory WHERE id > ?"
+        params_historico = [desde['ultimo_historico_id']]
+        if ate is not None:
+            historico += " AND id <= ?"
+            params_historico.append(ate['ultimo_historico_id'])
+        filtros.append(f"(pnf.id > ? OR pnf.id IN ({historico}))")
+        params.extend([desde['ultimo_nf_id'], *params_historico])
+
+    where = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+    try:
+        cursor = conn.execute(
+            f"""
+            SELECT pnf.id, pnf.numero_nf, pnf.data_nf, pnf.fornecedor_nf, pnf.valor_nf,
+                   pnf.status, pnf.timestamp_envio,
+                   (SELECT MAX(h.timestamp_mudanca) FROM {tabela_historico} h
+                    WHERE h.processamento_id = pnf.id) as ultima_mudanca,
+                   cp.numero_pedido, cp.valor as valor_pedido, cp.centro_de_custos,
+                   s.nome as solicitante_nome, s.email as solicitante_email
+            FROM {tabela} pnf
+            JOIN ControleDePedidos cp ON pnf.pedido_id = cp.id
+            JOIN Solicitantes s ON cp.solicitante_id = s.id
+            {where}
+            ORDER BY pnf.id
+            """,
+            params
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
@@ -1,11 +1,16 @@
 import smtplib
 import ssl
 import os
+import re
+import base64
+import uuid
+from email import policy
 from email.message import EmailMessage
 from email.mime.base import MIMEBase
-from email import encoders
 from dotenv import load_dotenv
-from typing import Any # Para tipar os objetos 'sqlite3.Row' que agem como dicionários
+from typing import Any, BinaryIO, Union # Any: para tipar os objetos 'sqlite3.Row' que agem como dicionários
+
+import nf_status
 
 # Carrega as variáveis de ambiente do arquivo .env
 load_dotenv()
@@ -16,7 +21,10 @@ EMAIL_PORT_STR = os.getenv("EMAIL_PORT", "587")
 EMAIL_USER = os.getenv("EMAIL_USER")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD") 
 FINANCE_EMAIL = os.getenv("FINANCE_EMAIL")
-APP_BASE_URL = os.getenv("APP_BASE_URL", "http://localhost:8501") 
+APP_BASE_URL = os.getenv("APP_BASE_URL", "http://localhost:8501")
+# Endereço dos links de aprovação/rejeição: o validation_server.py, se estiver
+# em uso, ou o próprio app Streamlit
+VALIDATION_BASE_URL = os.getenv("VALIDATION_BASE_URL", APP_BASE_URL)
 
 # Validação melhorada
 if not all([EMAIL_HOST, EMAIL_PORT_STR, EMAIL_USER, EMAIL_PASSWORD, FINANCE_EMAIL]):
@@ -33,10 +41,73 @@ def _format_currency(value: Any) -> str:
     except (ValueError, TypeError):
         return str(value)
 
+# Bloco de leitura dos anexos em streaming. Múltiplo de 57 bytes para que
+# cada bloco vire linhas completas de 76 caracteres em base64.
+ATTACHMENT_CHUNK_SIZE = 57 * 1024
+
+def _iter_attachment_base64(attachment_data: Union[bytes, BinaryIO]):
+    """
+    Gera o anexo codificado em base64 (linhas de 76 caracteres terminadas em
+    CRLF), bloco a bloco. Se `attachment_data` for um arquivo aberto, lê em
+    blocos, sem carregar o conteúdo inteiro na memória.
+    """
+    if isinstance(attachment_data, (bytes, bytearray)):
+        for inicio in range(0, len(attachment_data), ATTACHMENT_CHUNK_SIZE):
+            yield base64.encodebytes(attachment_data[inicio:inicio + ATTACHMENT_CHUNK_SIZE]).replace(b"\n", b"\r\n")
+        return
+
+    while True:
+        bloco = attachment_data.read(ATTACHMENT_CHUNK_SIZE)
+        if not bloco:
+            break
+        yield base64.encodebytes(bloco).replace(b"\n", b"\r\n")
+
+def _iter_message_bytes(msg: EmailMessage, anexos: list):
+    """
+    Gera a mensagem pronta para o comando DATA do SMTP (CRLF e pontos no
+    início de linha duplicados). Cada anexo está em `msg` como um marcador,
+    substituído aqui pelo conteúdo em base64 gerado em streaming.
+
+    Args:
+        anexos: Lista de tuplas (marcador, dados) na ordem em que aparecem em `msg`.
+    """
+    resto = msg.as_bytes(policy=policy.SMTP)
+    for marcador, attachment_data in anexos:
+        antes, resto = resto.split(marcador.encode("ascii") + b"\r\n", 1)
+        yield re.sub(rb"(?m)^\.", b"..", antes)
+        yield from _iter_attachment_base64(attachment_data)  # base64 nunca começa com '.'
+    yield re.sub(rb"(?m)^\.", b"..", resto)
+
+def _send_data_streaming(server: smtplib.SMTP, from_addr: str, to_addrs: list, blocos):
+    """
+    Equivalente ao server.sendmail(), mas envia o corpo da mensagem bloco a
+    bloco. O smtplib exige a mensagem inteira em memória no sendmail().
+    """
+    server.ehlo_or_helo_if_needed()
+    code, resp = server.mail(from_addr)
+    if code != 250:
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+    for to_addr in to_addrs:
+        code, resp = server.rcpt(to_addr)
+        if code not in (250, 251):
+            raise smtplib.SMTPRecipientsRefused({to_addr: (code, resp)})
+    code, resp = server.docmd("DATA")
+    if code != 354:
+        raise smtplib.SMTPDataError(code, resp)
+    for bloco in blocos:
+        server.send(bloco)
+    server.send(b".\r\n")
+    code, resp = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+
 def _send_email(to_email: str, subject: str, html_content: str, attachments: list = None):
     """
     Função interna para lidar com a conexão SMTP e envio de e-mail.
     (Versão com logging de debug detalhado e suporte a anexos)
+
+    Cada anexo é uma tupla (dados, nome_do_arquivo, mimetype), onde `dados`
+    pode ser bytes ou um arquivo aberto em modo binário (lido em streaming).
     """
     
     # Valida se a porta é um número
@@ -54,12 +125,16 @@ def _send_email(to_email: str, subject: str, html_content: str, attachments: lis
     msg.set_content("Seu cliente de e-mail não suporta HTML.")
     msg.add_alternative(html_content, subtype="html")
     
-    # Adiciona anexos, se houver
+    # Adiciona anexos, se houver. O conteúdo só é lido e codificado durante o
+    # envio (ver _iter_message_bytes); na mensagem fica um marcador.
+    anexos = []
     if attachments:
         for attachment_data, attachment_filename, attachment_mimetype in attachments:
+            marcador = f"ANEXO{uuid.uuid4().hex}"
+            anexos.append((marcador, attachment_data))
             part = MIMEBase(attachment_mimetype.split('/')[0], attachment_mimetype.split('/')[1])
-            part.set_payload(attachment_data)
-            encoders.encode_base64(part)
+            part.set_payload(marcador)
+            part['Content-Transfer-Encoding'] = 'base64'
             part.add_header('Content-Disposition', f'attachment; filename="{attachment_filename}"')
             msg.attach(part)
     
@@ -84,7 +159,7 @@ def _send_email(to_email: str, subject: str, html_content: str, attachments: lis
             print(f"[DEBUG E-MAIL] Login bem-sucedido.")
             
             print(f"[DEBUG E-MAIL] Enviando mensagem...")
-            server.send_message(msg)
+            _send_data_streaming(server, EMAIL_USER, [to_email], _iter_message_bytes(msg, anexos))
             
         print(f"[DEBUG E-MAIL] E-mail enviado com sucesso para {to_email}.")
         print(f"----------------------")
@@ -105,14 +180,33 @@ def _send_email(to_email: str, subject: str, html_content: str, attachments: lis
         raise ConnectionError(f"Falha ao enviar e-mail: {e}")
 
 
-def send_validation_email(solicitante_email: str, solicitante_nome: str, nf_data: Any, pedido_data: Any, validation_token: str):
+def send_validation_email(solicitante_email: str, solicitante_nome: str, nf_data: Any, pedido_data: Any, approve_token: str, reject_token: str,
+                          saldo_pedido: Any = None):
     """
     Envia o e-mail de validação para o solicitante com os links de aprovação/rejeição.
+    Cada link carrega o seu próprio token assinado (ver validation_tokens.py).
+    `saldo_pedido` (db_manager.get_order_balance) adiciona o saldo restante do pedido.
     """
     subject = f"Ação Necessária: Validar NF {nf_data['numero_nf']} (Pedido {pedido_data['numero_pedido']})"
     
-    link_approve = f"{APP_BASE_URL}/?action=approve&token={validation_token}"
-    link_reject = f"{APP_BASE_URL}/?action=reject&token={validation_token}"
+    saldo_html = ""
+    if saldo_pedido is not None:
+        alerta = ""
+        if saldo_pedido['sobrefaturado']:
+            alerta = "<p style='color: #dc3545; font-weight: bold;'>ATENÇÃO: o total faturado ultrapassa o valor do pedido.</p>"
+        saldo_html = f"""
+            <h3>Saldo do Pedido</h3>
+            <table>
+                <tr><th>NFs recebidas (incluindo esta)</th><td>{saldo_pedido['quantidade_nfs']}</td></tr>
+                <tr><th>Total faturado</th><td>{_format_currency(saldo_pedido['valor_faturado'])}</td></tr>
+                <tr><th>Total aprovado</th><td>{_format_currency(saldo_pedido['valor_aprovado'])}</td></tr>
+                <tr><th>Saldo restante</th><td>{_format_currency(saldo_pedido['saldo_restante'])}</td></tr>
+            </table>
+            {alerta}
+        """
+
+    link_approve = f"{VALIDATION_BASE_URL}/?action=approve&token={approve_token}"
+    link_reject = f"{VALIDATION_BASE_URL}/?action=reject&token={reject_token}"
 
     html_body = f"""
     <html>
@@ -151,7 +245,7 @@ def send_validation_email(solicitante_email: str, solicitante_nome: str, nf_data
                 <tr><th>Valor do Pedido</th><td>{_format_currency(pedido_data['valor_pedido'])}</td></tr>
                 <tr><th>Centro de Custos</th><td>{pedido_data['centro_de_custos']}</td></tr>
             </table>
-            
+            {saldo_html}
             <div class="actions">
                 <p style="font-weight: bold; margin-bottom: 20px;">As informações do pedido acima estão corretas?</p> <!-- Espaço extra aqui --><a href="{link_approve}" class="button approve" style="background-color: #28a745; color: white; text-decoration: none; padding: 12px 25px; border-radius: 5px; font-weight: bold; font-size: 16px;">SIM, APROVAR</a>
                 <a href="{link_reject}" class="button reject" style="background-color: #dc3545; color: white; text-decoration: none; padding: 12px 25px; border-radius: 5px; font-weight: bold; font-size: 16px; margin-left: 15px;">NÃO, REJEITAR</a>
@@ -169,29 +263,37 @@ def send_validation_email(solicitante_email: str, solicitante_nome: str, nf_data
     _send_email(solicitante_email, subject, html_body)
 
 
-def send_finance_email(nf_data: Any, pedido_data: Any, status: str, pdf_attachment_data: bytes = None):
+def send_finance_email(nf_data: Any, pedido_data: Any, status: str, pdf_attachment_data: Union[bytes, BinaryIO] = None,
+                       auto_approved: bool = False):
     """
     Envia o e-mail de status final para o setor financeiro.
     Inclui anexo do PDF se o status for 'APPROVED'.
+    `pdf_attachment_data` pode ser bytes ou um arquivo aberto (ex: blob_store.open_blob).
+    `auto_approved` indica que a NF foi aprovada pelas regras automáticas, sem clique do solicitante.
     """
     
     subject_prefix = ""
     action_message = ""
     attachments_list = [] # Lista para armazenar informações de anexos
 
-    if status == 'APPROVED':
+    if status == nf_status.APPROVED:
         subject_prefix = "[APROVADO]"
-        action_message = f"<p style='color: green; font-weight: bold; font-size: 18px;'>Ação: Realizar o pagamento.</p><p>Validado por: {pedido_data['solicitante_nome']}.</p><p>A Nota Fiscal original está anexada para sua referência.</p>"
+        if auto_approved:
+            validado_por = f"Aprovado automaticamente pelas regras de aprovação (solicitante: {pedido_data['solicitante_nome']})."
+        else:
+            validado_por = f"Validado por: {pedido_data['solicitante_nome']}."
+        action_message = f"<p style='color: green; font-weight: bold; font-size: 18px;'>Ação: Realizar o pagamento.</p><p>{validado_por}</p><p>A Nota Fiscal original está anexada para sua referência.</p>"
         
         # Adiciona o anexo apenas se o status for APPROVED
         if pdf_attachment_data:
-            filename = f"NF_{nf_data.get('numero_nf', 'SemNumero')}.pdf"
+            # nf_data pode ser um sqlite3.Row, que não tem .get()
+            filename = f"NF_{nf_data['numero_nf'] or 'SemNumero'}.pdf"
             attachments_list.append((pdf_attachment_data, filename, "application/pdf"))
 
-    elif status == 'REJECTED':
+    elif status == nf_status.REJECTED:
         subject_prefix = "[REJEITADO]"
         action_message = f"<p style='color: red; font-weight: bold; font-size: 18px;'>Ação: NÃO realizar o pagamento.</p><p>Rejeitado por: {pedido_data['solicitante_nome']}. Favor entrar em contato.</p>"
-    elif status == 'TIMEOUT':
+    elif status == nf_status.TIMEOUT:
         subject_prefix = "[TIMEOUT]"
         action_message = f"<p style='color: #E9A11A; font-weight: bold; font-size: 18px;'>Ação: Pagamento suspenso.</p><p>O solicitante ({pedido_data['solicitante_nome']}) não respondeu à validação em 48 horas.</p>"
     else:
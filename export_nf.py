@@ -0,0 +1,193 @@
+import argparse
+import csv
+import os
+from datetime import datetime
+
+import db_manager
+import nf_status
+
+EXPORT_DIR = os.path.join("data", "exportacoes")
+
+# Linhas lidas do banco por vez e linhas por row group no Parquet
+DEFAULT_CHUNK_SIZE = 500
+PARQUET_ROW_GROUP_SIZE = 10000
+
+# A cada quantas linhas o callback de progresso é chamado
+PROGRESS_EVERY = 5000
+
+# Tipos das colunas no Parquet (as demais são texto)
+_PARQUET_INT_COLUMNS = ('id',)
+_PARQUET_FLOAT_COLUMNS = ('valor_nf', 'valor_pedido')
+
+
+def _parquet_schema():
+    import pyarrow as pa
+    campos = []
+    for coluna in db_manager.EXPORT_COLUMNS:
+        if coluna in _PARQUET_INT_COLUMNS:
+            tipo = pa.int64()
+        elif coluna in _PARQUET_FLOAT_COLUMNS:
+            tipo = pa.float64()
+        else:
+            tipo = pa.string()
+        campos.append(pa.field(coluna, tipo))
+    return pa.schema(campos)
+
+
+def _write_csv(rows, path: str) -> int:
+    linhas = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(db_manager.EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(tuple(row))
+            linhas += 1
+    return linhas
+
+
+def _write_parquet(rows, path: str) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("O formato parquet requer o pacote 'pyarrow' (pip install pyarrow).")
+
+    schema = _parquet_schema()
+    linhas = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        bloco = []
+
+        def _flush():
+            colunas = {nome: [row[i] for row in bloco] for i, nome in enumerate(db_manager.EXPORT_COLUMNS)}
+            # Valores extraídos que não são números ficam como TEXT no SQLite:
+            # no Parquet viram nulos em vez de derrubar a exportação inteira
+            for nome in _PARQUET_FLOAT_COLUMNS:
+                colunas[nome] = [db_manager._to_amount(valor, default=None) for valor in colunas[nome]]
+            writer.write_table(pa.Table.from_pydict(colunas, schema=schema))
+            bloco.clear()
+
+        for row in rows:
+            bloco.append(tuple(row))
+            linhas += 1
+            if len(bloco) >= PARQUET_ROW_GROUP_SIZE:
+                _flush()
+        if bloco or linhas == 0:
+            _flush()
+    return linhas
+
+
+def watermark_key(incremental: str, status=None, centros_de_custos=None) -> str:
+    """
+    Chave da marca d'água de uma exportação incremental: o nome mais os
+    filtros em forma canônica. Exportações com filtros diferentes avançam
+    marcas d'água independentes, então uma exportação filtrada não faz a
+    exportação completa pular as NFs que ela deixou de fora.
+    """
+    filtros = []
+    if status:
+        filtros.append("status=" + ",".join(sorted(set(status))))
+    if centros_de_custos:
+        filtros.append("centros=" + ",".join(sorted(set(centros_de_custos))))
+    return f"{incremental}[{';'.join(filtros)}]" if filtros else incremental
+
+
+def _with_progress(rows, on_progress):
+    linhas = 0
+    for row in rows:
+        yield row
+        linhas += 1
+        if linhas % PROGRESS_EVERY == 0:
+            on_progress(linhas)
+
+
+def export_invoices(output_path: str = None, fmt: str = "csv", inicio=None, fim=None, status=None,
+                    centros_de_custos=None, incremental: str = None, include_archive: bool = False,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE, on_progress=None) -> dict:
+    """
+    Exporta as NFs (com pedido e solicitante) para CSV ou Parquet.
+
+    As linhas são lidas do banco em blocos e gravadas à medida que chegam,
+    então a memória usada não depende do tamanho da exportação. O arquivo é
+    gravado com o sufixo .parcial e só é renomeado ao final.
+
+    Args:
+        incremental: Nome da exportação incremental (ex: 'financeiro_diario').
+            Exporta só as NFs criadas ou com mudança de status desde a última
+            exportação com esse nome e os mesmos filtros de status/centro de
+            custos (ver watermark_key) e, ao concluir, avança a marca d'água.
+            Não aceita filtro de datas nem NFs arquivadas.
+        on_progress: Função opcional chamada com o número de linhas já
+            gravadas, a cada PROGRESS_EVERY linhas.
+
+    Returns:
+        Um dicionário com 'arquivo' e 'linhas'.
+    """
+    if fmt not in ("csv", "parquet"):
+        raise ValueError(f"Formato de exportação desconhecido: '{fmt}' (use csv ou parquet).")
+    if incremental and (inicio is not None or fim is not None):
+        # As NFs fora do período ficariam para trás da marca d'água para sempre
+        raise ValueError("Exportações incrementais não aceitam filtro de datas.")
+    if incremental and include_archive:
+        raise ValueError("Exportações incrementais consideram apenas as NFs não arquivadas.")
+    if output_path is None:
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        prefixo = incremental or "nfs"
+        output_path = os.path.join(EXPORT_DIR, f"{prefixo}_{datetime.now():%Y%m%d_%H%M%S}.{fmt}")
+
+    chave = watermark_key(incremental, status, centros_de_custos) if incremental else None
+    desde = db_manager.get_export_watermark(chave) if incremental else None
+    ate = db_manager.get_current_export_watermark()
+    if incremental:
+        print(f"Exportação incremental '{chave}' "
+              f"{'desde ' + str(desde['atualizado_em']) if desde else '(primeira execução: todas as NFs)'}.")
+
+    rows = db_manager.iter_export_rows(
+        inicio=inicio, fim=fim, status=status, centros_de_custos=centros_de_custos,
+        desde=desde, ate=ate, include_archive=include_archive, chunk_size=chunk_size
+    )
+    if on_progress is not None:
+        rows = _with_progress(rows, on_progress)
+    parcial = f"{output_path}.parcial"
+    try:
+        linhas = _write_parquet(rows, parcial) if fmt == "parquet" else _write_csv(rows, parcial)
+    except BaseException:
+        if os.path.exists(parcial):
+            os.remove(parcial)
+        raise
+    os.replace(parcial, output_path)
+
+    if incremental:
+        db_manager.save_export_watermark(chave, ate, linhas)
+    print(f"Exportação concluída: {linhas} NF(s) em {output_path}")
+    return {'arquivo': output_path, 'linhas': linhas}
+
+
+def _parse_date(valor: str):
+    return datetime.strptime(valor, "%Y-%m-%d")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta as NFs processadas (com pedido e solicitante) para o financeiro.")
+    parser.add_argument("--formato", choices=["csv", "parquet"], default="csv", help="Formato do arquivo (padrão: csv).")
+    parser.add_argument("--saida", default=None, help="Caminho do arquivo (padrão: data/exportacoes/<nome>_<data>.<formato>).")
+    parser.add_argument("--inicio", type=_parse_date, default=None, help="NFs recebidas a partir desta data (AAAA-MM-DD).")
+    parser.add_argument("--fim", type=_parse_date, default=None, help="NFs recebidas antes desta data (AAAA-MM-DD).")
+    parser.add_argument("--status", action="append", choices=nf_status.ALL_STATUSES, default=None,
+                        help="Filtra por status (pode repetir).")
+    parser.add_argument("--centro", action="append", default=None, help="Filtra por centro de custos (pode repetir).")
+    parser.add_argument("--incremental", default=None, metavar="NOME",
+                        help="Exporta só o que mudou desde a última exportação com este nome e os mesmos "
+                             "filtros de status/centro (ex: financeiro_diario). Não combina com --inicio/--fim.")
+    parser.add_argument("--incluir-arquivadas", action="store_true", help="Inclui as NFs já arquivadas.")
+    args = parser.parse_args()
+
+    export_invoices(
+        output_path=args.saida,
+        fmt=args.formato,
+        inicio=args.inicio,
+        fim=args.fim,
+        status=args.status,
+        centros_de_custos=args.centro,
+        incremental=args.incremental,
+        include_archive=args.incluir_arquivadas
+    )
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Modos suportados (variável de ambiente EXTRACTION_BACKEND):
+#   live   -> chama a API do Gemini diretamente (padrão)
+#   record -> chama a API e grava cada resposta no cassete
+#   replay -> responde a partir do cassete, sem acesso à rede
+DEFAULT_CASSETTE_FILE = os.path.join("data", "extraction_cassette.jsonl")
+
+
+class CassetteMissError(LookupError):
+    """Lançada no modo replay quando o prompt não está gravado no cassete."""
+
+
+def request_hash(model_name: str, prompt: str) -> str:
+    """Chave estável de uma requisição: SHA-256 do modelo + prompt."""
+    return hashlib.sha256(f"{model_name}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+class GeminiBackend:
+    """
+    Backend real: envia o prompt para a API do Gemini e devolve o texto da resposta.
+    """
+
+    def __init__(self, model_name: str):
+        # Importado aqui para que o modo replay funcione sem a biblioteca instalada
+        import google.generativeai as genai
+
+        self.model_name = model_name
+        self._model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt: str) -> str:
+        return self._model.generate_content(prompt).text
+
+
+class _Cassette:
+    """
+    Arquivo JSON Lines: uma linha {"key": hash_da_requisição, "response": ..., "latency": ...}
+    por resposta gravada. Em chaves repetidas vale a última linha.
+
+    Cada resposta é acrescentada com uma única escrita em modo append, então
+    gravar é O(1) por resposta e vários processos podem gravar no mesmo
+    cassete. Cassetes antigos (um único objeto JSON) também são lidos e são
+    convertidos para JSON Lines na primeira gravação.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        self._legacy = False
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            conteudo = f.read()
+        if conteudo.lstrip().startswith("{") and "\n{" not in conteudo.strip():
+            try:
+                dados = json.loads(conteudo)
+                if isinstance(dados, dict) and "key" not in dados:
+                    self.entries, self._legacy = dados, True
+                    return
+            except json.JSONDecodeError:
+                pass
+        for linha in conteudo.splitlines():
+            try:
+                entry = json.loads(linha)
+            except json.JSONDecodeError:
+                continue  # Linha incompleta (ex: processo interrompido durante a gravação)
+            self.entries[entry["key"]] = {"response": entry["response"], "latency": entry.get("latency", 0)}
+
+    @staticmethod
+    def _line(key: str, entry: dict) -> bytes:
+        return (json.dumps({"key": key, **entry}, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def get(self, key: str):
+        return self.entries.get(key)
+
+    def put(self, key: str, response: str, latency: float):
+        with self._lock:
+            entry = {"response": response, "latency": round(latency, 4)}
+            self.entries[key] = entry
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            if self._legacy:
+                # Converte o cassete antigo uma única vez (arquivo temporário + rename)
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    for k, e in self.entries.items():
+                        f.write(self._line(k, e))
+                os.replace(tmp_path, self.path)
+                self._legacy = False
+                return
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, self._line(key, entry))
+            finally:
+                os.close(fd)
+
+
+class RecordingBackend:
+    """
+    Envolve outro backend e grava (hash da requisição -> resposta) no cassete.
+    """
+
+    def __init__(self, inner, cassette_path: str = DEFAULT_CASSETTE_FILE):
+        self.inner = inner
+        self.model_name = inner.model_name
+        self.cassette = _Cassette(cassette_path)
+
+    def generate(self, prompt: str) -> str:
+        inicio = time.perf_counter()
+        response = self.inner.generate(prompt)
+        self.cassette.put(request_hash(self.model_name, prompt), response, time.perf_counter() - inicio)
+        return response
+
+
+class ReplayBackend:
+    """
+    Responde a partir de um cassete gravado, sem acesso à rede.
+
+    `latency` controla a latência simulada:
+      None        -> responde imediatamente
+      "recorded"  -> dorme o tempo medido durante a gravação
+      float       -> dorme esse número fixo de segundos
+    """
+
+    def __init__(self, model_name: str, cassette_path: str = DEFAULT_CASSETTE_FILE, latency=None):
+        if not os.path.exists(cassette_path):
+            raise FileNotFoundError(f"Cassete de extração '{cassette_path}' não encontrado.")
+        self.model_name = model_name
+        self.cassette = _Cassette(cassette_path)
+        self.latency = latency
+
+    def generate(self, prompt: str) -> str:
+        key = request_hash(self.model_name, prompt)
+        entry = self.cassette.get(key)
+        if entry is None:
+            raise CassetteMissError(f"Requisição {key[:12]} não encontrada no cassete '{self.cassette.path}'.")
+
+        if self.latency == "recorded":
+            time.sleep(entry.get("latency", 0))
+        elif self.latency:
+            time.sleep(float(self.latency))
+        return entry["response"]
+
+
+def create_backend(model_name: str, mode: str = None, cassette_path: str = None, latency=None):
+    """
+    Cria o backend de extração de acordo com o modo (ou as variáveis de ambiente
+    EXTRACTION_BACKEND, EXTRACTION_CASSETTE e EXTRACTION_REPLAY_LATENCY).
+    """
+    mode = (mode or os.getenv("EXTRACTION_BACKEND", "live")).lower()
+    cassette_path = cassette_path or os.getenv("EXTRACTION_CASSETTE", DEFAULT_CASSETTE_FILE)
+    if latency is None:
+        latency = os.getenv("EXTRACTION_REPLAY_LATENCY") or None
+
+    if mode == "live":
+        return GeminiBackend(model_name)
+    if mode == "record":
+        return RecordingBackend(GeminiBackend(model_name), cassette_path)
+    if mode == "replay":
+        return ReplayBackend(model_name, cassette_path, latency=latency)
+    raise ValueError(f"Modo de backend de extração desconhecido: '{mode}' (use live, record ou replay).")
@@ -0,0 +1,97 @@
+import argparse
+import statistics
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import validation_tokens
+
+DEFAULT_REQUESTS = 500
+DEFAULT_CONCURRENCY = 32
+
+
+def _load_links(tokens_file: str, total: int) -> list:
+    """
+    Links a disparar: (action, token).
+
+    Sem arquivo, gera tokens válidos (validation_tokens.generate_token) para
+    um processamento inexistente (id 0): a resposta percorre a verificação
+    do token e, com --confirmar, a tentativa de transição, sem alterar o
+    banco nem enviar e-mails. Com `tokens_file` (uma linha "action token"
+    por link), mede o caminho real de aprovação/rejeição.
+    """
+    if tokens_file:
+        with open(tokens_file, encoding="utf-8") as f:
+            return [tuple(linha.split()) for linha in f if linha.strip()][:total]
+    return [("approve", validation_tokens.generate_token(0, "approve"))] * total
+
+
+def _click(base_url: str, action: str, token: str, confirmar: bool, timeout: float) -> tuple:
+    """GET da página de confirmação e, se `confirmar`, o POST do formulário."""
+    inicio = time.perf_counter()
+    try:
+        query = urllib.parse.urlencode({"action": action, "token": token})
+        with urllib.request.urlopen(f"{base_url}/?{query}", timeout=timeout) as resposta:
+            resposta.read()
+            status = resposta.status
+        if confirmar:
+            corpo = urllib.parse.urlencode({"action": action, "token": token}).encode("ascii")
+            with urllib.request.urlopen(f"{base_url}/", data=corpo, timeout=timeout) as resposta:
+                resposta.read()
+                status = resposta.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = None
+    return status, time.perf_counter() - inicio
+
+
+def run_load_test(base_url: str, links: list, concurrency: int, confirmar: bool = False, timeout: float = 30) -> dict:
+    """Dispara os links com `concurrency` clientes simultâneos e mede vazão e latência."""
+    base_url = base_url.rstrip('/')
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        resultados = list(executor.map(
+            lambda link: _click(base_url, link[0], link[1], confirmar, timeout), links
+        ))
+    duracao = time.perf_counter() - inicio
+
+    latencias = sorted(latencia for status, latencia in resultados if status == 200)
+    erros = sum(1 for status, _ in resultados if status != 200)
+    return {
+        'requisicoes': len(resultados),
+        'erros': erros,
+        'req_por_segundo': len(resultados) / duracao if duracao else 0.0,
+        'p50_ms': statistics.median(latencias) * 1000 if latencias else None,
+        'p95_ms': latencias[int(len(latencias) * 0.95) - 1] * 1000 if latencias else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Teste de carga dos links de aprovação/rejeição (validation_server.py x Streamlit)."
+    )
+    parser.add_argument("urls", nargs="+",
+                        help="Endereços base a comparar (ex: http://localhost:8502 http://localhost:8501).")
+    parser.add_argument("--requisicoes", type=int, default=DEFAULT_REQUESTS,
+                        help=f"Cliques por endereço (padrão: {DEFAULT_REQUESTS}).")
+    parser.add_argument("--concorrencia", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Clientes simultâneos (padrão: {DEFAULT_CONCURRENCY}).")
+    parser.add_argument("--tokens", default=None,
+                        help="Arquivo com linhas 'action token' reais (padrão: tokens de um processamento inexistente).")
+    parser.add_argument("--confirmar", action="store_true",
+                        help="Após o GET, envia o POST de confirmação (só no validation_server.py).")
+    args = parser.parse_args()
+
+    links = _load_links(args.tokens, args.requisicoes)
+    print("Observação: no Streamlit, um GET devolve só a página inicial; a execução do app.py ocorre")
+    print("depois, pelo WebSocket da sessão. Os números do Streamlit são, portanto, um limite superior.\n")
+    print(f"{'Endereço':<32} {'req/s':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'erros':>6}")
+    for url in args.urls:
+        r = run_load_test(url, links, args.concorrencia, confirmar=args.confirmar)
+        p50 = f"{r['p50_ms']:.0f}" if r['p50_ms'] is not None else "-"
+        p95 = f"{r['p95_ms']:.0f}" if r['p95_ms'] is not None else "-"
+        print(f"{url:<32} {r['req_por_segundo']:>8.1f} {p50:>9} {p95:>9} {r['erros']:>6}")
@@ -0,0 +1,473 @@
+import argparse
+import binascii
+import hashlib
+import imaplib
+import mailbox
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email import policy
+from email.parser import BytesHeaderParser
+from dotenv import load_dotenv
+
+import db_manager
+import workflow_manager
+
+# Carrega as variáveis de ambiente (IMAP_*) do arquivo .env
+load_dotenv()
+
+# Pasta para onde as mensagens processadas são movidas
+DEFAULT_DONE_FOLDER = "Processadas"
+
+# Pasta para onde vão as mensagens que falharam MAX_ATTEMPTS vezes
+DEFAULT_FAILED_FOLDER = "Falhas"
+MAX_ATTEMPTS = 5
+
+# NFs processadas em paralelo pelo workflow e intervalo entre varreduras
+DEFAULT_CONCURRENCY = 4
+DEFAULT_POLL_SECONDS = 60
+
+# Mensagens e anexos acima deste tamanho vão para um arquivo temporário em disco
+SPOOL_MAX_BYTES = 1024 * 1024
+
+# Tamanho de cada trecho baixado do IMAP
+IMAP_FETCH_CHUNK = 1024 * 1024
+
+_header_parser = BytesHeaderParser(policy=policy.default)
+
+
+class MaildirSource:
+    """
+    Caixa de entrada em um diretório Maildir local (útil para testes).
+    As mensagens processadas vão para a subpasta `.Processadas`.
+    """
+
+    def __init__(self, path: str, done_folder: str = DEFAULT_DONE_FOLDER,
+                 failed_folder: str = DEFAULT_FAILED_FOLDER):
+        self.name = f"maildir:{path}"
+        self._box = mailbox.Maildir(path, factory=None, create=True)
+        self._done = self._get_folder(done_folder)
+        self._failed = self._get_folder(failed_folder)
+
+    def _get_folder(self, folder: str):
+        if folder in self._box.list_folders():
+            return self._box.get_folder(folder)
+        return self._box.add_folder(folder)
+
+    def list_keys(self) -> list:
+        return sorted(self._box.keys())
+
+    def get_message_id(self, key: str) -> str:
+        # Lê só os cabeçalhos, para descartar duplicatas sem decodificar o corpo
+        with self._box.get_file(key) as f:
+            headers = _header_parser.parse(f)
+        return headers.get("Message-ID")
+
+    def open_message(self, key: str):
+        """Arquivo binário com a mensagem bruta, lido do disco sob demanda."""
+        return self._box.get_file(key)
+
+    def _move(self, key: str, folder):
+        with self._box.get_file(key) as f:
+            folder.add(f)
+        self._box.discard(key)
+
+    def mark_done(self, key: str):
+        self._move(key, self._done)
+
+    def mark_failed(self, key: str):
+        self._move(key, self._failed)
+
+    def close(self):
+        self._box.close()
+
+
+class IMAPSource:
+    """
+    Caixa de entrada em um servidor IMAP (SSL).
+    As mensagens processadas são movidas para `done_folder`.
+    """
+
+    def __init__(self, host: str, user: str, password: str, folder: str = "INBOX",
+                 done_folder: str = DEFAULT_DONE_FOLDER, port: int = 993,
+                 failed_folder: str = DEFAULT_FAILED_FOLDER):
+        self.name = f"imap:{user}@{host}/{folder}"
+        self._conn = imaplib.IMAP4_SSL(host, port)
+        self._conn.login(user, password)
+        self._conn.select(folder)
+        self._done_folder = done_folder
+        self._failed_folder = failed_folder
+        # Ignorados pelo servidor se já existirem
+        self._conn.create(done_folder)
+        self._conn.create(failed_folder)
+        self._supports_move = "MOVE" in self._conn.capabilities
+
+    def list_keys(self) -> list:
+        status, data = self._conn.uid("SEARCH", None, "ALL")
+        if status != "OK" or not data or not data[0]:
+            return []
+        return data[0].split()
+
+    def _fetch_response(self, key, items: str) -> list:
+        status, data = self._conn.uid("FETCH", key, f"({items})")
+        if status != "OK" or not data or not isinstance(data[0], tuple):
+            raise ConnectionError(f"Falha ao buscar a mensagem {key!r} no IMAP: {status}")
+        return data
+
+    def _fetch(self, key, item: str) -> bytes:
+        return self._fetch_response(key, item)[0][1]
+
+    def get_message_id(self, key) -> str:
+        # Só o cabeçalho Message-ID: mensagens já vistas não são baixadas
+        headers = _header_parser.parsebytes(self._fetch(key, "BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)]"))
+        return headers.get("Message-ID")
+
+    def open_message(self, key):
+        """
+        Baixa a mensagem bruta em trechos de IMAP_FETCH_CHUNK bytes para um
+        arquivo temporário (em disco acima de SPOOL_MAX_BYTES).
+
+        O primeiro FETCH também pede o RFC822.SIZE, e os trechos param quando
+        esse total é lido: com um tamanho múltiplo exato de IMAP_FETCH_CHUNK,
+        o FETCH seguinte (vazio) não é feito, pois alguns servidores o
+        respondem sem literal.
+        """
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        data = self._fetch_response(key, f"RFC822.SIZE BODY.PEEK[]<0.{IMAP_FETCH_CHUNK}>")
+        # O RFC822.SIZE pode vir antes ou depois do literal, conforme o servidor
+        resposta = b" ".join(d[0] if isinstance(d, tuple) else d for d in data if isinstance(d, (tuple, bytes)))
+        tamanho = re.search(rb"RFC822\.SIZE (\d+)", resposta)
+        tamanho = int(tamanho.group(1)) if tamanho else None
+
+        trecho = data[0][1]
+        lidos = 0
+        while True:
+            spool.write(trecho)
+            lidos += len(trecho)
+            if len(trecho) < IMAP_FETCH_CHUNK or (tamanho is not None and lidos >= tamanho):
+                break
+            trecho = self._fetch(key, f"BODY.PEEK[]<{lidos}.{IMAP_FETCH_CHUNK}>")
+        spool.seek(0)
+        return spool
+
+    def _move(self, key, folder: str):
+        if self._supports_move:
+            self._conn.uid("MOVE", key, folder)
+        else:
+            self._conn.uid("COPY", key, folder)
+            self._conn.uid("STORE", key, "+FLAGS", "(\\Deleted)")
+
+    def mark_done(self, key):
+        self._move(key, self._done_folder)
+
+    def mark_failed(self, key):
+        self._move(key, self._failed_folder)
+
+    def close(self):
+        try:
+            self._conn.expunge()
+            self._conn.close()
+        finally:
+            self._conn.logout()
+
+
+def _read_headers(fp):
+    """Lê um bloco de cabeçalhos MIME (até a linha em branco)."""
+    linhas = []
+    while True:
+        linha = fp.readline()
+        if not linha or linha in (b"\r\n", b"\n"):
+            break
+        linhas.append(linha)
+    return _header_parser.parsebytes(b"".join(linhas))
+
+
+def _is_pdf(headers) -> bool:
+    filename = headers.get_filename() or ""
+    return headers.get_content_type() == "application/pdf" or filename.lower().endswith(".pdf")
+
+
+class _AttachmentSink:
+    """Decodifica o corpo de um anexo linha a linha para um arquivo temporário, calculando o SHA-256."""
+
+    def __init__(self, headers):
+        self.filename = headers.get_filename() or ""
+        self.encoding = str(headers.get("Content-Transfer-Encoding", "7bit")).strip().lower()
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        self.sha256 = hashlib.sha256()
+        self._resto = b""      # base64: caracteres que ainda não formam um grupo de 4
+        self._quebra = b""     # 7bit/8bit/binary: quebra de linha retida (pode pertencer ao delimitador)
+        self.size = 0
+
+    def _emit(self, data: bytes):
+        if data:
+            self.file.write(data)
+            self.sha256.update(data)
+            self.size += len(data)
+
+    def write(self, linha: bytes):
+        if self.encoding == "base64":
+            dados = self._resto + b"".join(linha.split())
+            corte = len(dados) - len(dados) % 4
+            self._emit(binascii.a2b_base64(dados[:corte]))
+            self._resto = dados[corte:]
+        elif self.encoding == "quoted-printable":
+            self._emit(binascii.a2b_qp(linha))
+        else:
+            conteudo = linha.rstrip(b"\r\n")
+            self._emit(self._quebra + conteudo)
+            self._quebra = linha[len(conteudo):]
+
+    def finish(self) -> tuple:
+        if self.encoding == "base64" and self._resto:
+            self._emit(binascii.a2b_base64(self._resto + b"=" * (-len(self._resto) % 4)))
+        self.file.seek(0)
+        return self.filename, self.file, self.sha256.hexdigest(), self.size
+
+
+def iter_pdf_attachments(fp):
+    """
+    Percorre a mensagem bruta (arquivo binário) em streaming e gera
+    (nome_do_arquivo, arquivo_temporário, sha256, tamanho) para cada anexo PDF.
+
+    Só um anexo por vez é decodificado, e ele vai para um arquivo temporário
+    (em disco acima de SPOOL_MAX_BYTES); o restante da mensagem é descartado
+    à medida que é lido.
+    """
+    limites = []  # boundaries dos multiparts abertos, do mais externo ao mais interno
+
+    def _start_part(headers):
+        if headers.get_content_maintype() == "multipart" and headers.get_param("boundary"):
+            limites.append(b"--" + headers.get_param("boundary").encode("ascii", "replace"))
+            return None  # preâmbulo: descartado
+        return _AttachmentSink(headers) if _is_pdf(headers) else None
+
+    sink = _start_part(_read_headers(fp))
+    while True:
+        linha = fp.readline()
+        if not linha:
+            break
+        if limites and linha.startswith(b"--"):
+            marcador = linha.rstrip(b" \t\r\n")
+            nivel = next(
+                (i for i in range(len(limites) - 1, -1, -1) if marcador in (limites[i], limites[i] + b"--")),
+                None
+            )
+            if nivel is not None:
+                if sink is not None:
+                    yield sink.finish()
+                    sink = None
+                fechamento = marcador.endswith(b"--") and marcador == limites[nivel] + b"--"
+                del limites[nivel + 1:]
+                if fechamento:
+                    limites.pop()  # epílogo: descartado até o delimitador do multipart pai
+                else:
+                    sink = _start_part(_read_headers(fp))
+                continue
+        if sink is not None:
+            sink.write(linha)
+    if sink is not None:
+        yield sink.finish()
+
+
+class MailboxIngestor:
+    """
+    Lê as mensagens de uma caixa de entrada (Maildir ou IMAP), extrai os
+    anexos PDF e envia cada NF ao workflow_manager em paralelo.
+
+    - Duplicatas são ignoradas pelo Message-ID e pelo hash SHA-256 do PDF.
+      Um PDF só é registrado como recebido quando o workflow conclui com
+      sucesso, então um reenvio após uma falha é processado normalmente.
+    - No máximo `concurrency` NFs são processadas ao mesmo tempo, e a leitura
+      da caixa fica bloqueada enquanto houver `max_in_flight` NFs na fila
+      (contrapressão).
+    - Uma mensagem só é movida para a pasta de processadas quando todos os
+      seus anexos terminaram com sucesso. Se algum falhar, ela fica na caixa
+      de entrada e é reprocessada na próxima varredura (os anexos que já
+      deram certo são ignorados pelo hash); após `max_attempts` falhas, vai
+      para a pasta de falhas para análise manual.
+    """
+
+    def __init__(self, source, concurrency: int = DEFAULT_CONCURRENCY, max_in_flight: int = None,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.source = source
+        self.max_attempts = max_attempts
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._slots = threading.BoundedSemaphore(max_in_flight or concurrency * 2)
+        self._hashes_em_andamento = {}  # pdf_hash -> future do processamento
+        self._mensagens_em_andamento = set()
+        self._pendentes = []  # (key, message_id, [futures])
+
+    def _process_attachment(self, pdf_hash: str, message_id: str, filename: str, pdf_stream) -> tuple:
+        """Executada nas threads. Retorna (sucesso, resultado)."""
+        try:
+            resultado = workflow_manager.handle_uploaded_invoice(pdf_stream)
+        except Exception as e:
+            resultado = f"Ocorreu um erro inesperado: {e}"
+        finally:
+            pdf_stream.close()
+            self._slots.release()
+
+        # O workflow sinaliza erros pela mensagem de retorno, não por exceção
+        sucesso = resultado.startswith("Sucesso!")
+        if sucesso:
+            db_manager.record_ingested_attachment(pdf_hash, message_id, filename, resultado)
+        print(f"  -> [{filename}] {resultado}")
+        return sucesso, resultado
+
+    def _submit_message(self, key, message_id: str):
+        futures = []
+        with self.source.open_message(key) as raw:
+            for filename, pdf_stream, pdf_hash, tamanho in iter_pdf_attachments(raw):
+                if not tamanho:
+                    pdf_stream.close()
+                    continue
+                if pdf_hash in self._hashes_em_andamento:
+                    # O mesmo PDF já está sendo processado (outra mensagem): esta
+                    # mensagem só é finalizada se esse processamento der certo
+                    print(f"  -> [{filename}] PDF já em processamento. Aguardando o resultado.")
+                    futures.append(self._hashes_em_andamento[pdf_hash])
+                    pdf_stream.close()
+                    continue
+                if db_manager.is_attachment_ingested(pdf_hash):
+                    print(f"  -> [{filename}] PDF já recebido anteriormente. Ignorando.")
+                    pdf_stream.close()
+                    continue
+
+                # Contrapressão: espera uma vaga antes de enfileirar mais uma NF
+                self._slots.acquire()
+                future = self.executor.submit(self._process_attachment, pdf_hash, message_id, filename, pdf_stream)
+                self._hashes_em_andamento[pdf_hash] = future
+                futures.append(future)
+        self._mensagens_em_andamento.add(message_id)
+        self._pendentes.append((key, message_id, futures))
+
+    def _finalize_message(self, key, message_id: str, futures: list):
+        erros = [resultado for sucesso, resultado in (future.result() for future in futures) if not sucesso]
+        if not erros:
+            db_manager.record_ingested_message(message_id, self.source.name)
+            self.source.mark_done(key)
+            return
+
+        tentativas = db_manager.record_ingestion_failure(message_id, erros[-1])
+        if tentativas is not None and tentativas >= self.max_attempts:
+            print(f"Mensagem {message_id} falhou {tentativas} vezes. Movendo para a pasta de falhas.")
+            self.source.mark_failed(key)
+        else:
+            print(f"Mensagem {message_id} com {len(erros)} anexo(s) com falha "
+                  f"(tentativa {tentativas}). Fica na caixa de entrada para nova tentativa.")
+
+    def _finalize_done_messages(self, wait_all: bool = False):
+        """Finaliza as mensagens cujos anexos já terminaram (ou todas, se wait_all)."""
+        restantes = []
+        for key, message_id, futures in self._pendentes:
+            if not wait_all and not all(future.done() for future in futures):
+                restantes.append((key, message_id, futures))
+                continue
+            self._finalize_message(key, message_id, futures)
+        self._pendentes = restantes
+
+    def _hash_message(self, key) -> str:
+        sha256 = hashlib.sha256()
+        with self.source.open_message(key) as raw:
+            for bloco in iter(lambda: raw.read(64 * 1024), b""):
+                sha256.update(bloco)
+        return sha256.hexdigest()
+
+    def poll_once(self) -> int:
+        """
+        Faz uma varredura completa da caixa de entrada.
+
+        Returns:
+            O número de mensagens novas encontradas.
+        """
+        novas = 0
+        for key in self.source.list_keys():
+            message_id = self.source.get_message_id(key)
+            if not message_id:
+                # Sem Message-ID: usa o hash da mensagem completa como identificador
+                message_id = f"<sem-id-{self._hash_message(key)}>"
+
+            if message_id in self._mensagens_em_andamento or db_manager.is_message_ingested(message_id):
+                print(f"Mensagem {message_id} já processada. Movendo para a pasta de processadas.")
+                self.source.mark_done(key)
+                continue
+
+            novas += 1
+            print(f"Nova mensagem {message_id}. Extraindo anexos PDF...")
+            self._submit_message(key, message_id)
+            self._finalize_done_messages()
+
+        self._finalize_done_messages(wait_all=True)
+        self._hashes_em_andamento.clear()
+        self._mensagens_em_andamento.clear()
+        return novas
+
+    def run_forever(self, poll_seconds: int = DEFAULT_POLL_SECONDS):
+        print(f"--- Ingestão de NFs por e-mail ({self.source.name}) ---")
+        print(f"A verificar a caixa de entrada a cada {poll_seconds} segundos. Pressione Ctrl+C para sair.")
+        try:
+            while True:
+                print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Verificando a caixa de entrada...")
+                try:
+                    novas = self.poll_once()
+                    print(f"{novas} mensagem(ns) nova(s) processada(s).")
+                    cache = db_manager.get_order_cache_stats()
+                    print(f"Cache de pedidos: {cache['acertos']}/{cache['consultas']} acertos ({cache['taxa_acerto']:.0%}).")
+                except Exception as e:
+                    print(f"ERRO CRÍTICO na verificação da caixa de entrada: {e}")
+                    # Tenta novamente na próxima varredura
+                time.sleep(poll_seconds)
+        except (KeyboardInterrupt, SystemExit):
+            print("Ingestão interrompida pelo utilizador.")
+        finally:
+            self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.source.close()
+
+
+def create_source(maildir_path: str = None):
+    """Cria a fonte: Maildir local, se informado, senão IMAP configurado no .env."""
+    if maildir_path:
+        return MaildirSource(maildir_path)
+
+    host = os.getenv("IMAP_HOST")
+    user = os.getenv("IMAP_USER")
+    password = os.getenv("IMAP_PASSWORD")
+    if not all([host, user, password]):
+        raise ValueError("Informe --maildir ou configure IMAP_HOST, IMAP_USER e IMAP_PASSWORD no arquivo .env.")
+    return IMAPSource(
+        host, user, password,
+        folder=os.getenv("IMAP_FOLDER", "INBOX"),
+        done_folder=os.getenv("IMAP_DONE_FOLDER", DEFAULT_DONE_FOLDER),
+        failed_folder=os.getenv("IMAP_FAILED_FOLDER", DEFAULT_FAILED_FOLDER),
+        port=int(os.getenv("IMAP_PORT", "993"))
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingere NFs em PDF recebidas por e-mail (Maildir ou IMAP).")
+    parser.add_argument("--maildir", default=None, help="Diretório Maildir local (se omitido, usa o IMAP do .env).")
+    parser.add_argument("--concorrencia", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"NFs processadas em paralelo (padrão: {DEFAULT_CONCURRENCY}).")
+    parser.add_argument("--intervalo", type=int, default=DEFAULT_POLL_SECONDS,
+                        help=f"Segundos entre verificações (padrão: {DEFAULT_POLL_SECONDS}).")
+    parser.add_argument("--tentativas", type=int, default=MAX_ATTEMPTS,
+                        help=f"Falhas até a mensagem ir para a pasta de falhas (padrão: {MAX_ATTEMPTS}).")
+    parser.add_argument("--uma-vez", action="store_true", help="Faz uma única verificação e sai.")
+    args = parser.parse_args()
+
+    ingestor = MailboxIngestor(create_source(args.maildir), concurrency=args.concorrencia, max_attempts=args.tentativas)
+    if args.uma_vez:
+        try:
+            ingestor.poll_once()
+        finally:
+            ingestor.close()
+    else:
+        ingestor.run_forever(args.intervalo)
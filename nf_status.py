@@ -0,0 +1,50 @@
+# --- Máquina de estados do ProcessamentoNF ---
+# Centraliza os status possíveis de uma NF e as transições permitidas entre
+# eles. A transição em si (UPDATE + histórico) é feita por
+# db_manager.transition_status, que consulta este módulo.
+
+# --- Status ---
+PENDING_VALIDATION = 'PENDING_VALIDATION'  # Aguardando o clique do solicitante
+APPROVED = 'APPROVED'                      # Aprovada pelo solicitante
+REJECTED = 'REJECTED'                      # Rejeitada pelo solicitante
+TIMEOUT = 'TIMEOUT'                        # Sem resposta dentro do prazo
+
+ALL_STATUSES = (PENDING_VALIDATION, APPROVED, REJECTED, TIMEOUT)
+
+# Status finais: nenhuma transição sai deles
+FINAL_STATUSES = (APPROVED, REJECTED, TIMEOUT)
+
+# Status em que o valor da NF conta como faturado contra o pedido
+# (usado no saldo dos pedidos, tabela SaldoPedidos)
+INVOICED_STATUSES = (PENDING_VALIDATION, APPROVED)
+
+# Transições permitidas: status de origem -> status de destino possíveis
+TRANSITIONS = {
+    PENDING_VALIDATION: (APPROVED, REJECTED, TIMEOUT),
+}
+
+# Ação do link de validação -> status de destino
+ACTION_TO_STATUS = {
+    'approve': APPROVED,
+    'reject': REJECTED,
+}
+
+
+class InvalidTransitionError(ValueError):
+    """Transição não prevista na máquina de estados."""
+
+
+def sources_for(new_status: str) -> tuple:
+    """
+    Retorna os status a partir dos quais é permitido ir para `new_status`.
+    Lança InvalidTransitionError se nenhum status leva a ele.
+    """
+    sources = tuple(origem for origem, destinos in TRANSITIONS.items() if new_status in destinos)
+    if not sources:
+        raise InvalidTransitionError(f"Nenhuma transição leva ao status '{new_status}'.")
+    return sources
+
+
+def can_transition(current_status: str, new_status: str) -> bool:
+    """Indica se a transição current_status -> new_status é permitida."""
+    return new_status in TRANSITIONS.get(current_status, ())
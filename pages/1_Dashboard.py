@@ -0,0 +1,87 @@
+import streamlit as st
+import pandas as pd
+import db_manager
+import nf_status
+
+# --- Configuração da Página ---
+st.set_page_config(
+    page_title="Dashboard de Operações",
+    page_icon="📊",
+    layout="wide"
+)
+
+st.title("📊 Dashboard de Operações")
+st.caption("Dados lidos das tabelas de resumo, atualizadas a cada nova NF e a cada mudança de status.")
+
+dias = st.slider("Período (dias)", min_value=7, max_value=180, value=30, step=1)
+
+# As tabelas de resumo já estão agregadas por dia/status/centro de custos,
+# então esta leitura não depende do tamanho do histórico.
+resumo_diario, pendentes = db_manager.get_dashboard_summary(dias)
+
+df = pd.DataFrame([dict(row) for row in resumo_diario],
+                  columns=["dia", "status", "centro_de_custos", "quantidade", "valor_total", "soma_segundos_resposta"])
+df_pendentes = pd.DataFrame([dict(row) for row in pendentes],
+                            columns=["centro_de_custos", "quantidade", "valor_total"])
+
+if df.empty and df_pendentes.empty:
+    st.info("Ainda não há dados de processamento para exibir.")
+    st.stop()
+
+# --- Indicadores principais ---
+por_status = df.groupby("status")[["quantidade", "soma_segundos_resposta"]].sum()
+
+def _total(status, coluna="quantidade"):
+    return por_status[coluna].get(status, 0)
+
+recebidas = _total(nf_status.PENDING_VALIDATION)
+aprovadas = _total(nf_status.APPROVED)
+finalizadas = sum(_total(s) for s in nf_status.FINAL_STATUSES)
+respondidas = aprovadas + _total(nf_status.REJECTED)
+
+taxa_aprovacao = (aprovadas / finalizadas * 100) if finalizadas else 0
+tempo_medio_horas = (
+    (_total(nf_status.APPROVED, "soma_segundos_resposta") + _total(nf_status.REJECTED, "soma_segundos_resposta"))
+    / respondidas / 3600
+) if respondidas else 0
+
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("NFs recebidas", int(recebidas))
+col2.metric("Pendentes agora", int(df_pendentes["quantidade"].sum()))
+col3.metric("Taxa de aprovação", f"{taxa_aprovacao:.1f}%")
+col4.metric("Tempo médio de resposta", f"{tempo_medio_horas:.1f} h")
+
+# --- Vazão diária por status ---
+st.subheader("Vazão diária por status")
+if not df.empty:
+    vazao = df.pivot_table(index="dia", columns="status", values="quantidade", aggfunc="sum", fill_value=0)
+    st.bar_chart(vazao)
+
+# --- Backlog pendente por centro de custos ---
+st.subheader("Backlog pendente por centro de custos")
+if df_pendentes.empty:
+    st.success("Nenhuma NF aguardando validação.")
+else:
+    st.dataframe(
+        df_pendentes.rename(columns={
+            "centro_de_custos": "Centro de Custos",
+            "quantidade": "NFs pendentes",
+            "valor_total": "Valor total (R$)",
+        }),
+        hide_index=True,
+        use_container_width=True
+    )
+
+# --- Resumo por centro de custos ---
+st.subheader("Resumo por centro de custos no período")
+if not df.empty:
+    por_centro = df.pivot_table(index="centro_de_custos", columns="status", values="quantidade", aggfunc="sum", fill_value=0)
+    st.dataframe(por_centro, use_container_width=True)
+
+# --- Cache de consultas de pedidos (deste processo) ---
+cache = db_manager.get_order_cache_stats()
+st.caption(
+    f"Cache de pedidos: {cache['acertos']} acerto(s) em {cache['consultas']} consulta(s) "
+    f"({cache['taxa_acerto']:.0%}), {cache['tamanho']} pedido(s) em cache, "
+    f"{cache['invalidacoes']} invalidação(ões)."
+)
@@ -0,0 +1,48 @@
+import streamlit as st
+import pandas as pd
+import db_manager
+
+# --- Configuração da Página ---
+st.set_page_config(
+    page_title="Busca de Notas Fiscais",
+    page_icon="🔎",
+    layout="wide"
+)
+
+st.title("🔎 Busca de Notas Fiscais")
+st.markdown("""
+Pesquise no texto extraído das NFs, no número da NF, no fornecedor e no número do pedido.
+
+- Todas as palavras precisam aparecer (ex: `acme contrato 2025`).
+- Para buscar em um campo específico use `campo:termo`
+  (campos: `fornecedor_nf`, `numero_nf`, `numero_pedido`, `texto`).
+""")
+
+texto_busca = st.text_input("Buscar", placeholder="ex: fornecedor_nf:acme contrato CT-2025")
+limite = st.selectbox("Máximo de resultados", [20, 50, 100], index=0)
+
+if texto_busca.strip():
+    resultados = db_manager.search_invoices(texto_busca, limit=limite)
+
+    if not resultados:
+        st.info("Nenhuma NF encontrada para essa busca.")
+    else:
+        st.caption(f"{len(resultados)} resultado(s), ordenados por relevância.")
+        df = pd.DataFrame([dict(row) for row in resultados])
+        df["status"] = df["status"].fillna("ARQUIVADA")
+        st.dataframe(
+            df[["numero_nf", "fornecedor_nf", "numero_pedido", "status", "timestamp_envio"]].rename(columns={
+                "numero_nf": "Número NF",
+                "fornecedor_nf": "Fornecedor",
+                "numero_pedido": "Pedido",
+                "status": "Status",
+                "timestamp_envio": "Recebida em",
+            }),
+            hide_index=True,
+            use_container_width=True
+        )
+
+        st.subheader("Trechos")
+        for row in resultados:
+            if row['trecho']:
+                st.markdown(f"**NF {row['numero_nf']}** — {row['fornecedor_nf']}: {row['trecho']}")
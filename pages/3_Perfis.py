@@ -0,0 +1,66 @@
+import streamlit as st
+import pandas as pd
+import profiler
+
+# --- Configuração da Página ---
+st.set_page_config(
+    page_title="Perfis de Desempenho",
+    page_icon="⏱️",
+    layout="wide"
+)
+
+st.title("⏱️ Perfis de Desempenho")
+st.markdown("""
+Perfis (cProfile + pico de memória) das execuções do workflow.
+
+Para gerar perfis marque a opção na página principal, ou configure
+`WORKFLOW_PROFILE=1` (todas as execuções) ou `WORKFLOW_PROFILE_SAMPLE_RATE` (amostragem) no `.env`.
+""")
+
+perfis = profiler.list_profiles()
+
+if not perfis:
+    st.info(f"Nenhum perfil gravado em `{profiler.PROFILE_DIR}`.")
+    st.stop()
+
+df = pd.DataFrame(perfis)
+df["pico_memoria_mib"] = df["pico_memoria_bytes"] / 1024 / 1024
+st.dataframe(
+    df[["inicio", "tipo", "numero_nf", "duracao_segundos", "pico_memoria_mib"]].rename(columns={
+        "inicio": "Início",
+        "tipo": "Tipo",
+        "numero_nf": "Número NF",
+        "duracao_segundos": "Duração (s)",
+        "pico_memoria_mib": "Pico de memória (MiB)",
+    }),
+    hide_index=True,
+    use_container_width=True
+)
+
+# --- Detalhes de um perfil ---
+nomes = [perfil["nome"] for perfil in perfis]
+nome = st.selectbox("Perfil", nomes)
+perfil = perfis[nomes.index(nome)]
+
+# O .json e o .prof são arquivos separados: o dump pode ter sido apagado
+try:
+    with open(profiler.profile_path(nome), "rb") as f:
+        dump = f.read()
+except FileNotFoundError:
+    dump = None
+    st.warning(f"O dump (.prof) do perfil '{nome}' não foi encontrado em {profiler.PROFILE_DIR}.")
+
+if dump is not None:
+    st.download_button(
+        "Baixar dump (.prof)",
+        data=dump,
+        file_name=f"{nome}.prof",
+        mime="application/octet-stream"
+    )
+
+    ordenacao = st.radio("Ordenar funções por", ["cumulative", "tottime", "ncalls"], horizontal=True)
+    st.subheader("Funções mais caras")
+    st.code(profiler.format_stats(nome, sort=ordenacao), language="text")
+
+st.subheader("Maiores alocações de memória")
+st.dataframe(pd.DataFrame(perfil["maiores_alocacoes"]), hide_index=True, use_container_width=True)
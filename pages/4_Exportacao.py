@@ -0,0 +1,118 @@
+import os
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import streamlit as st
+import db_manager
+import export_nf
+import nf_status
+
+# Os arquivos são gravados na pasta servida pelo próprio Streamlit
+# (server.enableStaticServing em .streamlit/config.toml): o download é lido
+# do disco em streaming, sem passar o arquivo inteiro pela sessão.
+STATIC_EXPORT_DIR = os.path.join("static", "exportacoes")
+STATIC_EXPORT_URL = "/app/static/exportacoes"
+
+# Arquivos exportados pela página são apagados depois deste prazo
+EXPORT_RETENTION_HOURS = 24
+
+# --- Configuração da Página ---
+st.set_page_config(
+    page_title="Exportação para o Financeiro",
+    page_icon="📤",
+    layout="centered"
+)
+
+
+@st.cache_resource
+def _export_jobs():
+    """Exportações em segundo plano, compartilhadas entre as sessões: {id: estado}."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="exportacao"), {}
+
+
+def _remove_old_exports():
+    if not os.path.isdir(STATIC_EXPORT_DIR):
+        return
+    limite = time.time() - EXPORT_RETENTION_HOURS * 3600
+    for nome in os.listdir(STATIC_EXPORT_DIR):
+        caminho = os.path.join(STATIC_EXPORT_DIR, nome)
+        if os.path.getmtime(caminho) < limite:
+            os.remove(caminho)
+
+
+def _start_export(**filtros) -> str:
+    executor, jobs = _export_jobs()
+    _remove_old_exports()
+    os.makedirs(STATIC_EXPORT_DIR, exist_ok=True)
+
+    # Nome imprevisível: a pasta estática não exige login
+    nome = f"{secrets.token_hex(16)}_{filtros.get('incremental') or 'nfs'}_{datetime.now():%Y%m%d_%H%M%S}.{filtros['fmt']}"
+    job_id = secrets.token_hex(8)
+    estado = {'linhas': 0, 'arquivo': nome}
+
+    def _progresso(linhas):
+        estado['linhas'] = linhas
+
+    estado['future'] = executor.submit(
+        export_nf.export_invoices,
+        output_path=os.path.join(STATIC_EXPORT_DIR, nome),
+        on_progress=_progresso,
+        **filtros
+    )
+    jobs[job_id] = estado
+    return job_id
+
+
+st.title("📤 Exportação para o Financeiro")
+st.markdown("""
+Gera um arquivo com as NFs processadas, o pedido e o solicitante.
+A exportação roda em segundo plano e grava o arquivo em disco aos poucos;
+ao final, um link de download é exibido.
+""")
+
+with st.form("exportacao"):
+    periodo = st.date_input("Período de recebimento", value=(date.today() - timedelta(days=1), date.today()))
+    status = st.multiselect("Status", nf_status.ALL_STATUSES)
+    centros = st.multiselect("Centros de custos", db_manager.get_cost_centers())
+    formato = st.radio("Formato", ["csv", "parquet"], horizontal=True)
+    incremental = st.checkbox(
+        "Somente o que mudou desde a última exportação incremental",
+        help="Ignora o período. Usa a marca d'água 'financeiro_diario' com os filtros escolhidos, a mesma do "
+             "comando `python export_nf.py --incremental financeiro_diario` com os mesmos --status/--centro."
+    )
+    gerar = st.form_submit_button("Gerar exportação")
+
+if gerar:
+    inicio = fim = None
+    if not incremental and isinstance(periodo, tuple) and len(periodo) == 2:
+        inicio = datetime.combine(periodo[0], datetime.min.time())
+        fim = datetime.combine(periodo[1] + timedelta(days=1), datetime.min.time())
+    st.session_state["exportacao"] = _start_export(
+        fmt=formato,
+        inicio=inicio,
+        fim=fim,
+        status=status or None,
+        centros_de_custos=centros or None,
+        incremental="financeiro_diario" if incremental else None
+    )
+
+job_id = st.session_state.get("exportacao")
+estado = _export_jobs()[1].get(job_id) if job_id else None
+if estado is not None:
+    future = estado['future']
+    if not future.done():
+        st.info(f"Exportando... {estado['linhas']} NF(s) gravada(s) até agora.")
+        time.sleep(1)
+        st.rerun()
+    elif future.exception() is not None:
+        st.error(f"Erro na exportação: {future.exception()}")
+    else:
+        resultado = future.result()
+        st.success(f"{resultado['linhas']} NF(s) exportada(s).")
+        st.markdown(
+            f'<a href="{STATIC_EXPORT_URL}/{estado["arquivo"]}" download="{estado["arquivo"].split("_", 1)[1]}">'
+            f'📥 Baixar arquivo</a>',
+            unsafe_allow_html=True
+        )
@@ -2,8 +2,11 @@ import fitz  # PyMuPDF
 import google.generativeai as genai
 import os
 import json
+import threading
 from dotenv import load_dotenv
 
+import extraction_backend
+
 # Carrega as variáveis de ambiente (GEMINI_API_KEY) do arquivo .env
 load_dotenv()
 
@@ -42,28 +45,27 @@ def extract_text_from_pdf(pdf_bytes: bytes) -> str:
         # Retorna o que foi possível extrair, ou uma string vazia
         return full_text 
 
-def get_invoice_data_with_gemini(pdf_text: str) -> dict:
-    """
-    Envia o texto extraído do PDF para o Gemini e solicita a extração
-    de dados estruturados em formato JSON.
+# Modelo do Gemini usado em todas as extrações.
+GEMINI_MODEL = 'gemini-2.5-pro'
 
-    Args:
-        pdf_text: A string de texto completa extraída do PDF.
+# Limite de caracteres do texto de cada NF enviado ao modelo.
+MAX_INVOICE_CHARS = 8000
 
-    Returns:
-        Um dicionário Python com os dados extraídos.
-    """
-    
-    # Modelo do Gemini. 'gemini-1.5-flash-latest' é rápido e eficaz para extração.
-    model = genai.GenerativeModel('gemini-2.5-pro')
+# Orçamento padrão (em tokens estimados) de uma requisição em lote.
+DEFAULT_BATCH_TOKEN_BUDGET = 24000
 
-    # --- Engenharia de Prompt Crítica ---
-    # Este prompt instrui o modelo a agir como um especialista,
-    # define os campos exatos e, o mais importante, restringe
-    # a busca do 'numero_pedido' ao campo 'descrição', como no desafio.
-    prompt = f"""
+# Campos que um item da resposta em lote precisa trazer preenchidos; itens
+# incompletos são reextraídos individualmente (numero_pedido pode ser null)
+BATCH_REQUIRED_FIELDS = ('numero_nf', 'fornecedor_nf', 'valor_nf')
+
+# --- Engenharia de Prompt Crítica ---
+# Este bloco instrui o modelo a agir como um especialista,
+# define os campos exatos e, o mais importante, restringe
+# a busca do 'numero_pedido' ao campo 'descrição', como no desafio.
+# É compartilhado entre a extração individual e a extração em lote.
+EXTRACTION_INSTRUCTIONS = """
     Você é um assistente de contas a pagar especialista em ler notas fiscais brasileiras.
-    Analise o texto da nota fiscal a seguir e extraia as seguintes informações no formato JSON.
+    Analise o texto da nota fiscal e extraia as seguintes informações no formato JSON.
     O JSON deve ter EXATAMENTE as seguintes chaves:
 
     1. "numero_nf": O número da Nota Fiscal (ex: "12345").
@@ -73,29 +75,95 @@ def get_invoice_data_with_gemini(pdf_text: str) -> dict:
     5. "numero_pedido": O número do pedido. Este número deve ser encontrado *especificamente* dentro do campo "descrição dos serviços", "dados adicionais" ou "informações complementares".
        Pode ter prefixos como 'PED-', 'Pedido n°', 'OC', etc. 
        Se não for encontrado NENHUM número de pedido nesses campos, retorne null para esta chave.
+"""
+
+
+# Backend de extração em uso (live, record ou replay). Criado sob demanda.
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_extraction_backend():
+    """
+    Retorna o backend de extração configurado por EXTRACTION_BACKEND
+    (ver extraction_backend.py), criando-o na primeira chamada.
+    Seguro para chamadas concorrentes: todas as threads recebem a mesma instância.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = extraction_backend.create_backend(GEMINI_MODEL)
+    return _backend
+
+
+def set_extraction_backend(backend) -> None:
+    """Substitui o backend de extração (ex: um ReplayBackend em benchmarks)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def _strip_markdown_fences(response_text: str) -> str:
+    """
+    Às vezes, o modelo pode "escapar" e adicionar markdown.
+    Remove o markdown '```json ... ```' se ele existir.
+    """
+    response_text = response_text.strip()
+    if response_text.startswith("```json"):
+        response_text = response_text[7:-3].strip()
+    elif response_text.startswith("```"):
+        response_text = response_text[3:-3].strip()
+    return response_text
+
+
+def compact_invoice_text(pdf_text: str, max_chars: int = MAX_INVOICE_CHARS) -> str:
+    """
+    Reduz o texto de uma NF antes de enviá-lo ao modelo.
+
+    Colapsa espaços e linhas em branco repetidos (comuns na saída do PyMuPDF)
+    e corta o resultado em `max_chars`, para que mais notas caibam no mesmo
+    orçamento de tokens.
+    """
+    linhas = (" ".join(linha.split()) for linha in pdf_text.splitlines())
+    compacto = "\n".join(linha for linha in linhas if linha)
+    return compacto[:max_chars]
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa grosseira de tokens (~4 caracteres por token)."""
+    return len(text) // 4 + 1
+
+
+def get_invoice_data_with_gemini(pdf_text: str) -> dict:
+    """
+    Envia o texto extraído do PDF para o Gemini e solicita a extração
+    de dados estruturados em formato JSON.
+
+    Args:
+        pdf_text: A string de texto completa extraída do PDF.
+
+    Returns:
+        Um dicionário Python com os dados extraídos.
+    """
+
+    prompt = f"""
+    {EXTRACTION_INSTRUCTIONS}
 
     Texto extraído do PDF:
     ---
-    {pdf_text[:8000]} 
+    {pdf_text[:MAX_INVOICE_CHARS]} 
     ---
 
     Responda APENAS com o objeto JSON, sem nenhum texto adicional ou markdown (como ```json ... ```).
     """
-    # Nota: {pdf_text[:8000]} limita o tamanho do prompt para evitar limites de token.
+    # Nota: MAX_INVOICE_CHARS limita o tamanho do prompt para evitar limites de token.
     # Ajuste se suas NFs forem muito longas.
 
+    response_text = ""
     try:
-        response = model.generate_content(prompt)
-        response_text = response.text.strip()
-
-        # --- Limpeza da Resposta ---
-        # Às vezes, o modelo pode "escapar" e adicionar markdown
-        # Este bloco remove o markdown '```json ... ```' se ele existir.
-        if response_text.startswith("```json"):
-            response_text = response_text[7:-3].strip()
-        elif response_text.startswith("```"):
-             response_text = response_text[3:-3].strip()
-            
+        response_text = _strip_markdown_fences(get_extraction_backend().generate(prompt))
+
         # Converte a string JSON em um dicionário Python
         data = json.loads(response_text)
         return data
@@ -108,8 +176,134 @@ def get_invoice_data_with_gemini(pdf_text: str) -> dict:
         print(f"Erro ao chamar a API do Gemini: {e}")
         raise
 
+
+def build_invoice_batches(documents: dict, token_budget: int = DEFAULT_BATCH_TOKEN_BUDGET) -> list:
+    """
+    Agrupa os documentos em lotes cujo tamanho estimado cabe em `token_budget`.
+
+    Args:
+        documents: Dicionário {doc_id: texto já compactado}.
+        token_budget: Máximo de tokens estimados por requisição (instruções incluídas).
+
+    Returns:
+        Lista de lotes; cada lote é uma lista de pares (doc_id, texto).
+        Um documento que sozinho excede o orçamento vai em um lote próprio.
+    """
+    overhead = estimate_tokens(EXTRACTION_INSTRUCTIONS) + 200
+    batches = []
+    current, current_tokens = [], overhead
+
+    for doc_id, text in documents.items():
+        doc_tokens = estimate_tokens(text) + 20  # cabeçalho do documento
+        if current and current_tokens + doc_tokens > token_budget:
+            batches.append(current)
+            current, current_tokens = [], overhead
+        current.append((doc_id, text))
+        current_tokens += doc_tokens
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _extract_batch_with_gemini(backend, batch: list) -> dict:
+    """
+    Envia um lote de NFs em uma única requisição e devolve {doc_id: dados}
+    apenas para os documentos que vieram corretamente na resposta, isto é,
+    com todos os BATCH_REQUIRED_FIELDS preenchidos.
+    """
+    blocos = "\n".join(
+        f'=== DOCUMENTO doc_id="{doc_id}" ===\n{text}\n=== FIM DO DOCUMENTO ==='
+        for doc_id, text in batch
+    )
+
+    prompt = f"""
+    {EXTRACTION_INSTRUCTIONS}
+
+    A seguir há {len(batch)} notas fiscais, cada uma delimitada por um cabeçalho com o seu doc_id.
+    Para CADA documento, produza um objeto com as chaves acima e mais a chave "doc_id",
+    copiada exatamente do cabeçalho.
+
+    {blocos}
+
+    Responda APENAS com um array JSON contendo um objeto por documento,
+    sem nenhum texto adicional ou markdown (como ```json ... ```).
+    """
+
+    response_text = _strip_markdown_fences(backend.generate(prompt))
+
+    try:
+        items = json.loads(response_text)
+    except json.JSONDecodeError as e:
+        print(f"Erro ao decodificar JSON do lote ({len(batch)} NFs): {e}")
+        return {}
+
+    if not isinstance(items, list):
+        print("Resposta do lote não é um array JSON.")
+        return {}
+
+    esperados = {str(doc_id): doc_id for doc_id, _ in batch}
+    results = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        doc_id = esperados.get(str(item.pop("doc_id", None)))
+        if doc_id is None or doc_id in results:
+            continue
+        faltando = [campo for campo in BATCH_REQUIRED_FIELDS if item.get(campo) in (None, "")]
+        if faltando:
+            print(f"Documento {doc_id} veio incompleto no lote (faltando: {', '.join(faltando)}).")
+            continue
+        results[doc_id] = item
+    return results
+
+
+def get_invoices_data_with_gemini_batch(documents: dict, token_budget: int = DEFAULT_BATCH_TOKEN_BUDGET) -> dict:
+    """
+    Extrai os dados de várias NFs empacotando-as em poucas requisições.
+
+    As instruções do prompt são enviadas uma única vez por lote, o que aumenta
+    o número de NFs processadas por minuto sob o mesmo limite de requisições.
+    Documentos ausentes, inválidos ou incompletos na resposta de um lote são
+    reprocessados individualmente com `get_invoice_data_with_gemini`.
+
+    Args:
+        documents: Dicionário {doc_id: texto extraído do PDF}.
+        token_budget: Máximo de tokens estimados por requisição em lote.
+
+    Returns:
+        Dicionário {doc_id: dados extraídos}. Um documento que falhar também
+        na chamada individual é mapeado para None.
+    """
+    backend = get_extraction_backend()
+    compactos = {doc_id: compact_invoice_text(text) for doc_id, text in documents.items()}
+    results = {}
+
+    for batch in build_invoice_batches(compactos, token_budget):
+        print(f"Enviando lote com {len(batch)} NFs para a IA (Gemini)...")
+        try:
+            batch_results = _extract_batch_with_gemini(backend, batch) if len(batch) > 1 else {}
+        except Exception as e:
+            print(f"Erro ao chamar a API do Gemini para o lote: {e}")
+            batch_results = {}
+        results.update(batch_results)
+
+        # Fallback: documentos que não vieram (completos) no lote são extraídos um a um
+        for doc_id, text in batch:
+            if doc_id in batch_results:
+                continue
+            try:
+                results[doc_id] = get_invoice_data_with_gemini(text)
+            except Exception as e:
+                print(f"Falha na extração individual do documento {doc_id}: {e}")
+                results[doc_id] = None
+
+    return results
+
 # --- Bloco de Teste ---
-# Isso permite que você teste este arquivo de forma independente
+# Isso permite que você teste este arquivo de forma independente.
+# Para rodar sem rede, grave uma vez com EXTRACTION_BACKEND=record
+# e depois repita com EXTRACTION_BACKEND=replay.
 if __name__ == "__main__":
     print("Testando o processador de PDF...")
 
@@ -127,7 +321,7 @@ if __name__ == "__main__":
     VALOR TOTAL DA NOTA: R$ 1.500,50
     """
     
-    print("--- Teste do Gemini ---")
+    print(f"--- Teste do Gemini (backend: {os.getenv('EXTRACTION_BACKEND', 'live')}) ---")
     try:
         extracted_data = get_invoice_data_with_gemini(simulated_pdf_text)
         print("Dados extraídos com sucesso:")
@@ -0,0 +1,157 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Carrega as variáveis de ambiente (WORKFLOW_PROFILE*) do arquivo .env
+load_dotenv()
+
+# Diretório onde os perfis (.prof + .json) são gravados
+PROFILE_DIR = os.getenv("WORKFLOW_PROFILE_DIR", os.path.join("data", "profiles"))
+
+# WORKFLOW_PROFILE=1 perfila todas as execuções; WORKFLOW_PROFILE_SAMPLE_RATE=0.05
+# perfila uma amostra aleatória (5%). Ambos desligados por padrão.
+PROFILE_ALWAYS = os.getenv("WORKFLOW_PROFILE", "0").lower() in ("1", "true", "sim")
+PROFILE_SAMPLE_RATE = float(os.getenv("WORKFLOW_PROFILE_SAMPLE_RATE", "0") or 0)
+
+# Linhas de código que mais alocaram memória, guardadas no resumo
+TOP_ALLOCATIONS = 20
+
+# cProfile e tracemalloc são globais ao processo na prática: só uma execução
+# é perfilada por vez (as demais seguem normalmente, sem perfil).
+_capture_lock = threading.Lock()
+_local = threading.local()
+
+
+def should_profile(force: bool = None) -> bool:
+    """
+    Decide se a execução atual deve ser perfilada.
+    `force` (ex: a opção da UI) tem prioridade sobre a configuração do .env.
+    """
+    if force is not None:
+        return force
+    if PROFILE_ALWAYS:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def tag_current_run(numero_nf):
+    """Associa o número da NF ao perfil em andamento nesta thread (se houver)."""
+    captura = getattr(_local, "captura", None)
+    if captura is not None and numero_nf:
+        captura["numero_nf"] = str(numero_nf)
+
+
+def _safe_name(valor: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_-]+", "-", valor).strip("-") or "sem-numero"
+
+
+@contextmanager
+def capture(tipo: str):
+    """
+    Perfila o bloco com cProfile e mede o pico de memória com tracemalloc.
+
+    Ao final grava em PROFILE_DIR:
+      - <data>_<tipo>_<nf>.prof: dump do cProfile (abra com pstats ou snakeviz).
+      - <data>_<tipo>_<nf>.json: duração, pico de memória e maiores alocações.
+
+    Se outra execução já estiver sendo perfilada, o bloco roda sem perfil.
+    """
+    if not _capture_lock.acquire(blocking=False):
+        print("Perfil não capturado: outra execução já está sendo perfilada.")
+        yield
+        return
+
+    captura = {"tipo": tipo, "numero_nf": None}
+    _local.captura = captura
+    iniciou_tracemalloc = not tracemalloc.is_tracing()
+    if iniciou_tracemalloc:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    profile = cProfile.Profile()
+    inicio = datetime.now()
+    t0 = time.perf_counter()
+    try:
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            duracao = time.perf_counter() - t0
+            _, pico = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            if iniciou_tracemalloc:
+                tracemalloc.stop()
+            _save(profile, snapshot, captura, inicio, duracao, pico)
+    finally:
+        _local.captura = None
+        _capture_lock.release()
+
+
+def _save(profile, snapshot, captura: dict, inicio: datetime, duracao: float, pico: int):
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        # Microssegundos no nome: duas execuções no mesmo segundo não se sobrescrevem
+        nome = f"{inicio:%Y%m%d_%H%M%S_%f}_{captura['tipo']}_{_safe_name(captura['numero_nf'] or '')}"
+        caminho_prof = os.path.join(PROFILE_DIR, f"{nome}.prof")
+        profile.dump_stats(caminho_prof)
+
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ])
+        alocacoes = [
+            {"local": str(stat.traceback), "tamanho_bytes": stat.size, "blocos": stat.count}
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+        ]
+        resumo = {
+            "nome": nome,
+            "tipo": captura["tipo"],
+            "numero_nf": captura["numero_nf"],
+            "inicio": inicio.isoformat(timespec="seconds"),
+            "duracao_segundos": round(duracao, 3),
+            "pico_memoria_bytes": pico,
+            "maiores_alocacoes": alocacoes,
+        }
+        with open(os.path.join(PROFILE_DIR, f"{nome}.json"), "w", encoding="utf-8") as f:
+            json.dump(resumo, f, ensure_ascii=False, indent=2)
+        print(f"Perfil gravado em {caminho_prof} ({duracao:.1f}s, pico de memória {pico / 1024 / 1024:.1f} MiB)")
+    except OSError as e:
+        print(f"Erro ao gravar o perfil: {e}")
+
+
+def list_profiles() -> list:
+    """Resumos (.json) dos perfis gravados, do mais recente para o mais antigo."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    resumos = []
+    for arquivo in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if not arquivo.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, arquivo), encoding="utf-8") as f:
+                resumos.append(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Erro ao ler o perfil '{arquivo}': {e}")
+    return resumos
+
+
+def profile_path(nome: str) -> str:
+    """Caminho do dump .prof de um perfil listado por list_profiles()."""
+    return os.path.join(PROFILE_DIR, f"{_safe_name(nome)}.prof")
+
+
+def format_stats(nome: str, sort: str = "cumulative", limit: int = 30) -> str:
+    """Relatório em texto do pstats (as `limit` funções mais caras)."""
+    saida = io.StringIO()
+    pstats.Stats(profile_path(nome), stream=saida).strip_dirs().sort_stats(sort).print_stats(limit)
+    return saida.getvalue()
@@ -0,0 +1,137 @@
+import argparse
+import csv
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+import db_manager
+import pdf_processor
+
+# Chamadas simultâneas ao extrator (respeite o limite de requisições da API)
+DEFAULT_CONCURRENCY = 4
+
+# Campos comparados entre a extração original e a nova
+COMPARED_FIELDS = ('numero_nf', 'data_nf', 'fornecedor_nf', 'valor_nf', 'numero_pedido')
+
+REPORT_DIR = os.path.join("data", "relatorios")
+
+
+def _normalize(field: str, value):
+    """Normaliza valores para que diferenças só de formatação não apareçam no relatório."""
+    if value is None:
+        return None
+    if field == 'valor_nf':
+        try:
+            return round(float(value), 2)
+        except (TypeError, ValueError):
+            return str(value).strip()
+    return str(value).strip()
+
+
+def diff_extraction(row, new_data: dict) -> list:
+    """
+    Compara a linha armazenada com a nova extração.
+
+    Returns:
+        Lista de tuplas (campo, valor_antigo, valor_novo) dos campos que mudaram.
+    """
+    diferencas = []
+    for field in COMPARED_FIELDS:
+        antigo = _normalize(field, row[field])
+        novo = _normalize(field, new_data.get(field))
+        if antigo != novo:
+            diferencas.append((field, antigo, novo))
+    return diferencas
+
+
+def _reextract_row(row) -> tuple:
+    """
+    Executada nas threads: descomprime o texto e chama o extrator atual.
+    Qualquer erro (inclusive texto armazenado corrompido) é devolvido para
+    ser registrado no relatório, sem interromper a reextração.
+    """
+    try:
+        texto = db_manager.decompress_text(row['texto_comprimido'])
+        return row, pdf_processor.get_invoice_data_with_gemini(texto), None
+    except Exception as e:
+        return row, None, e
+
+
+def run_reextraction(report_path: str = None, concurrency: int = DEFAULT_CONCURRENCY,
+                     include_archive: bool = False, since: datetime = None) -> dict:
+    """
+    Reprocessa os textos armazenados com o extrator atual (prompt/modelo
+    configurados em pdf_processor) e grava um relatório CSV com os campos
+    que mudaram. Não altera o banco nem lê PDFs.
+
+    As NFs são lidas do banco em streaming e no máximo `concurrency`
+    chamadas ao extrator ficam em andamento ao mesmo tempo.
+
+    Returns:
+        Um dicionário com os totais: processadas, alteradas e erros.
+    """
+    if report_path is None:
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        report_path = os.path.join(REPORT_DIR, f"reextracao_{datetime.now():%Y%m%d_%H%M%S}.csv")
+
+    # Cria o backend de extração (live/record/replay) antes das threads, que
+    # passam a compartilhar a mesma instância e o mesmo cassete
+    pdf_processor.get_extraction_backend()
+
+    totais = {'processadas': 0, 'alteradas': 0, 'erros': 0}
+    print(f"Iniciando reextração (concorrência: {concurrency}). Relatório: {report_path}")
+
+    with open(report_path, "w", newline="", encoding="utf-8") as f, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+        writer = csv.writer(f)
+        writer.writerow(["processamento_id", "numero_nf", "campo", "valor_antigo", "valor_novo"])
+
+        def _registrar(future):
+            row, new_data, erro = future.result()
+            totais['processadas'] += 1
+            if erro is not None:
+                totais['erros'] += 1
+                writer.writerow([row['id'], row['numero_nf'], "ERRO", "", str(erro)])
+                return
+            diferencas = diff_extraction(row, new_data)
+            if diferencas:
+                totais['alteradas'] += 1
+                for campo, antigo, novo in diferencas:
+                    writer.writerow([row['id'], row['numero_nf'], campo, antigo, novo])
+
+        # Contrapressão: nunca há mais que 2x `concurrency` tarefas na fila,
+        # então a memória não cresce com o tamanho do backlog
+        em_andamento = set()
+        for row in db_manager.iter_stored_texts(include_archive=include_archive, since=since):
+            if len(em_andamento) >= concurrency * 2:
+                concluidas, em_andamento = wait(em_andamento, return_when=FIRST_COMPLETED)
+                for future in concluidas:
+                    _registrar(future)
+            em_andamento.add(executor.submit(_reextract_row, row))
+
+        for future in wait(em_andamento).done:
+            _registrar(future)
+
+    print(f"Reextração concluída: {totais['processadas']} NFs processadas, "
+          f"{totais['alteradas']} com campos alterados, {totais['erros']} erro(s).")
+    return totais
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Reextrai os dados das NFs a partir dos textos armazenados e gera um relatório de diferenças."
+    )
+    parser.add_argument("--saida", default=None, help="Caminho do relatório CSV (padrão: data/relatorios/reextracao_<data>.csv).")
+    parser.add_argument("--concorrencia", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Chamadas simultâneas ao extrator (padrão: {DEFAULT_CONCURRENCY}).")
+    parser.add_argument("--incluir-arquivadas", action="store_true", help="Inclui as NFs já arquivadas.")
+    parser.add_argument("--desde", type=lambda s: datetime.strptime(s, "%Y-%m-%d"), default=None,
+                        help="Só NFs recebidas a partir desta data (AAAA-MM-DD).")
+    args = parser.parse_args()
+
+    run_reextraction(
+        report_path=args.saida,
+        concurrency=args.concorrencia,
+        include_archive=args.incluir_arquivadas,
+        since=args.desde
+    )
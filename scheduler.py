@@ -1,5 +1,10 @@
+import os
+import socket
+import uuid
 import db_manager
 import email_manager
+import nf_status
+import archiver
 from datetime import datetime, timedelta
 from apscheduler.schedulers.blocking import BlockingScheduler
 # Attempt to import python-dotenv; if unavailable, provide a minimal fallback.
@@ -18,7 +23,6 @@ def load_dotenv(env_path: str = ".env"):
     if _load_dotenv:
         return _load_dotenv(env_path)
 
-    import os
     from pathlib import Path
 
     path = Path(env_path)
@@ -47,85 +51,98 @@ load_dotenv()
 
 print("Módulo de Scheduler importado. As variáveis de ambiente foram carregadas.")
 
+# Prazo para o solicitante responder antes do TIMEOUT
+TIMEOUT_HOURS = 48
+
+# NFs reservadas por vez e duração do lease (ver db_manager.claim_expired_validations)
+CLAIM_BATCH_SIZE = 50
+LEASE_SECONDS = 300
+
+# Identificador desta instância do scheduler. Várias instâncias (HA, ou
+# hosts diferentes partilhando o mesmo ficheiro de banco) podem correr em
+# paralelo: cada uma só processa as NFs que reservou.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
 def check_timeouts():
     """
     Função principal do job.
-    1. Busca NFs com status 'PENDING_VALIDATION'.
-    2. Compara o 'timestamp_envio' com o tempo atual.
-    3. Se > 48 horas, atualiza o status para 'TIMEOUT' e notifica o financeiro.
+    1. Reserva (lease) lotes de NFs 'PENDING_VALIDATION' enviadas há mais de 48 horas.
+    2. Para cada NF reservada, faz a transição para 'TIMEOUT' e notifica o financeiro.
+    3. Repete até não haver mais NFs expiradas livres.
     """
     
     agora = datetime.now()
-    print(f"\n[{agora.strftime('%Y-%m-%d %H:%M:%S')}] Executando verificação de timeouts...")
+    print(f"\n[{agora.strftime('%Y-%m-%d %H:%M:%S')}] Executando verificação de timeouts (worker {WORKER_ID})...")
     
+    # Define o limite de tempo
+    limite_de_tempo = agora - timedelta(hours=TIMEOUT_HOURS)
+    total_processadas = 0
+
     try:
-        pending_nfs = db_manager.get_pending_validations()
-        
-        if not pending_nfs:
-            print("Nenhuma NF pendente de validação encontrada.")
-            return
-
-        print(f"Encontradas {len(pending_nfs)} NFs pendentes. A analisar...")
-        
-        # Define o limite de tempo
-        limite_de_tempo = agora - timedelta(hours=48)
-        
-        for nf in pending_nfs:
-            # O timestamp_envio vem do DB como uma string.
-            # Precisamos convertê-lo de volta para um objeto datetime.
+        while True:
+            # Passo 1: Reservar um lote de NFs expiradas.
+            # A reserva é atômica: outra instância nunca recebe as mesmas linhas,
+            # e leases de instâncias que caíram são recuperados após expirarem.
+            claimed = db_manager.claim_expired_validations(
+                WORKER_ID, limite_de_tempo, batch_size=CLAIM_BATCH_SIZE, lease_seconds=LEASE_SECONDS
+            )
+            if not claimed:
+                break
+
+            print(f"Reservadas {len(claimed)} NFs expiradas. A processar...")
+            pendentes_ids = [nf['id'] for nf in claimed]
+
             try:
-                # Tenta analisar o formato com microsegundos
-                timestamp_envio = datetime.strptime(nf['timestamp_envio'], '%Y-%m-%d %H:%M:%S.%f')
-            except ValueError:
-                # Se falhar, tenta analisar o formato sem microsegundos
-                try:
-                    timestamp_envio = datetime.strptime(nf['timestamp_envio'], '%Y-%m-%d %H:%M:%S')
-                except ValueError as e:
-                    print(f"  -> ERRO: Formato de data inválido '{nf['timestamp_envio']}' para o token {nf['validation_token']}. Ignorando. Erro: {e}")
-                    continue # Pula para a próxima NF na lista
-
-            # Compara o timestamp de envio com o limite de 48h atrás
-            if timestamp_envio < limite_de_tempo:
-                print(f"  -> TIMEOUT: A NF {nf['numero_nf']} (Token: {nf['validation_token']}) expirou.")
-                
-                # Passo 1: Atualizar o status no DB para 'TIMEOUT'
-                # A função update_processing_status_by_token já verifica
-                # se o status ainda é 'PENDING_VALIDATION', evitando
-                # que um status 'APPROVED' seja sobrescrito.
-                updated = db_manager.update_processing_status_by_token(nf['validation_token'], 'TIMEOUT')
-                
-                if updated:
-                    # Passo 2: Notificar o setor financeiro
-                    print(f"  -> Status atualizado. A notificar o financeiro...")
+                for nf in claimed:
+                    print(f"  -> TIMEOUT: A NF {nf['numero_nf']} (Token: {nf['validation_token']}) expirou.")
                     
-                    # Busca todos os dados necessários para o e-mail
-                    data_for_email = db_manager.get_data_for_finance_email(nf['validation_token'])
+                    # Passo 2: Transição para 'TIMEOUT' (grava também o histórico e libera o lease)
+                    # A transição só ocorre se o status ainda for 'PENDING_VALIDATION',
+                    # evitando que um status 'APPROVED' seja sobrescrito, e já
+                    # devolve todos os dados necessários para o e-mail.
+                    data_for_email = db_manager.transition_status(nf['id'], nf_status.TIMEOUT, origem='scheduler')
+                    pendentes_ids.remove(nf['id'])
                     
                     if data_for_email:
+                        # Passo 3: Notificar o setor financeiro
+                        print(f"  -> Status atualizado. A notificar o financeiro...")
                         email_manager.send_finance_email(
                             nf_data=data_for_email,
                             pedido_data=data_for_email,
-                            status='TIMEOUT'
+                            status=nf_status.TIMEOUT
                         )
                         print(f"  -> E-mail de TIMEOUT para a NF {nf['numero_nf']} enviado.")
+                        total_processadas += 1
+                    
                     else:
-                        print(f"  -> ERRO CRÍTICO: Não foi possível obter dados para o e-mail (Token: {nf['validation_token']})")
-                
-                else:
-                    # Isto pode acontecer se o utilizador aprovou/rejeitou
-                    # exatamente ao mesmo tempo que o scheduler estava a correr.
-                    print(f"  -> A NF {nf['numero_nf']} já foi processada (provavelmente aprovada/rejeitada). Nenhuma ação de timeout tomada.")
-            
-            else:
-                # Ainda dentro do prazo
-                tempo_restante = (timestamp_envio + timedelta(hours=48)) - agora
-                horas_restantes = tempo_restante.total_seconds() / 3600
-                print(f"  -> OK: A NF {nf['numero_nf']} ainda está dentro do prazo (restam {horas_restantes:.2f} horas).")
+                        # Isto pode acontecer se o utilizador aprovou/rejeitou
+                        # exatamente ao mesmo tempo que o scheduler estava a correr.
+                        print(f"  -> A NF {nf['numero_nf']} já foi processada (provavelmente aprovada/rejeitada). Nenhuma ação de timeout tomada.")
+            finally:
+                # Em caso de erro, devolve as NFs ainda não processadas do lote
+                # para que outra execução (ou instância) as retome de imediato.
+                db_manager.release_leases(WORKER_ID, pendentes_ids)
+
+        if total_processadas:
+            print(f"Verificação concluída: {total_processadas} NF(s) marcadas como TIMEOUT.")
+        else:
+            print("Nenhuma NF pendente expirada encontrada.")
 
     except Exception as e:
         print(f"ERRO CRÍTICO na execução do 'check_timeouts': {e}")
         # O scheduler continuará a tentar na próxima execução
 
+def run_archival_job():
+    """
+    Job diário: move as NFs finalizadas antigas para o banco de arquivo
+    (ver archiver.py), mantendo a tabela quente pequena.
+    """
+    try:
+        archiver.run_archival()
+    except Exception as e:
+        print(f"ERRO CRÍTICO na execução do arquivamento: {e}")
+        # O scheduler continuará a tentar na próxima execução
+
 if __name__ == "__main__":
     # --- Configuração do Scheduler ---
     
@@ -136,6 +153,9 @@ if __name__ == "__main__":
     # Adiciona a tarefa (job) para executar a função 'check_timeouts'
     # a cada 1 hora. (Pode ajustar para 'minutes=30', etc.)
     scheduler.add_job(check_timeouts, 'interval', hours=1)
+
+    # Arquivamento das NFs finalizadas, uma vez por dia de madrugada
+    scheduler.add_job(run_archival_job, 'cron', hour=3)
     
     print("--- Agente de Scheduler de Timeouts ---")
     print("Este processo verifica o banco de dados por NFs expiradas.")
@@ -1,9 +1,21 @@
 import sqlite3
 import os
 
+import db_manager
+
 DB_FILE = os.path.join("data", "pedidos.db")
 DB_DIR = "data"
 
+def _add_column_if_missing(cursor, table, column, definition):
+    """
+    Adiciona uma coluna a uma tabela já existente (bancos criados antes da
+    coluna existir). CREATE TABLE IF NOT EXISTS não altera tabelas antigas.
+    """
+    existentes = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()}
+    if column not in existentes:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        print(f"Coluna '{column}' adicionada à tabela '{table}'.")
+
 def create_database():
     """
     Cria a estrutura inicial do banco de dados SQLite e insere dados de exemplo.
@@ -18,6 +30,11 @@ def create_database():
     
     print(f"Banco de dados '{DB_FILE}' conectado/criado.")
 
+    # Permite devolver ao disco, aos poucos, o espaço liberado pelo arquivamento
+    # (archiver.py). Só tem efeito em um banco novo; bancos existentes são
+    # convertidos uma vez com 'python archiver.py --migrar-vacuum'.
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
     # --- Tabela 1: Solicitantes ---
     # Armazena informações das pessoas que fazem os pedidos
     try:
@@ -67,15 +84,255 @@ def create_database():
             status TEXT NOT NULL,
             validation_token TEXT NOT NULL UNIQUE,
             timestamp_envio DATETIME NOT NULL,
+            pdf_hash TEXT,
+            lease_owner TEXT,
+            lease_expira_em DATETIME,
+            texto_comprimido BLOB,
             FOREIGN KEY (pedido_id) REFERENCES ControleDePedidos (id)
         );
         """)
+        # Hash SHA-256 do PDF original no blob_store.py
+        _add_column_if_missing(cursor, "ProcessamentoNF", "pdf_hash", "TEXT")
+        # Lease de processamento: qual instância do scheduler reservou a linha e até quando
+        _add_column_if_missing(cursor, "ProcessamentoNF", "lease_owner", "TEXT")
+        _add_column_if_missing(cursor, "ProcessamentoNF", "lease_expira_em", "DATETIME")
+        # Texto extraído do PDF, comprimido com zlib (permite reextrair sem o PDF)
+        _add_column_if_missing(cursor, "ProcessamentoNF", "texto_comprimido", "BLOB")
+        # Usado pelo scheduler (pendentes) e pelo archiver (finalizadas antigas)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_processamento_status_data ON ProcessamentoNF (status, timestamp_envio);")
         print("Tabela 'ProcessamentoNF' criada com sucesso.")
     except sqlite3.Error as e:
         print(f"Erro ao criar tabela 'ProcessamentoNF': {e}")
         conn.close()
         return
 
+    # --- Tabela 4: ProcessamentoNFHistory ---
+    # Trilha de auditoria: uma linha por transição de status (ver nf_status.py)
+    try:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ProcessamentoNFHistory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            processamento_id INTEGER NOT NULL,
+            status_anterior TEXT NOT NULL,
+            status_novo TEXT NOT NULL,
+            origem TEXT NOT NULL,
+            timestamp_mudanca DATETIME NOT NULL,
+            FOREIGN KEY (processamento_id) REFERENCES ProcessamentoNF (id)
+        );
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_processamento ON ProcessamentoNFHistory (processamento_id);")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_status_data ON ProcessamentoNFHistory (status_novo, timestamp_mudanca);")
+        print("Tabela 'ProcessamentoNFHistory' criada com sucesso.")
+    except sqlite3.Error as e:
+        print(f"Erro ao criar tabela 'ProcessamentoNFHistory': {e}")
+        conn.close()
+        return
+
+    # --- Tabelas 5 e 6: Resumos do dashboard de operações ---
+    # Mantidas incrementalmente pelo db_manager, na mesma transação
+    # que altera o ProcessamentoNF. Em um banco que já tinha NFs, são
+    # populadas ao final (rebuild_dashboard_summaries); vazias, a primeira
+    # transição deixaria o backlog de pendentes negativo.
+    try:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ResumoPendentes'")
+        popular_resumos = cursor.fetchone() is None and \
+            cursor.execute("SELECT 1 FROM ProcessamentoNF LIMIT 1").fetchone() is not None
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ResumoDiarioStatus (
+            dia TEXT NOT NULL,
+            status TEXT NOT NULL,
+            centro_de_custos TEXT NOT NULL,
+            quantidade INTEGER NOT NULL DEFAULT 0,
+            valor_total REAL NOT NULL DEFAULT 0,
+            soma_segundos_resposta REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (dia, status, centro_de_custos)
+        );
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ResumoPendentes (
+            centro_de_custos TEXT PRIMARY KEY,
+            quantidade INTEGER NOT NULL DEFAULT 0,
+            valor_total REAL NOT NULL DEFAULT 0
+        );
+        """)
+        print("Tabelas de resumo do dashboard criadas com sucesso.")
+    except sqlite3.Error as e:
+        print(f"Erro ao criar tabelas de resumo do dashboard: {e}")
+        conn.close()
+        return
+
+    # --- Tabela 7: ProcessamentoNFBusca (índice de texto completo FTS5) ---
+    # rowid = ProcessamentoNF.id. Indexa o texto extraído do PDF e os campos
+    # principais, para buscas do tipo "NFs do fornecedor X que citam o contrato Y".
+    # É "contentless" (content=''): guarda só o índice, não uma cópia do texto,
+    # que já fica comprimido em ProcessamentoNF.texto_comprimido.
+    definicao_busca = """
+        numero_nf,
+        fornecedor_nf,
+        numero_pedido,
+        texto,
+        tokenize = 'unicode61 remove_diacritics 2',
+        content = ''
+    """
+    try:
+        cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS ProcessamentoNFBusca USING fts5({definicao_busca});")
+        # Bancos antigos têm o índice com conteúdo (tabela-sombra _content com o
+        # texto sem compressão): copia o índice para uma tabela contentless
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'ProcessamentoNFBusca_content'")
+        if cursor.fetchone():
+            cursor.execute(f"CREATE VIRTUAL TABLE ProcessamentoNFBusca_nova USING fts5({definicao_busca});")
+            cursor.execute("""
+            INSERT INTO ProcessamentoNFBusca_nova (rowid, numero_nf, fornecedor_nf, numero_pedido, texto)
+            SELECT rowid, numero_nf, fornecedor_nf, numero_pedido, texto FROM ProcessamentoNFBusca;
+            """)
+            cursor.execute("DROP TABLE ProcessamentoNFBusca;")
+            cursor.execute("ALTER TABLE ProcessamentoNFBusca_nova RENAME TO ProcessamentoNFBusca;")
+            print("Índice 'ProcessamentoNFBusca' migrado para FTS5 sem cópia do texto (contentless).")
+        # Indexa os campos das NFs registradas antes do índice existir (sem o texto)
+        cursor.execute("""
+        INSERT INTO ProcessamentoNFBusca (rowid, numero_nf, fornecedor_nf, numero_pedido, texto)
+        SELECT pnf.id, pnf.numero_nf, pnf.fornecedor_nf, cp.numero_pedido, ''
+        FROM ProcessamentoNF pnf
+        JOIN ControleDePedidos cp ON pnf.pedido_id = cp.id
+        WHERE pnf.id NOT IN (SELECT rowid FROM ProcessamentoNFBusca);
+        """)
+        print("Tabela 'ProcessamentoNFBusca' (FTS5) criada com sucesso.")
+    except sqlite3.Error as e:
+        print(f"Erro ao criar tabela 'ProcessamentoNFBusca': {e}")
+        conn.close()
+        return
+
+    # --- Tabelas 8 e 9: Controle da ingestão por e-mail (mailbox_ingestor.py) ---
+    # Evitam reprocessar a mesma mensagem (Message-ID) ou o mesmo PDF (hash).
+    try:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS MensagensIngeridas (
+            message_id TEXT PRIMARY KEY,
+            origem TEXT NOT NULL,
+            timestamp_ingestao DATETIME NOT NULL
+        );
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS AnexosIngeridos (
+            pdf_hash TEXT PRIMARY KEY,
+            message_id TEXT NOT NULL,
+            nome_arquivo TEXT,
+            resultado TEXT,
+            timestamp_ingestao DATETIME NOT NULL
+        );
+        """)
+        # Tentativas com falha por mensagem: a mensagem fica na caixa de entrada
+        # e é reprocessada até o limite do mailbox_ingestor.py
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS FalhasIngestao (
+            message_id TEXT PRIMARY KEY,
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            ultimo_erro TEXT,
+            timestamp_falha DATETIME NOT NULL
+        );
+        """)
+        print("Tabelas de ingestão por e-mail criadas com sucesso.")
+    except sqlite3.Error as e:
+        print(f"Erro ao criar tabelas de ingestão por e-mail: {e}")
+        conn.close()
+        return
+
+    # --- Tabela 10: AvaliacoesRegras ---
+    # Registro de cada avaliação das regras de aprovação automática (auto_approval.py)
+    try:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS AvaliacoesRegras (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            processamento_id INTEGER NOT NULL,
+            regra TEXT NOT NULL,
+            passou INTEGER NOT NULL,
+            detalhe TEXT,
+            timestamp_avaliacao DATETIME NOT NULL,
+            FOREIGN KEY (processamento_id) REFERENCES ProcessamentoNF (id)
+        );
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_avaliacoes_processamento ON AvaliacoesRegras (processamento_id);")
+        print("Tabela 'AvaliacoesRegras' criada com sucesso.")
+    except sqlite3.Error as e:
+        print(f"Erro ao criar tabela 'AvaliacoesRegras': {e}")
+        conn.close()
+        return
+
+    # --- Tabela 11: SaldoPedidos ---
+    # Totais faturado (NFs pendentes + aprovadas) e aprovado por pedido,
+    # mantidos pelo db_manager na mesma transação de cada mudança de status.
+    try:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS SaldoPedidos (
+            pedido_id INTEGER PRIMARY KEY,
+            valor_faturado REAL NOT NULL DEFAULT 0,
+            valor_aprovado REAL NOT NULL DEFAULT 0,
+            quantidade_nfs INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (pedido_id) REFERENCES ControleDePedidos (id)
+        );
+        """)
+        # Popula o saldo dos pedidos que já tinham NFs antes da tabela existir
+        cursor.execute("""
+        INSERT OR IGNORE INTO SaldoPedidos (pedido_id, valor_faturado, valor_aprovado, quantidade_nfs)
+        SELECT pedido_id,
+               TOTAL(CASE WHEN status IN ('PENDING_VALIDATION', 'APPROVED') THEN valor_nf END),
+               TOTAL(CASE WHEN status = 'APPROVED' THEN valor_nf END),
+               COUNT(*)
+        FROM ProcessamentoNF
+        GROUP BY pedido_id;
+        """)
+        print("Tabela 'SaldoPedidos' criada com sucesso.")
+    except sqlite3.Error as e:
+        print(f"Erro ao criar tabela 'SaldoPedidos': {e}")
+        conn.close()
+        return
+
+    # --- Tabela 12: VersaoCadastro ---
+    # Contador incrementado por triggers a cada mudança em ControleDePedidos ou
+    # Solicitantes (inclusive por outros processos, como o alterar_email.py).
+    # Usado pelo db_manager para invalidar o cache de consultas de pedidos.
+    try:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS VersaoCadastro (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            versao INTEGER NOT NULL DEFAULT 0
+        );
+        """)
+        cursor.execute("INSERT OR IGNORE INTO VersaoCadastro (id, versao) VALUES (1, 0);")
+        for tabela in ("ControleDePedidos", "Solicitantes"):
+            for evento in ("INSERT", "UPDATE", "DELETE"):
+                cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_versao_{tabela.lower()}_{evento.lower()}
+                AFTER {evento} ON {tabela}
+                BEGIN
+                    UPDATE VersaoCadastro SET versao = versao + 1 WHERE id = 1;
+                END;
+                """)
+        print("Tabela 'VersaoCadastro' criada com sucesso.")
+    except sqlite3.Error as e:
+        print(f"Erro ao criar tabela 'VersaoCadastro': {e}")
+        conn.close()
+        return
+
+    # --- Tabela 13: ExportacoesNF ---
+    # Marca d'água de cada exportação incremental (ver export_nf.py):
+    # maiores ids de ProcessamentoNF e do histórico já exportados.
+    try:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ExportacoesNF (
+            nome TEXT PRIMARY KEY,
+            ultimo_nf_id INTEGER NOT NULL,
+            ultimo_historico_id INTEGER NOT NULL,
+            linhas INTEGER NOT NULL,
+            atualizado_em DATETIME NOT NULL
+        );
+        """)
+        print("Tabela 'ExportacoesNF' criada com sucesso.")
+    except sqlite3.Error as e:
+        print(f"Erro ao criar tabela 'ExportacoesNF': {e}")
+        conn.close()
+        return
+
     # --- Inserir Dados de Exemplo (para teste) ---
     try:
         # Inserir um solicitante (ignora se o e-mail já existir)
@@ -108,5 +365,10 @@ def create_database():
         conn.close()
         print(f"Conexão com '{DB_FILE}' fechada.")
 
+    # Depois do commit: o recálculo usa a sua própria conexão e transação
+    if popular_resumos:
+        print("Populando as tabelas de resumo do dashboard com as NFs existentes...")
+        db_manager.rebuild_dashboard_summaries()
+
 if __name__ == "__main__":
     create_database()
\ No newline at end of file
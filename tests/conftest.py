@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+# Os módulos do projeto ficam na raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Lidos na importação dos módulos
+os.environ.setdefault("VALIDATION_TOKEN_SECRET", "segredo-de-teste")
+os.environ.setdefault("GEMINI_API_KEY", "chave-de-teste")
+
+import db_manager
+import setup_db
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Banco novo (setup_db.py) em um diretório temporário, com os pedidos de exemplo."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    setup_db.create_database()
+    db_manager.clear_order_cache()
+    yield
+    db_manager.clear_order_cache()
+
+
+@pytest.fixture
+def sent_emails(monkeypatch):
+    """Substitui o envio de e-mails e devolve a lista de chamadas."""
+    import email_manager
+
+    enviados = []
+    monkeypatch.setattr(email_manager, "send_finance_email", lambda **kwargs: enviados.append(("financeiro", kwargs)))
+    monkeypatch.setattr(email_manager, "send_validation_email", lambda **kwargs: enviados.append(("validacao", kwargs)))
+    return enviados
+
+
+def create_invoice(numero_pedido="PED-1001-XYZ", numero_nf="1", valor_nf=100.0, token=None):
+    """Registra uma NF pendente para o pedido e devolve o id do processamento."""
+    pedido = db_manager.get_order_details_by_number(numero_pedido)
+    nf_data = {"numero_nf": numero_nf, "data_nf": "01/10/2025", "fornecedor_nf": "ACME LTDA", "valor_nf": valor_nf}
+    return db_manager.create_processing_entry(nf_data, pedido["pedido_id"], token or f"token-{numero_nf}")
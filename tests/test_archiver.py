@@ -0,0 +1,73 @@
+import pytest
+
+import archiver
+import db_manager
+import nf_status
+from conftest import create_invoice
+
+
+def _auto_vacuum():
+    conn = db_manager.get_db_connection()
+    try:
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_full_vacuum_only_runs_as_explicit_migration(db):
+    conn = db_manager.get_db_connection()
+    conn.execute("PRAGMA auto_vacuum = NONE")
+    conn.execute("VACUUM")
+    conn.close()
+    nf_id = create_invoice()
+    db_manager.transition_status(nf_id, nf_status.APPROVED, "link")
+
+    assert archiver.run_archival(dias=-1) == 1
+    assert _auto_vacuum() == 0
+
+    assert archiver.migrate_incremental_vacuum() is True
+    assert _auto_vacuum() == 2
+    assert archiver.migrate_incremental_vacuum() is False
+
+
+def test_query_all_processing_entries_uses_parameters(db):
+    quente = create_invoice(numero_nf="1")
+    arquivada = create_invoice(numero_nf="2")
+    db_manager.transition_status(arquivada, nf_status.REJECTED, "link")
+    archiver.run_archival(dias=-1)
+
+    assert [row['id'] for row in db_manager.query_all_processing_entries(numero_nf="2")] == [arquivada]
+    assert [row['id'] for row in db_manager.query_all_processing_entries()] == [quente, arquivada]
+    assert db_manager.query_all_processing_entries(numero_nf="1' OR '1' = '1") == []
+    with pytest.raises(ValueError):
+        db_manager.query_all_processing_entries(**{"1 = 1 OR numero_nf": "x"})
+
+
+def _summaries():
+    conn = db_manager.get_db_connection()
+    try:
+        diario = conn.execute(
+            "SELECT dia, status, centro_de_custos, quantidade, round(valor_total, 2) FROM ResumoDiarioStatus "
+            "ORDER BY dia, status, centro_de_custos"
+        ).fetchall()
+        pendentes = conn.execute(
+            "SELECT centro_de_custos, quantidade, round(valor_total, 2) FROM ResumoPendentes "
+            "WHERE quantidade > 0 ORDER BY centro_de_custos"
+        ).fetchall()
+        return [tuple(r) for r in diario], [tuple(r) for r in pendentes]
+    finally:
+        conn.close()
+
+
+def test_rebuild_dashboard_summaries_includes_archived_invoices(db):
+    aprovada = create_invoice(numero_nf="1", valor_nf=100.0)
+    rejeitada = create_invoice(numero_pedido="PED-1002-ABC", numero_nf="2", valor_nf=50.0)
+    create_invoice(numero_nf="3", valor_nf=25.0)
+    db_manager.transition_status(aprovada, nf_status.APPROVED, "link")
+    db_manager.transition_status(rejeitada, nf_status.REJECTED, "link")
+    esperado = _summaries()
+
+    assert archiver.run_archival(dias=-1) == 2
+    assert db_manager.rebuild_dashboard_summaries() is True
+
+    assert _summaries() == esperado
@@ -0,0 +1,59 @@
+import csv
+import os
+
+import audit_report
+import db_manager
+from conftest import create_invoice
+
+
+def _read(diretorio, secao):
+    caminho = os.path.join(diretorio, f"{secao}.csv")
+    if not os.path.exists(caminho):
+        return []
+    with open(caminho, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def test_duplicates_are_grouped_by_normalized_key(db, tmp_path):
+    a = create_invoice(numero_nf="0012")
+    b = create_invoice(numero_pedido="PED-1002-ABC", numero_nf="12")
+    create_invoice(numero_nf="13")
+    conn = db_manager.get_db_connection()
+    conn.execute("UPDATE ProcessamentoNF SET fornecedor_nf = '  acme   ltda ' WHERE id = ?", (b,))
+    conn.commit()
+    conn.close()
+
+    saida = tmp_path / "auditoria"
+    audit_report.run_audit(output_dir=str(saida), chunk_size=1)
+
+    duplicadas = _read(saida, "duplicidades")
+    assert sorted(int(l["id"]) for l in duplicadas) == [a, b]
+    assert {l["chave_duplicidade"] for l in duplicadas} == {"acme ltda|12"}
+
+
+def test_non_numeric_amount_is_reported_as_divergence(db, tmp_path):
+    ok = create_invoice(numero_nf="20", valor_nf=1500.50)
+    ruim = create_invoice(numero_nf="21", valor_nf="R$ 1.500,50")
+
+    saida = tmp_path / "auditoria"
+    audit_report.run_audit(output_dir=str(saida))
+
+    divergentes = [int(l["id"]) for l in _read(saida, "divergencias_valor")]
+    assert ruim in divergentes
+    assert ok not in divergentes
+
+
+def test_parquet_sections_keep_schema_when_first_chunk_has_empty_column(db, tmp_path):
+    import pyarrow.parquet as pq
+
+    sem_numero = create_invoice(numero_nf=None)
+    com_numero = create_invoice(numero_nf="30")
+
+    saida = tmp_path / "auditoria"
+    contagens = audit_report.run_audit(output_dir=str(saida), fmt="parquet", chunk_size=1)
+
+    assert contagens["divergencias_valor"] == 2
+    tabela = pq.read_table(os.path.join(saida, "divergencias_valor.parquet"))
+    assert str(tabela.schema.field("numero_nf").type) == "string"
+    assert tabela.column("id").to_pylist() == [sem_numero, com_numero]
+    assert tabela.column("numero_nf").to_pylist() == [None, "30"]
@@ -0,0 +1,144 @@
+import io
+import json
+
+import pytest
+
+import auto_approval
+import db_manager
+import nf_status
+import pdf_processor
+import workflow_manager
+from conftest import create_invoice
+
+PEDIDO = {"pedido_id": 1, "numero_pedido": "PED-1001-XYZ", "valor_pedido": 1000.0, "centro_de_custos": "TI-INFRA"}
+
+
+def _nf(valor_nf=1000.0, fornecedor_nf="Soluções em TI Ltda"):
+    return {"numero_nf": "1", "fornecedor_nf": fornecedor_nf, "valor_nf": valor_nf, "numero_pedido": "PED-1001-XYZ"}
+
+
+@pytest.mark.parametrize("valor_nf, aprovar", [(1004.99, True), (1005.01, False), ("não numérico", False)])
+def test_amount_tolerance_uses_the_larger_allowance(valor_nf, aprovar):
+    regras = {"ativo": True, "tolerancia_valor": {"absoluta": 0.01, "percentual": 0.5}}
+
+    aprovado, resultados = auto_approval.evaluate(_nf(valor_nf), PEDIDO, regras)
+
+    assert aprovado is aprovar
+    assert [(regra, passou) for regra, passou, _ in resultados] == [("tolerancia_valor", aprovar)]
+
+
+def test_cost_center_limit_falls_back_to_wildcard():
+    limites = {"ativo": True, "limite_por_centro_de_custos": {"MARKETING": 5000.0, "*": 500.0}}
+    assert auto_approval.evaluate(_nf(400.0), PEDIDO, limites)[0] is True
+    assert auto_approval.evaluate(_nf(600.0), PEDIDO, limites)[0] is False
+
+    sem_coringa = {"ativo": True, "limite_por_centro_de_custos": {"MARKETING": 5000.0}}
+    aprovado, resultados = auto_approval.evaluate(_nf(1.0), PEDIDO, sem_coringa)
+    assert aprovado is False
+    assert "sem limite configurado" in resultados[0][2]
+
+
+@pytest.mark.parametrize("fornecedor, aprovar", [
+    ("  SOLUCOES   em ti ltda ", True),
+    ("Soluções em TI Ltda", True),
+    ("Soluções em TI S.A.", False),
+    (None, False),
+])
+def test_supplier_allowlist_ignores_accents_case_and_spacing(fornecedor, aprovar):
+    regras = {"ativo": True, "fornecedores_confiaveis": ["SOLUÇÕES EM TI LTDA"]}
+    assert auto_approval.evaluate(_nf(fornecedor_nf=fornecedor), PEDIDO, regras)[0] is aprovar
+
+
+def test_inactive_or_empty_rules_never_approve():
+    assert auto_approval.evaluate(_nf(), PEDIDO, {"ativo": False, "tolerancia_valor": {"absoluta": 1}}) == (False, [])
+    assert auto_approval.evaluate(_nf(), PEDIDO, {"ativo": True}) == (False, [])
+
+
+def test_every_rule_must_pass():
+    regras = {
+        "ativo": True,
+        "tolerancia_valor": {"absoluta": 0.01},
+        "limite_por_centro_de_custos": {"*": 500.0},
+    }
+    aprovado, resultados = auto_approval.evaluate(_nf(1000.0), PEDIDO, regras)
+    assert aprovado is False
+    assert [(regra, passou) for regra, passou, _ in resultados] == [
+        ("tolerancia_valor", True), ("limite_por_centro_de_custos", False)
+    ]
+
+
+# --- Fluxo de upload (workflow_manager, Passo 8a) ---
+
+@pytest.fixture
+def upload(db, sent_emails, tmp_path, monkeypatch):
+    """Envia um PDF simulado com os dados extraídos informados e as regras gravadas em arquivo."""
+    monkeypatch.setattr(auto_approval, "RULES_FILE", str(tmp_path / "regras.json"))
+    monkeypatch.setattr(auto_approval, "_rules_cache", (None, None))
+    monkeypatch.setattr(pdf_processor, "extract_text_from_pdf", lambda pdf_bytes: "texto da NF")
+
+    def _upload(nf_data, regras):
+        (tmp_path / "regras.json").write_text(json.dumps(regras), encoding="utf-8")
+        monkeypatch.setattr(pdf_processor, "get_invoice_data_with_gemini", lambda texto: dict(nf_data))
+        return workflow_manager._process_uploaded_invoice(io.BytesIO(b"%PDF-1.4 teste"))
+
+    return _upload
+
+
+def _last_invoice():
+    conn = db_manager.get_db_connection()
+    try:
+        nf = conn.execute("SELECT id, status FROM ProcessamentoNF ORDER BY id DESC LIMIT 1").fetchone()
+        avaliacoes = conn.execute(
+            "SELECT regra, passou FROM AvaliacoesRegras WHERE processamento_id = ? ORDER BY id", (nf["id"],)
+        ).fetchall()
+        return nf["status"], [(a["regra"], bool(a["passou"])) for a in avaliacoes]
+    finally:
+        conn.close()
+
+
+REGRAS_TI = {"ativo": True, "limite_por_centro_de_custos": {"TI-INFRA": 5000.0}, "fornecedores_confiaveis": ["ACME LTDA"]}
+NF_TI = {"numero_nf": "77", "data_nf": "01/10/2025", "fornecedor_nf": "Acme Ltda", "valor_nf": 600.0,
+         "numero_pedido": "PED-1001-XYZ"}
+
+
+def test_upload_approved_by_rules_notifies_finance(upload, sent_emails):
+    resposta = upload(NF_TI, REGRAS_TI)
+
+    assert "aprovada automaticamente" in resposta
+    assert _last_invoice() == (nf_status.APPROVED, [
+        ("limite_por_centro_de_custos", True), ("fornecedores_confiaveis", True)
+    ])
+    assert [(tipo, kwargs["status"], kwargs["auto_approved"]) for tipo, kwargs in sent_emails] == [
+        ("financeiro", nf_status.APPROVED, True)
+    ]
+
+
+def test_upload_failing_a_rule_asks_for_validation(upload, sent_emails):
+    resposta = upload(dict(NF_TI, fornecedor_nf="Outro Fornecedor"), REGRAS_TI)
+
+    assert "e-mail de validação" in resposta
+    assert _last_invoice() == (nf_status.PENDING_VALIDATION, [
+        ("limite_por_centro_de_custos", True), ("fornecedores_confiaveis", False)
+    ])
+    assert [tipo for tipo, _ in sent_emails] == ["validacao"]
+
+
+def test_upload_with_inactive_rules_records_no_evaluation(upload, sent_emails):
+    upload(NF_TI, dict(REGRAS_TI, ativo=False))
+
+    assert _last_invoice() == (nf_status.PENDING_VALIDATION, [])
+    assert [tipo for tipo, _ in sent_emails] == ["validacao"]
+
+
+def test_over_billed_order_forces_manual_validation(upload, sent_emails):
+    # 1000 já faturados + 600 desta NF passam do valor do pedido (1500,50)
+    create_invoice(numero_nf="76", valor_nf=1000.0)
+
+    resposta = upload(NF_TI, REGRAS_TI)
+
+    assert "e-mail de validação" in resposta
+    assert _last_invoice() == (nf_status.PENDING_VALIDATION, [
+        ("limite_por_centro_de_custos", True), ("fornecedores_confiaveis", True), ("saldo_pedido", False)
+    ])
+    assert [tipo for tipo, _ in sent_emails] == ["validacao"]
+    assert sent_emails[0][1]["saldo_pedido"]["sobrefaturado"]
@@ -0,0 +1,18 @@
+import os
+import time
+
+import blob_store
+
+
+def test_dedupe_refreshes_mtime_so_gc_keeps_reuploaded_blob(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, "BLOB_DIR", str(tmp_path / "blobs"))
+    blob_hash = blob_store.put(b"%PDF-1.4 nf")
+    caminho = blob_store._find_blob(blob_hash)
+    antigo = time.time() - 2 * blob_store.GC_GRACE_SECONDS
+    os.utime(caminho, (antigo, antigo))
+
+    # O mesmo PDF chega de novo, antes de o upload registrar a NF no banco
+    assert blob_store.put(b"%PDF-1.4 nf") == blob_hash
+
+    assert blob_store.collect_garbage(referenced_hashes=set()) == 0
+    assert blob_store.exists(blob_hash)
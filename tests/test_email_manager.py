@@ -0,0 +1,70 @@
+import io
+from email import message_from_bytes, policy
+
+import email_manager
+
+
+class _FakeSMTP:
+    """Registra os comandos do envio e o corpo recebido no DATA."""
+
+    def __init__(self):
+        self.blocos = []
+        self.destinatarios = []
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def mail(self, from_addr):
+        self.remetente = from_addr
+        return 250, b"ok"
+
+    def rcpt(self, to_addr):
+        self.destinatarios.append(to_addr)
+        return 250, b"ok"
+
+    def docmd(self, cmd):
+        assert cmd == "DATA"
+        return 354, b"go ahead"
+
+    def send(self, bloco):
+        self.blocos.append(bloco)
+
+    def getreply(self):
+        return 250, b"queued"
+
+
+def test_attachments_are_streamed_into_the_data_command(monkeypatch):
+    monkeypatch.setattr(email_manager, "ATTACHMENT_CHUNK_SIZE", 57)
+    pdf = bytes(range(256)) * 40
+    servidor = _FakeSMTP()
+
+    msg = email_manager.EmailMessage()
+    msg["Subject"] = "Teste"
+    msg["From"] = "agente@example.com"
+    msg["To"] = "financeiro@example.com"
+    msg.set_content("texto\n.linha com ponto\n")
+    msg.add_alternative("<p>html</p>", subtype="html")
+    anexos = []
+    for nome, dados in (("nf.pdf", io.BytesIO(pdf)), ("vazio.pdf", b"")):
+        marcador = f"ANEXO-{nome}"
+        anexos.append((marcador, dados))
+        part = email_manager.MIMEBase("application", "pdf")
+        part.set_payload(marcador)
+        part["Content-Transfer-Encoding"] = "base64"
+        part.add_header("Content-Disposition", f'attachment; filename="{nome}"')
+        msg.attach(part)
+
+    email_manager._send_data_streaming(servidor, "agente@example.com", ["financeiro@example.com"],
+                                       email_manager._iter_message_bytes(msg, anexos))
+
+    assert servidor.destinatarios == ["financeiro@example.com"]
+    assert servidor.blocos[-1] == b".\r\n"
+    # O PDF foi enviado em vários blocos, não como uma única string
+    assert len(servidor.blocos) > len(pdf) // 57
+    corpo = b"".join(servidor.blocos[:-1]).replace(b"\r\n..", b"\r\n.")
+    recebido = message_from_bytes(corpo, policy=policy.default)
+    partes = [p for p in recebido.walk() if p.get_content_disposition() == "attachment"]
+    assert [p.get_filename() for p in partes] == ["nf.pdf", "vazio.pdf"]
+    assert partes[0].get_content() == pdf
+    assert partes[1].get_content() == b""
+    assert ".linha com ponto" in recebido.get_body(preferencelist=("plain",)).get_content()
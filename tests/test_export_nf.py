@@ -0,0 +1,83 @@
+import csv
+
+import pytest
+
+import archiver
+import db_manager
+import export_nf
+import nf_status
+from conftest import create_invoice
+
+
+def _ids(resultado):
+    with open(resultado['arquivo'], newline="", encoding="utf-8") as f:
+        return [int(row['id']) for row in csv.DictReader(f)]
+
+
+def test_filtered_incremental_does_not_advance_unfiltered_watermark(db, tmp_path):
+    ti = [create_invoice("PED-1001-XYZ", numero_nf=str(i)) for i in range(3)]
+
+    filtrada = export_nf.export_invoices(str(tmp_path / "1.csv"), incremental="fin", centros_de_custos=["MARKETING"])
+    assert filtrada['linhas'] == 0
+
+    completa = export_nf.export_invoices(str(tmp_path / "2.csv"), incremental="fin")
+    assert _ids(completa) == ti
+
+
+def test_incremental_exports_new_and_changed_invoices(db, tmp_path):
+    ids = [create_invoice(numero_nf=str(i)) for i in range(3)]
+    assert _ids(export_nf.export_invoices(str(tmp_path / "1.csv"), incremental="fin")) == ids
+    assert export_nf.export_invoices(str(tmp_path / "2.csv"), incremental="fin")['linhas'] == 0
+
+    db_manager.transition_status(ids[1], nf_status.APPROVED, origem='link')
+    nova = create_invoice(numero_nf="99")
+    assert _ids(export_nf.export_invoices(str(tmp_path / "3.csv"), incremental="fin")) == [ids[1], nova]
+
+
+def test_incremental_refuses_date_filters(db, tmp_path):
+    create_invoice()
+    with pytest.raises(ValueError):
+        export_nf.export_invoices(str(tmp_path / "1.csv"), incremental="fin", inicio="2025-01-01")
+    assert db_manager.get_export_watermark("fin") is None
+
+
+def test_watermark_key_is_canonical():
+    assert export_nf.watermark_key("fin", ["APPROVED", "REJECTED"], ["B", "A"]) == \
+        export_nf.watermark_key("fin", ["REJECTED", "APPROVED", "APPROVED"], ["A", "B"])
+    assert export_nf.watermark_key("fin") == "fin"
+
+
+def test_parquet_export(db, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    ids = [create_invoice(numero_nf=str(i)) for i in range(2)]
+    resultado = export_nf.export_invoices(str(tmp_path / "nfs.parquet"), fmt="parquet")
+    tabela = pq.read_table(resultado['arquivo'])
+    assert tabela.column("id").to_pylist() == ids
+    assert tabela.column_names == list(db_manager.EXPORT_COLUMNS)
+
+
+def test_parquet_export_with_non_numeric_amount(db, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    ok = create_invoice(numero_nf="1", valor_nf=100.0)
+    texto = create_invoice(numero_nf="2", valor_nf="R$ 1.500,50")
+
+    resultado = export_nf.export_invoices(str(tmp_path / "nfs.parquet"), fmt="parquet", incremental="fin")
+    tabela = pq.read_table(resultado['arquivo'])
+    assert tabela.column("id").to_pylist() == [ok, texto]
+    assert tabela.column("valor_nf").to_pylist() == [100.0, None]
+    assert db_manager.get_export_watermark("fin")['ultimo_nf_id'] == texto
+
+
+def test_archived_invoices_keep_last_status_change(db, tmp_path):
+    arquivada = create_invoice(numero_nf="1")
+    quente = create_invoice(numero_nf="2")
+    db_manager.transition_status(arquivada, nf_status.APPROVED, origem='link')
+    db_manager.transition_status(quente, nf_status.REJECTED, origem='link')
+    assert archiver.run_archival(dias=-1, max_batches=1, batch_size=1) == 1
+
+    resultado = export_nf.export_invoices(str(tmp_path / "nfs.csv"), include_archive=True)
+    with open(resultado['arquivo'], newline="", encoding="utf-8") as f:
+        linhas = {int(row['id']): row for row in csv.DictReader(f)}
+    assert set(linhas) == {arquivada, quente}
+    assert linhas[arquivada]['status'] == nf_status.APPROVED
+    assert all(linha['ultima_mudanca'] for linha in linhas.values())
@@ -0,0 +1,69 @@
+import json
+import threading
+
+import extraction_backend
+import pdf_processor
+
+
+class _FakeBackend:
+    model_name = "modelo-teste"
+
+    def generate(self, prompt):
+        return f"resposta:{prompt}"
+
+
+def test_cassette_appends_one_line_per_response_and_replays(tmp_path):
+    caminho = tmp_path / "cassete.jsonl"
+    gravador = extraction_backend.RecordingBackend(_FakeBackend(), str(caminho))
+    for i in range(3):
+        gravador.generate(f"p{i}")
+    gravador.generate("p0")
+
+    linhas = caminho.read_text(encoding="utf-8").splitlines()
+    assert len(linhas) == 4
+    # Linha incompleta de um processo interrompido é ignorada na leitura
+    with open(caminho, "a", encoding="utf-8") as f:
+        f.write('{"key": "trunc')
+
+    replay = extraction_backend.ReplayBackend("modelo-teste", str(caminho))
+    assert [replay.generate(f"p{i}") for i in range(3)] == ["resposta:p0", "resposta:p1", "resposta:p2"]
+
+
+def test_legacy_json_cassette_is_read_and_converted(tmp_path):
+    caminho = tmp_path / "cassete.json"
+    chave = extraction_backend.request_hash("modelo-teste", "antigo")
+    caminho.write_text(json.dumps({chave: {"response": "r-antiga", "latency": 0.5}}), encoding="utf-8")
+
+    gravador = extraction_backend.RecordingBackend(_FakeBackend(), str(caminho))
+    gravador.generate("novo")
+
+    replay = extraction_backend.ReplayBackend("modelo-teste", str(caminho))
+    assert replay.generate("antigo") == "r-antiga"
+    assert replay.generate("novo") == "resposta:novo"
+    assert len(caminho.read_text(encoding="utf-8").splitlines()) == 2
+
+
+def test_concurrent_callers_share_one_backend(monkeypatch):
+    criados = []
+    barreira = threading.Barrier(8)
+
+    def _create_backend(model_name):
+        criados.append(model_name)
+        return _FakeBackend()
+
+    monkeypatch.setattr(pdf_processor, "_backend", None)
+    monkeypatch.setattr(extraction_backend, "create_backend", _create_backend)
+    resultados = []
+
+    def _worker():
+        barreira.wait()
+        resultados.append(pdf_processor.get_extraction_backend())
+
+    threads = [threading.Thread(target=_worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(criados) == 1
+    assert all(r is resultados[0] for r in resultados)
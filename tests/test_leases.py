@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+
+import db_manager
+import nf_status
+from conftest import create_invoice
+
+# As NFs criadas no teste são "antigas" para qualquer limite no futuro
+LIMITE = datetime.now() + timedelta(days=1)
+
+
+def _ids(rows):
+    return sorted(row["id"] for row in rows)
+
+
+def test_workers_never_claim_the_same_rows(db):
+    ids = [create_invoice(numero_nf=str(i)) for i in range(5)]
+
+    primeiro = db_manager.claim_expired_validations("worker-a", LIMITE, batch_size=3)
+    segundo = db_manager.claim_expired_validations("worker-b", LIMITE, batch_size=3)
+
+    assert len(primeiro) == 3
+    assert set(_ids(primeiro)).isdisjoint(_ids(segundo))
+    assert sorted(_ids(primeiro) + _ids(segundo)) == ids
+    assert db_manager.claim_expired_validations("worker-c", LIMITE) == []
+
+
+def test_expired_or_released_leases_can_be_claimed_again(db):
+    a = create_invoice(numero_nf="1")
+    b = create_invoice(numero_nf="2")
+
+    assert _ids(db_manager.claim_expired_validations("worker-a", LIMITE, lease_seconds=-1)) == [a, b]
+    # Lease expirado (ex: a instância caiu): outro worker assume as linhas
+    assert _ids(db_manager.claim_expired_validations("worker-b", LIMITE)) == [a, b]
+
+    # Só o dono libera o lease
+    db_manager.release_leases("worker-a", [a, b])
+    assert db_manager.claim_expired_validations("worker-c", LIMITE) == []
+    db_manager.release_leases("worker-b", [a])
+    assert _ids(db_manager.claim_expired_validations("worker-c", LIMITE)) == [a]
+
+
+def test_transition_clears_lease_and_final_rows_are_not_claimed(db):
+    nf_id = create_invoice()
+    assert _ids(db_manager.claim_expired_validations("worker-a", LIMITE)) == [nf_id]
+
+    assert db_manager.transition_status(nf_id, nf_status.TIMEOUT, "scheduler") is not None
+
+    conn = db_manager.get_db_connection()
+    lease = conn.execute("SELECT lease_owner, lease_expira_em FROM ProcessamentoNF WHERE id = ?", (nf_id,)).fetchone()
+    conn.close()
+    assert tuple(lease) == (None, None)
+    assert db_manager.claim_expired_validations("worker-b", LIMITE) == []
+
+
+def test_only_invoices_sent_before_the_limit_are_claimed(db):
+    create_invoice()
+    assert db_manager.claim_expired_validations("worker-a", datetime.now() - timedelta(hours=1)) == []
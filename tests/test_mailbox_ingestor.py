@@ -0,0 +1,209 @@
+import hashlib
+import io
+import mailbox
+import re
+from email.message import EmailMessage
+
+import pytest
+
+import db_manager
+import mailbox_ingestor
+import workflow_manager
+
+PDF = b"%PDF-1.4\n" + bytes(range(256)) * 50 + b"\n%%EOF\n"
+
+
+def _message(message_id, pdfs=(("nf.pdf", PDF),)):
+    msg = EmailMessage()
+    msg["Message-ID"] = message_id
+    msg["Subject"] = "NF"
+    msg.set_content("Segue a nota fiscal.")
+    msg.add_alternative("<p>Segue a nota fiscal.</p>", subtype="html")
+    for filename, data in pdfs:
+        msg.add_attachment(data, maintype="application", subtype="pdf", filename=filename)
+    return msg
+
+
+@pytest.fixture
+def inbox(db, tmp_path):
+    path = str(tmp_path / "maildir")
+    box = mailbox.Maildir(path, create=True)
+    return path, box
+
+
+@pytest.fixture
+def workflow_results(monkeypatch):
+    """Respostas do workflow, consumidas em ordem; registra os PDFs recebidos."""
+    resultados, recebidos = [], []
+
+    def _handle(pdf_stream):
+        recebidos.append(pdf_stream.read())
+        return resultados.pop(0)
+
+    monkeypatch.setattr(workflow_manager, "handle_uploaded_invoice", _handle)
+    return resultados, recebidos
+
+
+def _poll(path, **kwargs):
+    ingestor = mailbox_ingestor.MailboxIngestor(mailbox_ingestor.MaildirSource(path), concurrency=2, **kwargs)
+    try:
+        ingestor.poll_once()
+    finally:
+        ingestor.close()
+
+
+def test_failed_attachment_is_retried_and_not_marked_ingested(inbox, workflow_results):
+    path, box = inbox
+    resultados, recebidos = workflow_results
+    box.add(_message("<m1@fornecedor>"))
+
+    resultados.append("Ocorreu um erro inesperado: API 503")
+    _poll(path)
+
+    # A mensagem continua na caixa de entrada e o PDF não foi registrado
+    assert len(mailbox.Maildir(path).keys()) == 1
+    assert not db_manager.is_message_ingested("<m1@fornecedor>")
+
+    # O fornecedor reenvia o mesmo PDF em outra mensagem: o PDF é processado de novo
+    box.add(_message("<m2@fornecedor>"))
+    resultados.append("Sucesso! NF 1 processada.")
+    _poll(path)
+
+    assert recebidos == [PDF, PDF]
+    assert db_manager.is_message_ingested("<m1@fornecedor>")
+    assert db_manager.is_message_ingested("<m2@fornecedor>")
+    assert len(mailbox.Maildir(path).get_folder("Processadas").keys()) == 2
+
+
+def test_duplicate_in_flight_pdf_keeps_both_messages_on_failure(inbox, workflow_results):
+    path, box = inbox
+    resultados, recebidos = workflow_results
+    box.add(_message("<m1@fornecedor>"))
+    box.add(_message("<m2@fornecedor>"))
+
+    resultados.append("Ocorreu um erro inesperado: API 503")
+    _poll(path)
+
+    assert recebidos == [PDF]
+    assert len(mailbox.Maildir(path).keys()) == 2
+    assert not db_manager.is_attachment_ingested(hashlib.sha256(PDF).hexdigest())
+
+
+def test_successful_attachment_is_skipped_on_resend(inbox, workflow_results):
+    path, box = inbox
+    resultados, recebidos = workflow_results
+    box.add(_message("<m1@fornecedor>"))
+    resultados.append("Sucesso! NF 1 processada.")
+    _poll(path)
+
+    box.add(_message("<m2@fornecedor>"))
+    _poll(path)
+
+    assert recebidos == [PDF]
+    assert len(mailbox.Maildir(path).keys()) == 0
+    assert len(mailbox.Maildir(path).get_folder("Processadas").keys()) == 2
+
+
+def test_message_moves_to_failed_folder_after_max_attempts(inbox, workflow_results):
+    path, box = inbox
+    resultados, _ = workflow_results
+    box.add(_message("<m1@fornecedor>"))
+
+    for _ in range(2):
+        resultados.append("Erro: O Pedido 'X' não existe.")
+        _poll(path, max_attempts=2)
+
+    maildir = mailbox.Maildir(path)
+    assert len(maildir.keys()) == 0
+    assert len(maildir.get_folder("Falhas").keys()) == 1
+    assert not db_manager.is_message_ingested("<m1@fornecedor>")
+
+
+def test_iter_pdf_attachments_streams_each_part():
+    outro = b"%PDF-1.7\r\nconteudo\r\n--nao-e-limite\r\n%%EOF"
+    msg = _message("<m@x>", pdfs=(("a.pdf", PDF), ("b.PDF", outro)))
+    msg.add_attachment(b"texto", maintype="text", subtype="plain", filename="leia.txt")
+
+    anexos = list(mailbox_ingestor.iter_pdf_attachments(io.BytesIO(msg.as_bytes())))
+
+    assert [(nome, arquivo.read()) for nome, arquivo, _, _ in anexos] == [("a.pdf", PDF), ("b.PDF", outro)]
+
+
+class _FakeIMAP:
+    """
+    Servidor IMAP em memória com as respostas no formato do imaplib. Um FETCH
+    parcial além do fim da mensagem volta sem literal (`BODY[]<n> NIL`), como
+    em alguns servidores reais.
+    """
+
+    capabilities = ("IMAP4REV1", "MOVE")
+
+    def __init__(self, mensagens):
+        self.mensagens = {str(uid).encode(): raw for uid, raw in enumerate(mensagens, start=1)}
+        self.pastas = {}
+        self.fetches = []
+
+    def login(self, user, password):
+        return "OK", [b"Logged in"]
+
+    def select(self, folder):
+        return "OK", [str(len(self.mensagens)).encode()]
+
+    def create(self, folder):
+        return "OK", [b""]
+
+    def uid(self, comando, *args):
+        if comando == "SEARCH":
+            return "OK", [b" ".join(self.mensagens)]
+        if comando == "MOVE":
+            uid, pasta = args
+            self.pastas.setdefault(pasta, []).append(self.mensagens.pop(uid))
+            return "OK", [b""]
+        uid, itens = args
+        self.fetches.append(itens)
+        raw = self.mensagens[uid]
+        prefixo = b"1 (UID " + uid
+        if "HEADER.FIELDS" in itens:
+            cabecalho = raw.split(b"\r\n\r\n", 1)[0] if b"\r\n\r\n" in raw else raw.split(b"\n\n", 1)[0]
+            linha = next((l for l in cabecalho.splitlines() if l.lower().startswith(b"message-id")), b"") + b"\r\n\r\n"
+            return "OK", [(prefixo + b" BODY[HEADER.FIELDS (MESSAGE-ID)] {%d}" % len(linha), linha), b")"]
+        inicio, tamanho = map(int, re.search(r"BODY\.PEEK\[\]<(\d+)\.(\d+)>", itens).groups())
+        trecho = raw[inicio:inicio + tamanho]
+        if "RFC822.SIZE" in itens:
+            prefixo += b" RFC822.SIZE %d" % len(raw)
+        if not trecho:
+            return "OK", [prefixo + b" BODY[]<%d> NIL)" % inicio]
+        return "OK", [(prefixo + b" BODY[]<%d> {%d}" % (inicio, len(trecho)), trecho), b")"]
+
+    def expunge(self):
+        return "OK", [b""]
+
+    def close(self):
+        return "OK", [b""]
+
+    def logout(self):
+        return "BYE", [b""]
+
+
+@pytest.mark.parametrize("divisor, resto", [(1, 0), (3, 0), (3, 1)], ids=["um-trecho", "multiplo-exato", "ultimo-menor"])
+def test_imap_message_is_fetched_in_chunks_up_to_its_size(db, workflow_results, monkeypatch, divisor, resto):
+    resultados, recebidos = workflow_results
+    raw = _message("<m1@fornecedor>").as_bytes()
+    raw += b" " * (-len(raw) % 3)
+    # Com resto 0 o tamanho da mensagem é múltiplo exato do trecho
+    monkeypatch.setattr(mailbox_ingestor, "IMAP_FETCH_CHUNK", len(raw) // divisor + resto)
+    servidor = _FakeIMAP([raw])
+    monkeypatch.setattr(mailbox_ingestor.imaplib, "IMAP4_SSL", lambda host, port: servidor)
+
+    resultados.append("Sucesso! NF 1 processada.")
+    source = mailbox_ingestor.IMAPSource("imap.exemplo", "nf@exemplo", "senha")
+    ingestor = mailbox_ingestor.MailboxIngestor(source, concurrency=1)
+    try:
+        ingestor.poll_once()
+    finally:
+        ingestor.close()
+
+    assert recebidos == [PDF]
+    assert servidor.pastas == {"Processadas": [raw]}
+    parciais = [itens for itens in servidor.fetches if "BODY.PEEK[]<" in itens]
+    assert len(parciais) == -(-len(raw) // mailbox_ingestor.IMAP_FETCH_CHUNK)
@@ -0,0 +1,63 @@
+import db_manager
+from conftest import create_invoice
+
+
+def _execute(sql, params=()):
+    """Grava por uma conexão separada, como outro processo (ex: alterar_email.py)."""
+    conn = db_manager.get_db_connection()
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def _stats_delta(antes):
+    """As estatísticas do cache valem para o processo inteiro: compara com o início do teste."""
+    depois = db_manager.get_order_cache_stats()
+    return {chave: depois[chave] - antes[chave] for chave in ("acertos", "falhas", "invalidacoes")}
+
+
+def test_repeated_and_missing_orders_are_served_from_cache(db):
+    antes = db_manager.get_order_cache_stats()
+    assert db_manager.get_order_details_by_number("PED-1001-XYZ")["centro_de_custos"] == "TI-INFRA"
+    assert db_manager.get_order_details_by_number("PED-1001-XYZ")["centro_de_custos"] == "TI-INFRA"
+    assert db_manager.get_order_details_by_number("PED-INEXISTENTE") is None
+    assert db_manager.get_order_details_by_number("PED-INEXISTENTE") is None
+
+    assert _stats_delta(antes) == {"acertos": 2, "falhas": 2, "invalidacoes": 0}
+    assert db_manager.get_order_cache_stats()["negativos"] == 1
+
+
+def test_unrelated_writes_keep_the_cache(db):
+    db_manager.get_order_details_by_number("PED-1001-XYZ")
+    antes = db_manager.get_order_cache_stats()
+    create_invoice()
+
+    db_manager.get_order_details_by_number("PED-1001-XYZ")
+    assert _stats_delta(antes)["invalidacoes"] == 0
+    assert _stats_delta(antes)["acertos"] >= 1
+
+
+def test_order_and_requester_changes_invalidate_the_cache(db):
+    antes = db_manager.get_order_cache_stats()
+    assert db_manager.get_order_details_by_number("PED-1001-XYZ")["valor_pedido"] == 1500.50
+    assert db_manager.get_order_details_by_number("PED-NOVO") is None
+
+    _execute("UPDATE ControleDePedidos SET valor = 2000 WHERE numero_pedido = 'PED-1001-XYZ'")
+    assert db_manager.get_order_details_by_number("PED-1001-XYZ")["valor_pedido"] == 2000
+
+    pedido = db_manager.get_order_details_by_number("PED-1001-XYZ")
+    _execute(
+        "UPDATE Solicitantes SET email = 'novo@example.com' "
+        "WHERE id = (SELECT solicitante_id FROM ControleDePedidos WHERE id = ?)",
+        (pedido["pedido_id"],)
+    )
+    assert db_manager.get_order_details_by_number("PED-1001-XYZ")["solicitante_email"] == "novo@example.com"
+
+    # O cache negativo também é invalidado quando o pedido passa a existir
+    _execute(
+        "INSERT INTO ControleDePedidos (numero_pedido, valor, centro_de_custos, solicitante_id) "
+        "SELECT 'PED-NOVO', 10, 'TI-INFRA', solicitante_id FROM ControleDePedidos WHERE id = ?",
+        (pedido["pedido_id"],)
+    )
+    assert db_manager.get_order_details_by_number("PED-NOVO")["valor_pedido"] == 10
+    assert _stats_delta(antes)["invalidacoes"] == 3
@@ -0,0 +1,56 @@
+import pytest
+
+import db_manager
+import nf_status
+from conftest import create_invoice
+
+
+def _balance(numero_pedido="PED-1001-XYZ"):
+    return db_manager.get_order_balance(db_manager.get_order_details_by_number(numero_pedido)["pedido_id"])
+
+
+def test_partial_invoices_accumulate_and_flag_over_billing(db):
+    primeira = create_invoice(numero_nf="1", valor_nf=1000.0)
+    segunda = create_invoice(numero_nf="2", valor_nf=600.0)
+
+    saldo = _balance()
+    assert saldo["quantidade_nfs"] == 2
+    assert saldo["valor_faturado"] == pytest.approx(1600.0)
+    assert saldo["saldo_restante"] == pytest.approx(-99.5)
+    assert saldo["sobrefaturado"] == 1
+
+    db_manager.transition_status(segunda, nf_status.REJECTED, "link")
+    db_manager.transition_status(primeira, nf_status.APPROVED, "link")
+
+    saldo = _balance()
+    assert saldo["valor_faturado"] == pytest.approx(1000.0)
+    assert saldo["valor_aprovado"] == pytest.approx(1000.0)
+    assert saldo["sobrefaturado"] == 0
+
+
+def test_text_amounts_are_coerced_in_the_ledger(db):
+    numerica = create_invoice(numero_nf="1", valor_nf="250.25")
+    invalida = create_invoice(numero_nf="2", valor_nf="R$ 1.500,50")
+    assert numerica and invalida
+
+    assert _balance()["valor_faturado"] == pytest.approx(250.25)
+
+    assert db_manager.transition_status(invalida, nf_status.REJECTED, "link") is not None
+    assert db_manager.transition_status(numerica, nf_status.APPROVED, "link") is not None
+    saldo = _balance()
+    assert saldo["valor_faturado"] == pytest.approx(250.25)
+    assert saldo["valor_aprovado"] == pytest.approx(250.25)
+
+
+def test_text_amounts_are_coerced_in_dashboard_summaries(db):
+    create_invoice(numero_nf="1", valor_nf="250.25")
+    invalida = create_invoice(numero_pedido="PED-1002-ABC", numero_nf="2", valor_nf="1.500,50")
+    db_manager.transition_status(invalida, nf_status.REJECTED, "link")
+
+    conn = db_manager.get_db_connection()
+    pendentes = {row["centro_de_custos"]: row["valor_total"]
+                 for row in conn.execute("SELECT centro_de_custos, valor_total FROM ResumoPendentes")}
+    conn.close()
+    assert pendentes["TI-INFRA"] == pytest.approx(250.25)
+    # A NF saiu do backlog: o valor que entrou é o mesmo que saiu
+    assert pendentes["MARKETING"] == pytest.approx(0)
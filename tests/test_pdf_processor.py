@@ -0,0 +1,30 @@
+import json
+
+import pdf_processor
+
+
+class _BatchBackend:
+    model_name = "modelo-teste"
+
+    def __init__(self, itens):
+        self.itens = itens
+
+    def generate(self, prompt):
+        return json.dumps(self.itens)
+
+
+def test_incomplete_batch_items_fall_back_to_single_extraction(monkeypatch):
+    completo = {"doc_id": "a", "numero_nf": "1", "data_nf": "01/10/2025", "fornecedor_nf": "ACME",
+                "valor_nf": 10.0, "numero_pedido": None}
+    sem_valor = {"doc_id": "b", "numero_nf": "2", "fornecedor_nf": "ACME", "valor_nf": None}
+    sem_fornecedor = {"doc_id": "c", "numero_nf": "3", "valor_nf": 30.0}
+    monkeypatch.setattr(pdf_processor, "_backend", _BatchBackend([completo, sem_valor, sem_fornecedor]))
+    individuais = []
+    monkeypatch.setattr(pdf_processor, "get_invoice_data_with_gemini",
+                        lambda texto: individuais.append(texto) or {"numero_nf": texto})
+
+    resultados = pdf_processor.get_invoices_data_with_gemini_batch({"a": "NF A", "b": "NF B", "c": "NF C"})
+
+    assert resultados["a"]["valor_nf"] == 10.0
+    assert sorted(individuais) == ["NF B", "NF C"]
+    assert resultados["b"] == {"numero_nf": "NF B"}
@@ -0,0 +1,27 @@
+import os
+
+import profiler
+
+
+def test_capture_writes_dump_and_summary_named_after_the_invoice(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_DIR", str(tmp_path))
+
+    # Duas execuções seguidas (no mesmo segundo) geram perfis distintos
+    for _ in range(2):
+        with profiler.capture("upload"):
+            profiler.tag_current_run("NF 123/1")
+            sum(range(1000))
+
+    arquivos = sorted(os.listdir(tmp_path))
+    assert len(arquivos) == 4
+    assert all("_upload_NF-123-1." in arquivo for arquivo in arquivos)
+    nomes = {os.path.splitext(arquivo)[0] for arquivo in arquivos}
+    assert len(nomes) == 2
+    for nome in nomes:
+        assert os.path.exists(os.path.join(tmp_path, f"{nome}.prof"))
+        assert os.path.exists(os.path.join(tmp_path, f"{nome}.json"))
+
+    resumos = profiler.list_profiles()
+    assert {r["nome"] for r in resumos} == nomes
+    assert all(r["numero_nf"] == "NF 123/1" and r["tipo"] == "upload" for r in resumos)
+    assert os.path.exists(profiler.profile_path(resumos[0]["nome"]))
@@ -0,0 +1,30 @@
+import csv
+
+import db_manager
+import pdf_processor
+import reextract
+from conftest import create_invoice
+
+
+def test_corrupt_stored_text_is_reported_and_run_continues(db, tmp_path, monkeypatch):
+    pedido = db_manager.get_order_details_by_number("PED-1001-XYZ")
+    nf_data = {"numero_nf": "10", "data_nf": "01/10/2025", "fornecedor_nf": "ACME", "valor_nf": 100.0}
+    ok_id = db_manager.create_processing_entry(nf_data, pedido["pedido_id"], "t-ok", pdf_text="NF 10 ACME")
+    ruim_id = create_invoice(numero_nf="11")
+    conn = db_manager.get_db_connection()
+    conn.execute("UPDATE ProcessamentoNF SET texto_comprimido = ? WHERE id = ?", (b"nao-e-zlib", ruim_id))
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(pdf_processor, "_backend", object())
+    monkeypatch.setattr(pdf_processor, "get_invoice_data_with_gemini",
+                        lambda texto: dict(nf_data, numero_pedido="PED-1001-XYZ"))
+
+    relatorio = tmp_path / "reextracao.csv"
+    totais = reextract.run_reextraction(str(relatorio), concurrency=2)
+
+    assert totais == {'processadas': 2, 'alteradas': 0, 'erros': 1}
+    with open(relatorio, newline="", encoding="utf-8") as f:
+        linhas = list(csv.DictReader(f))
+    assert [(int(l['processamento_id']), l['campo']) for l in linhas] == [(ruim_id, "ERRO")]
+    assert ok_id != ruim_id
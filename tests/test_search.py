@@ -0,0 +1,52 @@
+import db_manager
+import nf_status
+import setup_db
+
+
+def _create_with_text(numero_nf, fornecedor, texto):
+    pedido = db_manager.get_order_details_by_number("PED-1001-XYZ")
+    nf_data = {"numero_nf": numero_nf, "data_nf": "01/10/2025", "fornecedor_nf": fornecedor, "valor_nf": 100.0}
+    return db_manager.create_processing_entry(nf_data, pedido["pedido_id"], f"t-{numero_nf}", pdf_text=texto)
+
+
+def _tables():
+    conn = db_manager.get_db_connection()
+    try:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+    finally:
+        conn.close()
+
+
+def test_index_does_not_store_text_and_search_builds_snippet(db):
+    nf_id = _create_with_text("55", "ACME LTDA", "Serviços de manutenção conforme o contrato CT-2025 assinado em março.")
+    _create_with_text("56", "Beta SA", "Licenças de software.")
+
+    assert "ProcessamentoNFBusca_content" not in _tables()
+
+    resultados = db_manager.search_invoices("fornecedor_nf:acme manutencao contr")
+    assert [r['id'] for r in resultados] == [nf_id]
+    resultado = resultados[0]
+    assert resultado['numero_nf'] == "55"
+    assert resultado['numero_pedido'] == "PED-1001-XYZ"
+    assert resultado['status'] == nf_status.PENDING_VALIDATION
+    assert "**manutenção**" in resultado['trecho']
+    assert "**contrato**" in resultado['trecho']
+    assert "ACME" not in resultado['trecho']
+
+
+def test_legacy_index_with_content_is_migrated(db):
+    conn = db_manager.get_db_connection()
+    conn.execute("DROP TABLE ProcessamentoNFBusca")
+    conn.execute("""
+        CREATE VIRTUAL TABLE ProcessamentoNFBusca USING fts5(
+            numero_nf, fornecedor_nf, numero_pedido, texto, tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+    conn.commit()
+    conn.close()
+    nf_id = _create_with_text("57", "ACME LTDA", "Referente ao contrato CT-2025.")
+
+    setup_db.create_database()
+
+    assert "ProcessamentoNFBusca_content" not in _tables()
+    assert [r['id'] for r in db_manager.search_invoices("CT-2025")] == [nf_id]
@@ -0,0 +1,32 @@
+import pytest
+
+import db_manager
+import nf_status
+import setup_db
+from conftest import create_invoice
+
+
+def test_upgraded_database_gets_dashboard_summaries_populated(db):
+    primeira = create_invoice(numero_nf="1", valor_nf=100.0)
+    create_invoice(numero_nf="2", valor_nf=50.0)
+    # Banco de antes das tabelas de resumo: as NFs já existem, os resumos não
+    conn = db_manager.get_db_connection()
+    conn.execute("DROP TABLE ResumoPendentes")
+    conn.execute("DROP TABLE ResumoDiarioStatus")
+    conn.commit()
+    conn.close()
+
+    setup_db.create_database()
+    db_manager.transition_status(primeira, nf_status.APPROVED, "link")
+
+    _, pendentes = db_manager.get_dashboard_summary()
+    assert [(row["centro_de_custos"], row["quantidade"]) for row in pendentes] == [("TI-INFRA", 1)]
+    assert pendentes[0]["valor_total"] == pytest.approx(50.0)
+
+
+def test_existing_summaries_are_not_rebuilt(db, monkeypatch):
+    create_invoice()
+    chamadas = []
+    monkeypatch.setattr(db_manager, "rebuild_dashboard_summaries", lambda: chamadas.append(1))
+    setup_db.create_database()
+    assert chamadas == []
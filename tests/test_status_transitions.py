@@ -0,0 +1,54 @@
+import pytest
+
+import db_manager
+import nf_status
+import validation_tokens
+import workflow_manager
+from conftest import create_invoice
+
+
+def _status(processing_id):
+    conn = db_manager.get_db_connection()
+    try:
+        return conn.execute("SELECT status FROM ProcessamentoNF WHERE id = ?", (processing_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_transition_records_history_and_final_status_is_terminal(db):
+    nf_id = create_invoice()
+
+    data = db_manager.transition_status(nf_id, nf_status.APPROVED, "link")
+    assert data["status"] == nf_status.APPROVED
+    assert data["numero_pedido"] == "PED-1001-XYZ"
+
+    # Status finais não mudam mais (ex: timeout do scheduler depois do clique)
+    assert db_manager.transition_status(nf_id, nf_status.TIMEOUT, "scheduler") is None
+    assert db_manager.transition_status(nf_id, nf_status.REJECTED, "link") is None
+    assert _status(nf_id) == nf_status.APPROVED
+
+    historico = db_manager.get_status_history(nf_id)
+    assert [(h["status_anterior"], h["status_novo"], h["origem"]) for h in historico] == [
+        (nf_status.PENDING_VALIDATION, nf_status.APPROVED, "link")
+    ]
+
+
+def test_transition_to_unreachable_status_is_refused(db):
+    nf_id = create_invoice()
+    with pytest.raises(nf_status.InvalidTransitionError):
+        db_manager.transition_status(nf_id, nf_status.PENDING_VALIDATION, "link")
+    assert db_manager.transition_status(nf_id + 1000, nf_status.APPROVED, "link") is None
+
+
+def test_validation_link_is_single_use_and_action_bound(db, sent_emails):
+    nf_id = create_invoice()
+    reject_token = validation_tokens.generate_token(nf_id, "reject")
+
+    # Token de rejeição não serve para aprovar
+    assert "inválido" in workflow_manager.handle_validation_response(reject_token, "approve", profile=False)
+    assert _status(nf_id) == nf_status.PENDING_VALIDATION
+
+    assert "REJEITADO" in workflow_manager.handle_validation_response(reject_token, "reject", profile=False)
+    assert "inválido" in workflow_manager.handle_validation_response(reject_token, "reject", profile=False)
+    assert _status(nf_id) == nf_status.REJECTED
+    assert [tipo for tipo, _ in sent_emails] == ["financeiro"]
@@ -0,0 +1,66 @@
+import threading
+import urllib.parse
+import urllib.request
+
+import pytest
+
+import db_manager
+import nf_status
+import validation_server
+import validation_tokens
+from conftest import create_invoice
+
+
+@pytest.fixture
+def server(db, sent_emails):
+    srv = validation_server.PooledHTTPServer(("127.0.0.1", 0), validation_server.ValidationRequestHandler, workers=2)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}"
+    srv.shutdown()
+    srv.server_close()
+
+
+def _status(processing_id):
+    conn = db_manager.get_db_connection()
+    row = conn.execute("SELECT status FROM ProcessamentoNF WHERE id = ?", (processing_id,)).fetchone()
+    conn.close()
+    return row["status"]
+
+
+def test_get_does_not_change_status(server, sent_emails):
+    processing_id = create_invoice()
+    token = validation_tokens.generate_token(processing_id, "approve")
+
+    with urllib.request.urlopen(f"{server}/?action=approve&token={token}") as resposta:
+        pagina = resposta.read().decode("utf-8")
+
+    assert 'method="post"' in pagina
+    assert _status(processing_id) == nf_status.PENDING_VALIDATION
+    assert db_manager.get_status_history(processing_id) == []
+    assert sent_emails == []
+
+
+def test_post_runs_transition(server, sent_emails):
+    processing_id = create_invoice()
+    token = validation_tokens.generate_token(processing_id, "approve")
+
+    corpo = urllib.parse.urlencode({"action": "approve", "token": token}).encode("ascii")
+    with urllib.request.urlopen(f"{server}/", data=corpo) as resposta:
+        pagina = resposta.read().decode("utf-8")
+
+    assert "APROVADO" in pagina
+    assert _status(processing_id) == nf_status.APPROVED
+    assert [row["origem"] for row in db_manager.get_status_history(processing_id)] == ["link"]
+    assert len(sent_emails) == 1
+
+
+def test_get_with_invalid_token_shows_error(server):
+    processing_id = create_invoice()
+    token = validation_tokens.generate_token(processing_id, "reject")
+
+    # Token de rejeição usado no link de aprovação
+    with urllib.request.urlopen(f"{server}/?action=approve&token={token}") as resposta:
+        pagina = resposta.read().decode("utf-8")
+
+    assert "inválido" in pagina
+    assert 'method="post"' not in pagina
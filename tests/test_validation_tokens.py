@@ -0,0 +1,35 @@
+import pytest
+
+import validation_tokens
+
+
+def test_placeholder_and_short_secrets_are_refused(monkeypatch):
+    assert validation_tokens._check_secret(None) is None
+    assert validation_tokens._check_secret("COLE_UM_SEGREDO_ALEATORIO_AQUI") is None
+    assert validation_tokens._check_secret("curto") is None
+    assert validation_tokens._check_secret("x" * validation_tokens.MIN_SECRET_LENGTH) == "x" * validation_tokens.MIN_SECRET_LENGTH
+
+    monkeypatch.setattr(validation_tokens, "VALIDATION_TOKEN_SECRET", None)
+    with pytest.raises(validation_tokens.InvalidTokenError):
+        validation_tokens.generate_token(1, "approve")
+
+
+def test_expired_token_is_refused():
+    token = validation_tokens.generate_token(7, "approve", ttl_seconds=-1)
+    with pytest.raises(validation_tokens.InvalidTokenError, match="expirado"):
+        validation_tokens.verify_token(token, "approve")
+
+
+def test_tampered_token_is_refused():
+    token = validation_tokens.generate_token(7, "approve")
+    assert validation_tokens.verify_token(token, "approve") == 7
+
+    payload, assinatura = token.split(".")
+    # Outro id com a assinatura original
+    outro_payload = validation_tokens._b64encode(validation_tokens._b64decode(payload).replace(b"7:", b"8:", 1))
+    # Assinatura trocada
+    outra_assinatura = validation_tokens._b64encode(b"\x00" * 32)
+
+    for adulterado in (f"{outro_payload}.{assinatura}", f"{payload}.{outra_assinatura}", payload, "lixo"):
+        with pytest.raises(validation_tokens.InvalidTokenError):
+            validation_tokens.verify_token(adulterado, "approve")
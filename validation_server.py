@@ -0,0 +1,218 @@
+import argparse
+import html
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import nf_status
+import validation_tokens
+import workflow_manager
+
+# Respostas processadas ao mesmo tempo (cada uma usa uma conexão SQLite e o SMTP)
+DEFAULT_WORKERS = 8
+DEFAULT_PORT = 8502
+
+# Tamanho máximo do corpo do POST (só contém a ação e o token)
+MAX_FORM_BYTES = 4096
+
+# Texto do botão de confirmação por ação
+CONFIRM_LABELS = {
+    'approve': ("aprovar", "Confirmar aprovação", "#28a745"),
+    'reject': ("rejeitar", "Confirmar rejeição", "#dc3545"),
+}
+
+# Página estática de confirmação: só a mensagem e a cor variam
+CONFIRMATION_PAGE = """<!DOCTYPE html>
+<html lang="pt-BR">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>Validação de Nota Fiscal</title>
+<style>
+  body {{ font-family: Arial, sans-serif; background: #f4f4f4; margin: 0; padding: 40px 16px; color: #333; }}
+  .box {{ max-width: 560px; margin: 0 auto; background: #fff; border-radius: 8px; padding: 28px;
+          border-top: 6px solid {cor}; box-shadow: 0 1px 4px rgba(0, 0, 0, 0.1); }}
+  h1 {{ font-size: 20px; margin-top: 0; }}
+  p {{ font-size: 16px; line-height: 1.5; }}
+  .info {{ color: #777; font-size: 14px; }}
+  button {{ background: {cor}; color: #fff; border: 0; border-radius: 5px; padding: 12px 24px;
+           font-size: 16px; font-weight: bold; cursor: pointer; }}
+</style>
+</head>
+<body>
+<div class="box">
+  <h1>🤖 Agente de Análise de Notas Fiscais</h1>
+  <p>{mensagem}</p>
+  {conteudo}
+</div>
+</body>
+</html>
+"""
+
+
+def render_confirmation(mensagem: str) -> bytes:
+    """Monta a página de confirmação com a cor do resultado (mesma regra do app.py)."""
+    if "APROVADO" in mensagem or "Obrigado!" in mensagem:
+        cor = "#28a745"
+    elif "REJEITADO" in mensagem:
+        cor = "#ffc107"
+    else:
+        cor = "#dc3545"
+    return CONFIRMATION_PAGE.format(
+        cor=cor, mensagem=html.escape(mensagem), conteudo='<p class="info">Pode fechar esta janela.</p>'
+    ).encode("utf-8")
+
+
+def render_confirm_form(action: str, token: str) -> bytes:
+    """
+    Página exibida no GET: pede a confirmação com um formulário POST.
+    Scanners de e-mail e pré-carregamento de links só fazem GET, então não
+    alteram a NF.
+    """
+    verbo, botao, cor = CONFIRM_LABELS[action]
+    formulario = (
+        '<form method="post" action="/">'
+        f'<input type="hidden" name="action" value="{html.escape(action)}">'
+        f'<input type="hidden" name="token" value="{html.escape(token)}">'
+        f'<button type="submit">{botao}</button>'
+        '</form>'
+    )
+    mensagem = f"Clique no botão abaixo para {verbo} o pagamento desta Nota Fiscal."
+    return CONFIRMATION_PAGE.format(cor=cor, mensagem=html.escape(mensagem), conteudo=formulario).encode("utf-8")
+
+
+class ValidationRequestHandler(BaseHTTPRequestHandler):
+    """
+    Atende os links de aprovação/rejeição dos e-mails de validação
+    (`/?action=...&token=...`) sem abrir uma sessão do Streamlit.
+
+    O GET apenas verifica o token e mostra um botão de confirmação; a
+    transição de status só acontece no POST enviado por esse botão.
+    """
+
+    server_version = "ValidacaoNF/1.0"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/healthz":
+            self._send(200, b"ok", "text/plain; charset=utf-8")
+            return
+        if url.path != "/":
+            self._send(404, render_confirmation("Página não encontrada."))
+            return
+
+        action, token = self._get_params(parse_qs(url.query))
+        if not token or not action:
+            self._send(400, render_confirmation("Link de validação incompleto."))
+            return
+
+        # Só verifica o token (sem acessar o banco); a ação exige o POST
+        if action not in nf_status.ACTION_TO_STATUS:
+            self._send(400, render_confirmation("Ação desconhecida."))
+            return
+        try:
+            validation_tokens.verify_token(token, action)
+        except validation_tokens.InvalidTokenError:
+            self._send(200, render_confirmation("Este link de validação é inválido ou já foi processado."))
+            return
+        self._send(200, render_confirm_form(action, token))
+
+    def do_POST(self):
+        if urlsplit(self.path).path != "/":
+            self._send(404, render_confirmation("Página não encontrada."))
+            return
+        try:
+            tamanho = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            tamanho = -1
+        if tamanho < 0 or tamanho > MAX_FORM_BYTES:
+            self._send(400, render_confirmation("Requisição inválida."))
+            return
+
+        corpo = self.rfile.read(tamanho).decode("utf-8", errors="replace")
+        action, token = self._get_params(parse_qs(corpo))
+        if not token or not action:
+            self._send(400, render_confirmation("Link de validação incompleto."))
+            return
+
+        mensagem = workflow_manager.handle_validation_response(token, action)
+        self._send(200, render_confirmation(mensagem))
+
+    @staticmethod
+    def _get_params(params: dict) -> tuple:
+        return params.get("action", [None])[0], params.get("token", [None])[0]
+
+    def _send(self, status: int, corpo: bytes, content_type: str = "text/html; charset=utf-8"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(corpo)))
+        self.send_header("Cache-Control", "no-store")
+        # O token vai na URL: não o repassa a outros sites pelo Referer
+        self.send_header("Referrer-Policy", "no-referrer")
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, format, *args):
+        # Não registra a URL (contém o token); só o método, o caminho e o status
+        print(f"{self.address_string()} - {self.command} {urlsplit(self.path).path} {args[1] if len(args) > 1 else ''}")
+
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTPServer que atende cada conexão em um pool fixo de threads.
+
+    Diferente do ThreadingHTTPServer (uma thread nova por conexão), picos de
+    cliques ficam na fila do pool em vez de abrir conexões SQLite/SMTP sem limite.
+    Com a fila cheia o servidor para de aceitar conexões, que esperam na fila
+    do sistema operacional (contrapressão).
+    """
+
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, workers: int = DEFAULT_WORKERS):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="validacao")
+        self._slots = threading.BoundedSemaphore(workers * 4)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        self.executor.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+def run_server(host: str = "0.0.0.0", port: int = DEFAULT_PORT, workers: int = DEFAULT_WORKERS):
+    server = PooledHTTPServer((host, port), ValidationRequestHandler, workers=workers)
+    print(f"--- Servidor de validação em http://{socket.getfqdn() if host == '0.0.0.0' else host}:{port} "
+          f"({workers} workers) ---")
+    print("Configure VALIDATION_BASE_URL no .env com este endereço. Pressione Ctrl+C para sair.")
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        print("Servidor interrompido pelo utilizador.")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor HTTP leve para os links de aprovação/rejeição.")
+    parser.add_argument("--host", default="0.0.0.0", help="Endereço de escuta (padrão: 0.0.0.0).")
+    parser.add_argument("--porta", type=int, default=DEFAULT_PORT, help=f"Porta (padrão: {DEFAULT_PORT}).")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"Respostas processadas ao mesmo tempo (padrão: {DEFAULT_WORKERS}).")
+    args = parser.parse_args()
+
+    run_server(args.host, args.porta, args.workers)
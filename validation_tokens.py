@@ -0,0 +1,111 @@
+import base64
+import hashlib
+import hmac
+import os
+import time
+from dotenv import load_dotenv
+
+# Carrega as variáveis de ambiente (VALIDATION_TOKEN_SECRET) do arquivo .env
+load_dotenv()
+
+# Tamanho mínimo aceito para o segredo (secrets.token_urlsafe(32) gera 43 caracteres)
+MIN_SECRET_LENGTH = 16
+
+# Valor de exemplo do .env.example, que nunca deve ser usado como segredo
+PLACEHOLDER_SECRET = "COLE_UM_SEGREDO_ALEATORIO_AQUI"
+
+# Validade dos links, igual ao prazo de timeout do scheduler
+TOKEN_TTL_SECONDS = 48 * 3600
+
+# Ações que um token pode autorizar
+VALID_ACTIONS = ("approve", "reject")
+
+
+def _check_secret(secret):
+    """
+    Devolve o segredo se ele puder ser usado, ou None (com um aviso) se não
+    estiver definido, for o valor de exemplo do .env.example ou for curto demais.
+    Sem segredo válido, nenhum link é gerado nem aceito.
+    """
+    if not secret:
+        motivo = "não foi definida"
+    elif secret.strip() == PLACEHOLDER_SECRET:
+        motivo = "ainda contém o valor de exemplo do .env.example"
+    elif len(secret) < MIN_SECRET_LENGTH:
+        motivo = f"tem menos de {MIN_SECRET_LENGTH} caracteres"
+    else:
+        return secret
+    print(f"ERRO CRÍTICO: A variável de ambiente VALIDATION_TOKEN_SECRET {motivo}. "
+          "Os links de validação não poderão ser gerados nem verificados.")
+    return None
+
+
+# Segredo usado para assinar os links de aprovação/rejeição.
+# Deve ser o mesmo em todos os processos que geram ou verificam links.
+VALIDATION_TOKEN_SECRET = _check_secret(os.getenv("VALIDATION_TOKEN_SECRET"))
+
+
+class InvalidTokenError(ValueError):
+    """Token malformado, adulterado, expirado ou de outra ação."""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(payload: bytes) -> bytes:
+    if not VALIDATION_TOKEN_SECRET:
+        raise InvalidTokenError("VALIDATION_TOKEN_SECRET não configurado ou inválido.")
+    return hmac.new(VALIDATION_TOKEN_SECRET.encode("utf-8"), payload, hashlib.sha256).digest()
+
+
+def generate_token(processing_id: int, action: str, ttl_seconds: int = TOKEN_TTL_SECONDS) -> str:
+    """
+    Gera um token assinado para um processamento e uma ação.
+
+    O token carrega o id do ProcessamentoNF, a ação permitida e a data de
+    expiração, no formato `<payload base64>.<hmac base64>`.
+    """
+    if action not in VALID_ACTIONS:
+        raise ValueError(f"Ação inválida para token: '{action}'")
+    expires_at = int(time.time()) + ttl_seconds
+    payload = f"{int(processing_id)}:{action}:{expires_at}".encode("ascii")
+    return f"{_b64encode(payload)}.{_b64encode(_sign(payload))}"
+
+
+def verify_token(token: str, action: str) -> int:
+    """
+    Verifica a assinatura, a ação e a validade de um token SEM acessar o banco.
+
+    Returns:
+        O id (chave primária) do ProcessamentoNF autorizado pelo token.
+
+    Raises:
+        InvalidTokenError: se o token for inválido por qualquer motivo.
+    """
+    try:
+        payload_b64, signature_b64 = token.split(".", 1)
+        payload = _b64decode(payload_b64)
+        signature = _b64decode(signature_b64)
+    except (AttributeError, ValueError) as e:
+        raise InvalidTokenError("Token malformado.") from e
+
+    if not hmac.compare_digest(signature, _sign(payload)):
+        raise InvalidTokenError("Assinatura do token inválida.")
+
+    try:
+        processing_id, token_action, expires_at = payload.decode("ascii").split(":")
+        processing_id, expires_at = int(processing_id), int(expires_at)
+    except ValueError as e:
+        raise InvalidTokenError("Conteúdo do token inválido.") from e
+
+    if token_action != action:
+        raise InvalidTokenError("O token não autoriza esta ação.")
+    if expires_at < time.time():
+        raise InvalidTokenError("Token expirado.")
+
+    return processing_id
@@ -5,8 +5,54 @@ import io
 import pdf_processor
 import db_manager
 import email_manager
+import validation_tokens
+import nf_status
+import blob_store
+import auto_approval
+import profiler
 
-def handle_uploaded_invoice(pdf_file: io.BytesIO) -> str:
+def _notify_finance(data_for_email, status: str, auto_approved: bool = False):
+    """
+    Envia o e-mail de status final para o setor financeiro.
+
+    O `email_manager.send_finance_email` espera `nf_data` e `pedido_data`.
+    Como `data_for_email` (um sqlite3.Row) contém todas as chaves
+    de ambos (ex: 'numero_nf', 'numero_pedido', etc.), podemos
+    passar o mesmo objeto para ambos os argumentos.
+    Se aprovado, o PDF original é lido do blob_store em streaming e anexado.
+    """
+    pdf_hash = data_for_email['pdf_hash']
+    if status == nf_status.APPROVED and pdf_hash and blob_store.exists(pdf_hash):
+        with blob_store.open_blob(pdf_hash) as pdf_stream:
+            email_manager.send_finance_email(
+                nf_data=data_for_email,
+                pedido_data=data_for_email,
+                status=status,
+                pdf_attachment_data=pdf_stream,
+                auto_approved=auto_approved
+            )
+    else:
+        email_manager.send_finance_email(
+            nf_data=data_for_email, 
+            pedido_data=data_for_email, 
+            status=status,
+            auto_approved=auto_approved
+        )
+
+def handle_uploaded_invoice(pdf_file: io.BytesIO, profile: bool = None) -> str:
+    """
+    Processa uma NF enviada (ver _process_uploaded_invoice).
+
+    Com `profile=True` (opção da UI), WORKFLOW_PROFILE=1 ou por amostragem
+    (WORKFLOW_PROFILE_SAMPLE_RATE), a execução é perfilada e o perfil é
+    gravado em data/profiles com o número da NF (ver profiler.py).
+    """
+    if not profiler.should_profile(profile):
+        return _process_uploaded_invoice(pdf_file)
+    with profiler.capture("upload"):
+        return _process_uploaded_invoice(pdf_file)
+
+def _process_uploaded_invoice(pdf_file: io.BytesIO) -> str:
     """
     Orquestra o fluxo de trabalho completo para um novo upload de NF.
 
@@ -14,10 +60,11 @@ def handle_uploaded_invoice(pdf_file: io.BytesIO) -> str:
     2. Envia texto para o Gemini para extrair dados.
     3. Valida se o 'numero_pedido' foi encontrado.
     4. Consulta o 'numero_pedido' no banco de dados.
-    5. Valida se o pedido existe.
-    6. Gera um token de validação.
+    5. Valida se o pedido existe e avalia as regras de aprovação automática.
+    6. Gera um identificador único do processamento.
     7. Salva o estado 'PENDING_VALIDATION' no banco.
-    8. Envia o e-mail de validação para o solicitante.
+    8. Se as regras aprovaram a NF, faz a transição para 'APPROVED' e notifica o financeiro.
+       Caso contrário, gera os tokens assinados e envia o e-mail de validação para o solicitante.
 
     Retorna uma string de status para a UI do Streamlit.
     """
@@ -28,6 +75,12 @@ def handle_uploaded_invoice(pdf_file: io.BytesIO) -> str:
         # Passo 1: Extrair texto do PDF
         # O objeto do Streamlit (pdf_file) tem o método .read() que retorna bytes
         pdf_bytes = pdf_file.read()
+
+        # Guarda o PDF original no armazenamento por conteúdo, para anexá-lo
+        # ao e-mail do financeiro quando a NF for aprovada
+        pdf_hash = blob_store.put(pdf_bytes)
+        print(f"PDF armazenado (hash: {pdf_hash[:12]}...)")
+
         print("Extraindo texto do PDF...")
         pdf_text = pdf_processor.extract_text_from_pdf(pdf_bytes)
         
@@ -38,6 +91,7 @@ def handle_uploaded_invoice(pdf_file: io.BytesIO) -> str:
         print("Enviando texto para a IA (Gemini)...")
         nf_data = pdf_processor.get_invoice_data_with_gemini(pdf_text)
         print(f"IA retornou: {nf_data}")
+        profiler.tag_current_run(nf_data.get('numero_nf'))
 
         # Passo 3: Validar 'numero_pedido' da IA
         numero_pedido_extraido = nf_data.get('numero_pedido')
@@ -52,22 +106,52 @@ def handle_uploaded_invoice(pdf_file: io.BytesIO) -> str:
         if not pedido_data:
             return f"Erro: O Pedido '{numero_pedido_extraido}' foi encontrado na NF, mas não existe em nosso banco de dados 'Controle de Pedidos'."
 
-        # Passo 6: Gerar token de validação único
+        # Avalia as regras de aprovação automática (ver auto_approval.py)
+        auto_aprovar, resultados_regras = auto_approval.evaluate(nf_data, pedido_data)
+
+        # Passo 6: Gerar identificador único do processamento
         token = str(uuid.uuid4())
         print(f"Gerado token de validação: {token}")
 
         # Passo 7: Salvar o estado 'PENDING_VALIDATION' no banco
         # (pedido_data é um sqlite3.Row, acessamos o 'pedido_id' por chave)
-        db_manager.create_processing_entry(nf_data, pedido_data['pedido_id'], token)
-
-        # Passo 8: Enviar e-mail de validação para o solicitante
+        processing_id = db_manager.create_processing_entry(
+            nf_data, pedido_data['pedido_id'], token, pdf_hash=pdf_hash, pdf_text=pdf_text
+        )
+        if processing_id is None:
+            return "Erro: Não foi possível registrar a NF no banco de dados."
+
+        # Saldo do pedido já considerando esta NF (faturamento parcial)
+        saldo_pedido = db_manager.get_order_balance(pedido_data['pedido_id'])
+        if saldo_pedido and saldo_pedido['sobrefaturado']:
+            print(f"ATENÇÃO: Pedido '{pedido_data['numero_pedido']}' sobrefaturado "
+                  f"(faturado {saldo_pedido['valor_faturado']:.2f} de {saldo_pedido['valor_pedido']:.2f}).")
+            if auto_aprovar:
+                # Sobrefaturamento sempre exige a validação do solicitante
+                auto_aprovar = False
+                resultados_regras.append(('saldo_pedido', False, "Pedido sobrefaturado; validação manual exigida."))
+        db_manager.record_rule_evaluations(processing_id, resultados_regras)
+
+        # Passo 8a: Aprovação automática, sem esperar o clique do solicitante
+        if auto_aprovar:
+            print("NF aprovada pelas regras de aprovação automática.")
+            data_for_email = db_manager.transition_status(processing_id, nf_status.APPROVED, origem='regras')
+            if data_for_email:
+                _notify_finance(data_for_email, nf_status.APPROVED, auto_approved=True)
+                return f"Sucesso! NF {nf_data.get('numero_nf')} aprovada automaticamente pelas regras. O financeiro foi notificado."
+
+        # Passo 8b: Gerar os links assinados e enviar o e-mail de validação
+        # Os tokens embutem o id, a ação e a expiração, e são verificados
+        # por HMAC antes de qualquer acesso ao banco.
         print(f"Enviando e-mail de validação para {pedido_data['solicitante_email']}...")
         email_manager.send_validation_email(
             solicitante_email=pedido_data['solicitante_email'],
             solicitante_nome=pedido_data['solicitante_nome'],
             nf_data=nf_data,
             pedido_data=pedido_data,
-            validation_token=token
+            saldo_pedido=saldo_pedido,
+            approve_token=validation_tokens.generate_token(processing_id, 'approve'),
+            reject_token=validation_tokens.generate_token(processing_id, 'reject')
         )
         
         # Sucesso!
@@ -78,65 +162,67 @@ def handle_uploaded_invoice(pdf_file: io.BytesIO) -> str:
         print(f"ERRO GERAL NO FLUXO: {e}")
         return f"Ocorreu um erro inesperado: {e}"
 
-def handle_validation_response(token: str, action: str) -> str:
+def handle_validation_response(token: str, action: str, profile: bool = None) -> str:
+    """
+    Processa o clique em um link de validação (ver _process_validation_response).
+    A execução pode ser perfilada como em handle_uploaded_invoice.
+    """
+    if not profiler.should_profile(profile):
+        return _process_validation_response(token, action)
+    with profiler.capture("validacao"):
+        return _process_validation_response(token, action)
+
+def _process_validation_response(token: str, action: str) -> str:
     """
     Orquestra o fluxo de resposta de uma validação (clique no e-mail).
 
     1. Determina o novo status ('APPROVED' ou 'REJECTED').
-    2. Tenta atualizar o status no banco de dados (só funciona se estiver 'PENDING').
-    3. Se a atualização falhar, informa que o link é inválido/expirado.
-    4. Se for bem-sucedido, busca todos os dados da NF e do Pedido.
-    5. Envia o e-mail de status final para o setor financeiro.
+    2. Verifica a assinatura, a ação e a validade do token (sem acessar o banco).
+    3. Executa a transição de status (nf_status), que numa única transação
+       atualiza o status, grava o histórico e devolve os dados da NF e do Pedido.
+       Se a verificação ou a transição falhar, informa que o link é inválido/expirado.
+    4. Envia o e-mail de status final para o setor financeiro.
 
     Retorna uma string de status para a UI do Streamlit.
     """
     
     try:
-        print(f"Processando resposta: token={token}, action={action}")
+        print(f"Processando resposta: action={action}")
         
         # Passo 1: Determinar novo status
-        if action not in ['approve', 'reject']:
+        if action not in nf_status.ACTION_TO_STATUS:
             return "Ação desconhecida."
             
-        new_status = 'APPROVED' if action == 'approve' else 'REJECTED'
-
-        # Passo 2: Tentar atualizar o status no banco
-        # Esta função (update_processing_status_by_token) só deve atualizar
-        # se o status atual for 'PENDING_VALIDATION'.
-        print(f"Atualizando status para {new_status} para o token {token}...")
-        update_success = db_manager.update_processing_status_by_token(token, new_status)
-
-        # Passo 3: Lidar com token inválido ou já processado
-        if not update_success:
-            print("Atualização falhou. Token inválido, expirado ou já utilizado.")
+        new_status = nf_status.ACTION_TO_STATUS[action]
+
+        # Passo 2: Verificar o token assinado antes de tocar no banco.
+        # Links forjados, adulterados ou expirados (inclusive de scanners
+        # de segurança de e-mail) são rejeitados aqui.
+        try:
+            processing_id = validation_tokens.verify_token(token, action)
+        except validation_tokens.InvalidTokenError as e:
+            print(f"Token rejeitado: {e}")
             return "Este link de validação é inválido ou já foi processado."
 
-        # Passo 4: Buscar todos os dados para o e-mail do financeiro
-        print("Coletando dados para enviar ao financeiro...")
-        # Esta função (get_data_for_finance_email) retorna um único
-        # objeto sqlite3.Row com todos os dados da NF e do Pedido.
-        data_for_email = db_manager.get_data_for_finance_email(token)
-        
+        # Passo 3: Executar a transição pela chave primária.
+        # Só tem efeito se o status atual permitir a transição (ex: 'PENDING_VALIDATION').
+        # Retorna um único sqlite3.Row com todos os dados da NF e do Pedido.
+        print(f"Atualizando status para {new_status} para o processamento {processing_id}...")
+        data_for_email = db_manager.transition_status(processing_id, new_status, origem='link')
+
+        # Lidar com processamento inexistente ou já processado
         if not data_for_email:
-             # Isso não deve acontecer se o passo 2 foi bem-sucedido, mas é uma boa checagem.
-             print(f"ERRO CRÍTICO: Status atualizado, mas dados não encontrados para o token {token}")
-             return "Erro ao buscar dados. Contate o administrador."
+            print("Transição falhou. Token inválido, expirado ou já utilizado.")
+            return "Este link de validação é inválido ou já foi processado."
+        profiler.tag_current_run(data_for_email['numero_nf'])
 
-        # Passo 5: Enviar e-mail de status final para o financeiro
+        # Passo 4: Enviar e-mail de status final para o financeiro
         print(f"Enviando e-mail para o setor financeiro com status: {new_status}")
         
-        # O `email_manager.send_finance_email` espera `nf_data` e `pedido_data`.
-        # Como `data_for_email` (um sqlite3.Row) contém todas as chaves
-        # de ambos (ex: 'numero_nf', 'numero_pedido', etc.), podemos
-        # passar o mesmo objeto para ambos os argumentos.
-        email_manager.send_finance_email(
-            nf_data=data_for_email, 
-            pedido_data=data_for_email, 
-            status=new_status
-        )
+        _notify_finance(data_for_email, new_status)
         
         # Sucesso!
-        if new_status == 'APPROVED':
+        if new_status == nf_status.APPROVED:
             return "Obrigado! O pagamento foi APROVADO e o financeiro foi notificado."
         else:
             return "Confirmação recebida. O pagamento foi REJEITADO e o financeiro foi notificado."